@@ -0,0 +1,280 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+import pandas as pd
+
+from construct_basic_data import build_daily_bars, load_stock_data, resample_to_daily
+from construct_filtered_stocks import (
+    create_filtered_by_vol_and_amount, create_higher, create_new_high, create_top_ret,
+    criterion_to_list, filter_stocks_by_trading_days, mask_to_list, process_filtered_stocks
+    )
+from main_backtest import backtest, backtest_metrics, summarize_backtest
+from trading_calendar import CACHE_DIR, get_sessions
+
+BENCH_DATA_DIR = CACHE_DIR / 'bench'
+BENCH_START_DATE = '2022-01-03'
+# (stocks, trading days, missing-bar rate)
+SCALES = {
+    'small': (20, 120, 0.02),
+    'medium': (100, 250, 0.02),
+    'large': (300, 500, 0.02),
+}
+
+# --- synthetic data ------------------------------------------------------------------
+
+def synthetic_sessions(n_days: int) -> pd.DatetimeIndex:
+    """The first n_days XTAI sessions from BENCH_START_DATE."""
+    start = pd.Timestamp(BENCH_START_DATE)
+    return get_sessions(start, start + pd.Timedelta(days=2 * n_days + 30))[:n_days]
+
+def generate_minute_bars(
+        stock_code: str,
+        sessions: pd.DatetimeIndex,
+        missing_rate: float = 0.02,
+        seed: int = 0
+    ) -> pd.DataFrame:
+    """Deterministic XTAI-like 09:01-13:30 minute bars of one stock, indexed by ts.
+
+    Prices follow a random walk with a daily drift, volume has a per-day level, and
+    missing_rate of the bars plus about 1% of whole days are dropped.
+    """
+    rng = np.random.default_rng([seed, int(stock_code)])
+    minutes = pd.timedelta_range('09:01:00', '13:30:00', freq='min')
+    n_days, n_minutes = len(sessions), len(minutes)
+    ts = (sessions.values[:, None] + minutes.values[None, :]).ravel()
+    n = len(ts)
+
+    day_level = np.repeat(np.exp(rng.standard_normal(n_days) * 0.9), n_minutes)
+    drift = np.repeat(rng.standard_normal(n_days) * 0.01, n_minutes)
+    close = 100 * np.exp(np.cumsum(rng.standard_normal(n) * 0.002 + drift / n_minutes * 3))
+    open_ = close * np.exp(rng.standard_normal(n) * 0.001)
+    high = np.maximum(open_, close) * (1 + np.abs(rng.standard_normal(n)) * 0.001)
+    low = np.minimum(open_, close) * (1 - np.abs(rng.standard_normal(n)) * 0.001)
+    volume = (rng.poisson(50, n) * day_level).astype('int64')
+
+    keep = rng.random(n) >= missing_rate
+    keep &= ~np.repeat(rng.random(n_days) < 0.01, n_minutes)
+    return pd.DataFrame(
+        {
+            'Open': open_[keep].round(2),
+            'High': high[keep].round(2),
+            'Low': low[keep].round(2),
+            'Close': close[keep].round(2),
+            'Volume': volume[keep],
+            'Amount': (close * volume * 1000)[keep].round(0),
+        },
+        index=pd.DatetimeIndex(ts[keep], name='ts')
+        )
+
+def write_synthetic_csvs(
+        folder: Path,
+        n_stocks: int,
+        n_days: int,
+        missing_rate: float = 0.02,
+        seed: int = 0
+    ) -> List[Path]:
+    """Write one k_data-style CSV per stock; existing files of the same spec are reused."""
+    folder.mkdir(parents=True, exist_ok=True)
+    sessions = synthetic_sessions(n_days)
+    csv_files = []
+    for i in range(n_stocks):
+        csv_file = folder / f'{1101 + i}.csv'
+        if not csv_file.exists():
+            tmp_file = csv_file.with_suffix(f'.{os.getpid()}.tmp')
+            generate_minute_bars(csv_file.stem, sessions, missing_rate, seed).to_csv(tmp_file)
+            os.replace(tmp_file, csv_file)
+        csv_files.append(csv_file)
+    return csv_files
+
+# --- measurement ---------------------------------------------------------------------
+
+def measure(func: Callable, repeat: int = 3) -> Tuple[object, float, float]:
+    """(result, best wall time in s, peak traced memory in MB) of func().
+
+    Timing runs are done without tracemalloc; one extra traced run gives the peak.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        gc.collect()
+        start_time = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start_time)
+    del result
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, best, peak / 1024 ** 2
+
+def run_scale(
+        n_stocks: int,
+        n_days: int,
+        missing_rate: float,
+        seed: int = 0,
+        repeat: int = 3
+    ) -> Dict[str, dict]:
+    """Time every stage on one synthetic data set; returns {stage: measurements}."""
+    data_folder = BENCH_DATA_DIR / f'{n_stocks}x{n_days}-{missing_rate}-{seed}'
+    csv_files = write_synthetic_csvs(data_folder, n_stocks, n_days, missing_rate, seed)
+    sessions = synthetic_sessions(n_days)
+    start_date, end_date = sessions[0].strftime('%Y-%m-%d'), sessions[-1].strftime('%Y-%m-%d')
+    # 前 20 天作為暖身, 之後才回測
+    backtest_start = sessions[min(20, n_days - 1)].to_pydatetime()
+    top_n = max(1, n_stocks // 5)
+
+    results = {}
+    def record(stage: str, func: Callable, items: Callable[[object], int], unit: str):
+        result, seconds, peak_mb = measure(func, repeat)
+        n_items = int(items(result))
+        results[stage] = {
+            'seconds': seconds,
+            'peak_mb': peak_mb,
+            'items': n_items,
+            'unit': unit,
+            'items_per_s': n_items / seconds if seconds > 0 else None,
+        }
+        print(f'  {stage:<36}{seconds:>10.4f} s{peak_mb:>10.1f} MB{n_items:>12} {unit}')
+        return result
+
+    minute_frames = record(
+        'load_stock_data',
+        lambda: [load_stock_data(f.stem, f, use_cache=False) for f in csv_files],
+        lambda frames: sum(len(df) for df in frames), 'rows'
+    )
+    for f in csv_files:
+        load_stock_data(f.stem, f)  # 先建好快取, 只量讀取快取的時間
+    record(
+        'load_stock_data (cached)',
+        lambda: [load_stock_data(f.stem, f) for f in csv_files],
+        lambda frames: sum(len(df) for df in frames), 'rows'
+    )
+    record(
+        'resample_to_daily',
+        lambda: [resample_to_daily(f.stem, df, start_date, end_date) for f, df in zip(csv_files, minute_frames)],
+        lambda frames: len(frames), 'stocks'
+    )
+    all_stocks = pd.concat(
+        {f.stem: df for f, df in zip(csv_files, minute_frames)}, names=['stock_code']
+        ).sort_index()
+    all_stocks_daily = record(
+        'build_daily_bars',
+        lambda: build_daily_bars(all_stocks, start_date, end_date),
+        lambda daily: len(all_stocks), 'rows'
+    )
+    stocks_df = record(
+        'filter_stocks_by_trading_days',
+        lambda: filter_stocks_by_trading_days(all_stocks_daily, start_date, end_date),
+        lambda panel: panel.size, 'cells'
+    )
+    criteria = [
+        record('create_top_ret', lambda: create_top_ret(stocks_df, 3, top_n), lambda c: c.size, 'cells'),
+        record('create_new_high', lambda: create_new_high(stocks_df, 3), lambda c: c.size, 'cells'),
+        record(
+            'create_filtered_by_vol_and_amount',
+            lambda: create_filtered_by_vol_and_amount(stocks_df, 3),
+            lambda c: c.size, 'cells'
+        ),
+        record('create_higher', lambda: create_higher(stocks_df, 0.001), lambda c: c.size, 'cells'),
+    ]
+    filtered_stocks_list = record(
+        'criterion_to_list',
+        lambda: criterion_to_list(stocks_df, *criteria),
+        lambda fl: fl['stock_list'].apply(len).sum(), 'trades'
+    )
+    filtered_stocks_data = record(
+        'process_filtered_stocks',
+        lambda: process_filtered_stocks(filtered_stocks_list, all_stocks),
+        lambda fd: len(fd), 'rows'
+    )
+    ret_per_trade = record(
+        'backtest',
+        lambda: backtest(filtered_stocks_list, filtered_stocks_data, backtest_start, sessions[-1].to_pydatetime()),
+        lambda ret: len(ret), 'trades'
+    )
+    record(
+        'sr8 metrics',
+        lambda: backtest_metrics(summarize_backtest(ret_per_trade)),
+        lambda metrics: len(ret_per_trade), 'trades'
+    )
+
+    # 選股條件在合成資料上選出的交易很少, 另外以每個有資料的 (day, stock) 壓測回測
+    present = stocks_df.xs('Close', axis=1, level=1).notna()
+    all_pairs_list = mask_to_list(present.to_numpy(), stocks_df.index, present.columns)
+    all_pairs_data = process_filtered_stocks(all_pairs_list, all_stocks)
+    record(
+        'backtest (every stock-day)',
+        lambda: backtest(all_pairs_list, all_pairs_data, backtest_start, sessions[-1].to_pydatetime()),
+        lambda ret: len(ret), 'trades'
+    )
+    return results
+
+def run_benchmarks(scales: List[str], seed: int = 0, repeat: int = 3) -> dict:
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'cpu_count': os.cpu_count(),
+        },
+        'seed': seed,
+        'scales': {},
+    }
+    for name in scales:
+        n_stocks, n_days, missing_rate = SCALES[name]
+        print(f'{name}: {n_stocks} stocks x {n_days} days, missing {missing_rate:.0%}')
+        report['scales'][name] = {
+            'n_stocks': n_stocks,
+            'n_days': n_days,
+            'missing_rate': missing_rate,
+            'stages': run_scale(n_stocks, n_days, missing_rate, seed, repeat),
+        }
+    return report
+
+def compare_reports(baseline: dict, current: dict) -> pd.DataFrame:
+    """Time and peak-memory ratios (current / baseline) of the stages both reports share."""
+    rows = []
+    for scale, scale_report in current['scales'].items():
+        base_stages = baseline['scales'].get(scale, {}).get('stages', {})
+        for stage, measured in scale_report['stages'].items():
+            if stage not in base_stages:
+                continue
+            rows.append({
+                'scale': scale,
+                'stage': stage,
+                'baseline s': base_stages[stage]['seconds'],
+                'current s': measured['seconds'],
+                'time ratio': measured['seconds'] / base_stages[stage]['seconds'],
+                'memory ratio': measured['peak_mb'] / base_stages[stage]['peak_mb'] if base_stages[stage]['peak_mb'] else np.nan,
+            })
+    return pd.DataFrame(rows)
+
+
+#%%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark every pipeline stage on synthetic minute bars.')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=list(SCALES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', type=Path, help='write the report as JSON (e.g. a new baseline)')
+    parser.add_argument('--baseline', type=Path, help='compare against an earlier JSON report')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.scales, args.seed, args.repeat)
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.baseline is not None:
+        comparison = compare_reports(json.loads(args.baseline.read_text()), report)
+        print(comparison.to_string(index=False, float_format='{:.3f}'.format))
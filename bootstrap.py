@@ -0,0 +1,159 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+
+import sr8_performance as sr8
+
+# 每個 chunk 用自己的 SeedSequence 子種子, 結果與 worker 數量無關
+RESAMPLES_PER_CHUNK = 500
+
+def bootstrap_indices(
+        n: int,
+        n_resamples: int,
+        block_size: Optional[int] = None,
+        rng: Optional[np.random.Generator] = None
+    ) -> np.ndarray:
+    """(n, n_resamples) matrix of resampled positions, one column per resample.
+
+    block_size=None draws positions i.i.d.; otherwise circular blocks of block_size
+    consecutive positions are concatenated, which keeps short-range autocorrelation.
+    """
+    rng = rng or np.random.default_rng()
+    if not block_size or block_size <= 1:
+        return rng.integers(0, n, size=(n, n_resamples))
+    n_blocks = -(-n // block_size)
+    starts = rng.integers(0, n, size=(n_blocks, 1, n_resamples))
+    offsets = np.arange(block_size)[None, :, None]
+    return ((starts + offsets) % n).reshape(n_blocks * block_size, n_resamples)[:n]
+
+def _tradely_stats(values: np.ndarray, idx: np.ndarray) -> Dict[str, np.ndarray]:
+    return sr8.batch_single_metrics(values[idx])
+
+def _equity_stats(values: np.ndarray, idx: np.ndarray, total_investment: float) -> Dict[str, np.ndarray]:
+    # values 是每日損益; 重抽後依序累加成權益曲線
+    equity = np.cumsum(values[idx], axis=0) + total_investment
+    return sr8.batch_equity_metrics(total_investment, equity)
+
+# statistic -> (函式, 是否需要 total_investment)
+STATISTICS: Dict[str, Tuple[Callable, bool]] = {
+    'single': (_tradely_stats, False),
+    'equity': (_equity_stats, True),
+}
+
+def _run_chunk(args: tuple) -> Dict[str, np.ndarray]:
+    statistic, values, total_investment, n_resamples, block_size, seed_seq = args
+    idx = bootstrap_indices(len(values), n_resamples, block_size, np.random.default_rng(seed_seq))
+    func, uses_investment = STATISTICS[statistic]
+    return func(values, idx, total_investment) if uses_investment else func(values, idx)
+
+def bootstrap_distribution(
+        statistic: str,
+        values: np.ndarray,
+        total_investment: float = 0.0,
+        n_resamples: int = 2000,
+        block_size: Optional[int] = None,
+        seed: int = 0,
+        max_workers: Optional[int] = 1
+    ) -> Dict[str, np.ndarray]:
+    """Every metric of `statistic` ('single' or 'equity') on n_resamples resamples of values.
+
+    Resamples are drawn in chunks of RESAMPLES_PER_CHUNK index columns and scored with
+    the batch metrics of sr8_performance; max_workers != 1 scores chunks in a process pool.
+    """
+    if n_resamples < 1:
+        raise ValueError(f'n_resamples must be at least 1, got {n_resamples}')
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        raise ValueError('cannot bootstrap an empty series')
+    chunk_sizes = [RESAMPLES_PER_CHUNK] * (n_resamples // RESAMPLES_PER_CHUNK)
+    if n_resamples % RESAMPLES_PER_CHUNK:
+        chunk_sizes.append(n_resamples % RESAMPLES_PER_CHUNK)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    tasks = [
+        (statistic, values, total_investment, size, block_size, seed_seq)
+        for size, seed_seq in zip(chunk_sizes, seeds)
+        ]
+
+    if max_workers == 1 or len(tasks) <= 1:
+        chunks = [_run_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            chunks = list(executor.map(_run_chunk, tasks))
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+def confidence_intervals(
+        distribution: Dict[str, np.ndarray],
+        ci: float = 0.95
+    ) -> Dict[str, Tuple[float, float]]:
+    """Percentile interval of each metric, ignoring NaN resamples (e.g. no losing trade)."""
+    low_q, high_q = (1 - ci) / 2, 1 - (1 - ci) / 2
+    intervals = {}
+    for key, samples in distribution.items():
+        samples = np.asarray(samples, dtype=float)
+        samples = samples[np.isfinite(samples)]
+        if len(samples) == 0:
+            intervals[key] = (np.nan, np.nan)
+        else:
+            low, high = np.quantile(samples, [low_q, high_q])
+            intervals[key] = (float(low), float(high))
+    return intervals
+
+def with_confidence_intervals(
+        metrics: dict,
+        intervals: Dict[str, Tuple[float, float]],
+        ci: float = 0.95
+    ) -> dict:
+    """Metric dict with each value followed by its CI bounds, ready for sr8.print_dict."""
+    low_label, high_label = f'{(1 - ci) / 2:.1%}', f'{1 - (1 - ci) / 2:.1%}'
+    result = {}
+    for key, value in metrics.items():
+        result[key] = value
+        if key in intervals and key not in ('Trade times', 'Total investment'):
+            result[f'  {key} {low_label}'] = intervals[key][0]
+            result[f'  {key} {high_label}'] = intervals[key][1]
+    return result
+
+def series_confidence_intervals(
+        ror_per_trade: np.ndarray,
+        ror_per_day: np.ndarray,
+        ret_per_day: np.ndarray,
+        total_investment: float,
+        n_resamples: int = 2000,
+        block_size: Optional[int] = 5,
+        ci: float = 0.95,
+        seed: int = 0,
+        max_workers: Optional[int] = 1
+    ) -> Tuple[dict, dict, dict]:
+    """(tradely, daily, equity) CIs from the return series of one backtest.
+
+    Trades are resampled i.i.d.; daily series use a block bootstrap of block_size
+    sessions. Equity curves are rebuilt from the resampled daily P&L (ret_per_day).
+    """
+    tradely = bootstrap_distribution(
+        'single', ror_per_trade, n_resamples=n_resamples, seed=seed, max_workers=max_workers
+    )
+    daily = bootstrap_distribution(
+        'single', ror_per_day, n_resamples=n_resamples,
+        block_size=block_size, seed=seed + 1, max_workers=max_workers
+    )
+    equity = bootstrap_distribution(
+        'equity', ret_per_day, total_investment, n_resamples=n_resamples,
+        block_size=block_size, seed=seed + 2, max_workers=max_workers
+    )
+    return (
+        confidence_intervals(tradely, ci),
+        confidence_intervals(daily, ci),
+        confidence_intervals(equity, ci),
+    )
+
+def backtest_confidence_intervals(summary: dict, **kwargs) -> Tuple[dict, dict, dict]:
+    """series_confidence_intervals of a summarize_backtest result."""
+    if summary['ror_per_trade'].empty:
+        return {}, {}, {}
+    return series_confidence_intervals(
+        summary['ror_per_trade'].to_numpy(),
+        summary['ror_per_day'].to_numpy(),
+        summary['ret_per_day'].to_numpy(),
+        summary['total_investment'],
+        **kwargs
+    )
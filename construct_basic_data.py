@@ -1,28 +1,131 @@
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 from pathlib import Path
-from typing import Tuple
-import pandas_market_calendars as mcal
+from typing import Optional, Tuple
+
+from instrumentation import count, instrumented
+from trading_calendar import CACHE_DIR, get_session_ids, get_session_labels, get_sessions
+
+CSV_DTYPES = {
+    'Open': 'float64',
+    'High': 'float64',
+    'Low': 'float64',
+    'Close': 'float64',
+    'Volume': 'int64',
+    'Amount': 'float64'
+}
+DAILY_AGG = {
+    'Open': 'first',
+    'High': 'max',
+    'Low': 'min',
+    'Close': 'last',
+    'Volume': 'sum',
+    'Amount': 'sum'
+}
+# 放在 minute store 目錄內, '_' 開頭會被 parquet dataset 讀取略過
+INGEST_STATE_FILE = '_ingest_state.parquet'
+# minute store 以 month=YYYY-MM 分區, 每個檔案內每檔股票一個 row group
+MONTH_PARTITIONING = ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive')
+# 原始 CSV 轉成的 Arrow 檔, ts 存成 int64 timestamp, 不用再解析文字
+CSV_CACHE_DIR = CACHE_DIR / 'k_data'
+
+def _csv_cache_path(file_path: Path) -> Path:
+    # 不同資料夾的同名 CSV 分開存
+    folder_key = hashlib.sha1(str(file_path.resolve().parent).encode('utf-8')).hexdigest()[:12]
+    return CSV_CACHE_DIR / folder_key / f'{file_path.stem}.arrow'
+
+def read_csv_cache(file_path: Path, stat: os.stat_result) -> Optional[pd.DataFrame]:
+    """Return the cached frame of a CSV, or None if missing or stale (mtime/size changed)."""
+    cache_path = _csv_cache_path(file_path)
+    if not cache_path.exists():
+        return None
+    table = feather.read_table(cache_path, memory_map=True)
+    metadata = table.schema.metadata or {}
+    if (metadata.get(b'source_mtime_ns') != str(stat.st_mtime_ns).encode()
+            or metadata.get(b'source_size') != str(stat.st_size).encode()):
+        return None
+    stock_df = table.to_pandas()
+    stock_df.set_index('ts', inplace=True)
+    return stock_df
+
+def write_csv_cache(file_path: Path, stock_df: pd.DataFrame, stat: os.stat_result) -> None:
+    """Store a parsed CSV as an uncompressed Arrow file tagged with the source mtime and size."""
+    cache_path = _csv_cache_path(file_path)
+    table = pa.Table.from_pandas(stock_df.reset_index(), preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        'source_mtime_ns': str(stat.st_mtime_ns),
+        'source_size': str(stat.st_size)
+        })
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # read-only cache dir: fall back to parsing every time
 
 def load_stock_data(
         stock_code: str, 
         file_path: Path, 
+        use_cache: bool = True
         ) -> pd.DataFrame:
-    """Read and resample stock data from CSV."""
+    """Read stock data from CSV, through the binary cache unless use_cache=False."""
+    # stat 先取, 讀取途中檔案若被改寫, 下次 mtime 不同就會重新解析
+    stat = file_path.stat()
+    if use_cache:
+        stock_df = read_csv_cache(file_path, stat)
+        if stock_df is not None:
+            return stock_df
+
     stock_df = pd.read_csv(
         file_path,
         parse_dates=['ts'],
-        dtype={
-            'Open': 'float64',
-            'High': 'float64',
-            'Low': 'float64',
-            'Close': 'float64',
-            'Volume': 'int64',
-            'Amount': 'float64'
-        }
+        dtype=CSV_DTYPES
     )
     stock_df.set_index('ts', inplace=True)
+    if use_cache:
+        write_csv_cache(file_path, stock_df, stat)
     return stock_df
+
+def load_new_stock_data(
+        stock_code: str,
+        file_path: Path,
+        offset: int,
+        last_ts: pd.Timestamp
+        ) -> pd.DataFrame:
+    """Parse only the rows appended to a CSV after byte `offset` and newer than `last_ts`."""
+    with open(file_path, 'rb') as f:
+        columns = f.readline().decode('utf-8').strip().split(',')
+        if offset > f.tell():
+            f.seek(offset - 1)
+            # offset 不在行首時跳過殘行
+            if f.read(1) != b'\n':
+                f.readline()
+        try:
+            stock_df = pd.read_csv(
+                f,
+                header=None,
+                names=columns,
+                parse_dates=['ts'],
+                dtype=CSV_DTYPES
+            )
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame(columns=columns).set_index('ts')
+    stock_df.set_index('ts', inplace=True)
+    if not pd.isna(last_ts):
+        stock_df = stock_df[stock_df.index > last_ts]
+    return stock_df
+
 def resample_to_daily(
         stock_code: str,
         stock_df: pd.DataFrame,
@@ -30,21 +133,11 @@ def resample_to_daily(
         end_date: str
         ) -> pd.DataFrame:
     # Resample to daily frequency and aggregate
-    stock_df = stock_df.resample('D').agg({
-        'Open': 'first',
-        'High': 'max',
-        'Low': 'min',
-        'Close': 'last',
-        'Volume': 'sum',
-        'Amount': 'sum'
-    })
+    stock_df = stock_df.resample('D').agg(DAILY_AGG)
     
     # Fill missing dates between start_date and end_date with NaN
-    trading_days = mcal.get_calendar('XTAI').schedule(
-        start_date=start_date, 
-        end_date=end_date
-        ).index.strftime('%Y-%m-%d')
-    stock_df = stock_df.reindex(trading_days)
+    stock_df = stock_df.reindex(get_sessions(start_date, end_date))
+    stock_df.index = get_session_labels(start_date, end_date)
     stock_df = stock_df.where(stock_df.notna().all(axis=1))
     # Add stock_code as a level in the column index
     stock_df['stock_code'] = stock_code
@@ -52,59 +145,365 @@ def resample_to_daily(
     stock_df = stock_df.reorder_levels(['stock_code', stock_df.index.names[0]])
     return stock_df
 
+def aggregate_daily_arrays(
+        stock_ids: np.ndarray,
+        ts: np.ndarray,
+        values: np.ndarray,
+        n_stocks: int,
+        sessions: pd.DatetimeIndex
+        ) -> np.ndarray:
+    """Aggregate minute bars of many stocks into a (stock, session, field) daily grid.
+
+    Inputs must be sorted by (stock_ids, ts); `values` holds the DAILY_AGG columns in
+    order. Bars are built in one pass over contiguous (stock, session) runs, and a bar
+    with any NaN field is NaN as a whole, like resample_to_daily.
+    """
+    n_sessions = len(sessions)
+    daily = np.full((n_stocks * n_sessions, len(DAILY_AGG)), np.nan)
+    if n_sessions == 0 or len(ts) == 0:
+        return daily.reshape(n_stocks, n_sessions, len(DAILY_AGG))
+
+    # 非交易日或超出區間的分鐘資料直接丟掉
+    days = ts.astype('datetime64[D]')
+    session_days = sessions.to_numpy().astype('datetime64[D]')
+    session_pos = np.searchsorted(session_days, days)
+    in_session = session_days[np.minimum(session_pos, n_sessions - 1)] == days
+    keys = stock_ids[in_session] * n_sessions + session_pos[in_session]
+    values = values[in_session]
+    if len(keys) == 0:
+        return daily.reshape(n_stocks, n_sessions, len(DAILY_AGG))
+
+    starts = np.r_[0, np.flatnonzero(np.diff(keys)) + 1]
+    group_keys = keys[starts]
+    for j, how in enumerate(DAILY_AGG.values()):
+        column = values[:, j]
+        if how in ('first', 'last'):
+            valid = ~np.isnan(column)
+            valid_keys = keys[valid]
+            if len(valid_keys) == 0:
+                continue
+            change = np.flatnonzero(np.diff(valid_keys))
+            pick = np.r_[0, change + 1] if how == 'first' else np.r_[change, len(valid_keys) - 1]
+            daily[valid_keys[pick], j] = column[valid][pick]
+        elif how == 'max':
+            daily[group_keys, j] = np.fmax.reduceat(column, starts)
+        elif how == 'min':
+            daily[group_keys, j] = np.fmin.reduceat(column, starts)
+        else:
+            daily[group_keys, j] = np.add.reduceat(np.nan_to_num(column), starts)
+    daily[np.isnan(daily).any(axis=1)] = np.nan
+    return daily.reshape(n_stocks, n_sessions, len(DAILY_AGG))
+
+@instrumented()
+def build_daily_bars(
+        all_stocks: pd.DataFrame,
+        start_date: str,
+        end_date: str,
+        dense: bool = True
+        ) -> pd.DataFrame:
+    """Daily OHLCVA of every stock in a (stock_code, ts) minute frame in one batched pass.
+
+    dense=True returns the full stock x session grid (NaN rows for missing sessions),
+    matching the concatenated resample_to_daily output; dense=False keeps only the
+    (stock_code, day) rows that have a bar.
+    """
+    if not all_stocks.index.is_monotonic_increasing:
+        all_stocks = all_stocks.sort_index()
+    sessions = get_sessions(start_date, end_date)
+    labels = get_session_labels(start_date, end_date)
+
+    # 已排序, 股票代碼連續出現, 以變化點編號
+    codes = all_stocks.index.codes[0]
+    stock_starts = np.r_[0, np.flatnonzero(codes[1:] != codes[:-1]) + 1] if len(codes) else np.array([], dtype=int)
+    stock_ids = np.zeros(len(codes), dtype=np.int64)
+    stock_ids[stock_starts[1:]] = 1
+    stock_ids = np.cumsum(stock_ids)
+    stock_codes = all_stocks.index.levels[0][codes[stock_starts]]
+
+    daily = aggregate_daily_arrays(
+        stock_ids,
+        all_stocks.index.get_level_values(1).to_numpy(),
+        all_stocks[list(DAILY_AGG)].to_numpy(dtype='float64'),
+        len(stock_codes),
+        sessions
+        ).reshape(-1, len(DAILY_AGG))
+    index = pd.MultiIndex.from_product([stock_codes, labels], names=[all_stocks.index.names[0], None])
+    all_stocks_daily = pd.DataFrame(daily, index=index, columns=list(DAILY_AGG))
+    if not dense:
+        all_stocks_daily = all_stocks_daily[~np.isnan(daily[:, 0])]
+    return all_stocks_daily
+
+def process_stock(csv_file: Path) -> pd.DataFrame:
+    """Load one CSV and return its minute frame indexed by (stock_code, ts)."""
+    stock_code = csv_file.stem  # Use file stem as the stock code
+    stock_df = load_stock_data(stock_code, csv_file)
+    stock_df['stock_code'] = stock_code
+    stock_df.set_index('stock_code', append=True, inplace=True)
+    stock_df = stock_df.reorder_levels(['stock_code', stock_df.index.names[0]])
+    return stock_df
+
+@instrumented()
 def combine_stock_data(
-        data_folder: Path, start_date: str, end_date: str
+        data_folder: Path, start_date: str, end_date: str,
+        max_workers: Optional[int] = 1
         ) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    """Combine multiple stock data CSVs into a single DataFrame with MultiIndex columns."""
+    """Combine multiple stock data CSVs into a single DataFrame with MultiIndex columns.
+
+    max_workers=1 runs serially; any other value (None = os.cpu_count()) parses the
+    CSVs in a process pool, since read_csv holds the GIL.
+    """
+    csv_files = sorted(data_folder.glob('*.csv'))
 
-    all_stocks_daily = []
     all_stocks = []
+
+    if max_workers == 1:
+        results = map(process_stock, csv_files)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        # 小 chunk 讓大檔與小檔平均分散到各 worker
+        chunksize = max(1, len(csv_files) // ((max_workers or os.cpu_count()) * 8))
+        results = executor.map(process_stock, csv_files, chunksize=chunksize)
+
+    try:
+        for csv_file, stock_df in zip(csv_files, results):
+            all_stocks.append(stock_df)
+            count('files parsed')
+            count('rows read', len(stock_df))
+            print(f"Processing stock_code: {csv_file.stem}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    all_stocks = pd.concat(all_stocks, axis=0).sort_index()
+    # 日K一次對全部股票彙總, 不再逐檔 resample
+    all_stocks_daily = build_daily_bars(all_stocks, start_date, end_date)
     
-    for csv_file in data_folder.glob('*.csv'):
-        stock_code = csv_file.stem  # Use file stem as the stock code
-        stock_df = load_stock_data(stock_code, csv_file)
-        stock_df_daily = resample_to_daily(stock_code, stock_df, start_date, end_date)
+    return all_stocks, all_stocks_daily
+
+def csv_file_sizes(data_folder: Path) -> pd.Series:
+    """Byte size of every CSV, taken before parsing and used as the append offset."""
+    return pd.Series(
+        {csv_file.stem: csv_file.stat().st_size for csv_file in data_folder.glob('*.csv')},
+        dtype='int64'
+        )
+
+def read_ingest_state(minute_store_path: Path) -> pd.DataFrame:
+    """Per-stock high-water mark: last ingested ts and CSV byte offset."""
+    return pd.read_parquet(minute_store_path / INGEST_STATE_FILE)
+
+def write_minute_partitions(
+        all_stocks: pd.DataFrame,
+        minute_store_path: Path
+        ) -> None:
+    """Append minute rows as a new part under each month=YYYY-MM partition.
+
+    Rows are sorted by (stock_code, ts) and every stock gets its own row group, so a
+    stock_code filter is answered from row-group statistics without decoding others.
+    """
+    months = all_stocks.index.get_level_values(1).values.astype('datetime64[M]')
+    order = np.argsort(months, kind='stable')
+    months = months[order]
+    month_bounds = np.flatnonzero(months[1:] != months[:-1]) + 1
+    for month_rows in np.split(order, month_bounds):
+        month_df = all_stocks.iloc[month_rows].sort_index()
+        month_path = minute_store_path / f"month={month_df.index[0][1].strftime('%Y-%m')}"
+        month_path.mkdir(parents=True, exist_ok=True)
+        part_id = len(list(month_path.glob('part-*.parquet')))
+
+        table = pa.Table.from_pandas(month_df)
+        codes = month_df.index.get_level_values(0)
+        stock_bounds = np.r_[0, np.flatnonzero(codes[1:] != codes[:-1]) + 1, len(codes)]
+        with pq.ParquetWriter(month_path / f'part-{part_id:05d}.parquet', table.schema) as writer:
+            for start, stop in zip(stock_bounds[:-1], stock_bounds[1:]):
+                writer.write_table(table.slice(start, stop - start))
+
+@instrumented()
+def write_minute_store(
+        all_stocks: pd.DataFrame,
+        minute_store_path: Path,
+        file_sizes: pd.Series
+        ) -> None:
+    """Full rebuild: replace the minute store partitions and reset the ingest state."""
+    if minute_store_path.is_file():
+        minute_store_path.unlink()
+    minute_store_path.mkdir(parents=True, exist_ok=True)
+    for old_path in minute_store_path.iterdir():
+        if old_path.is_dir():
+            shutil.rmtree(old_path)
+        else:
+            old_path.unlink()
+    write_minute_partitions(all_stocks, minute_store_path)
+
+    last_ts = pd.Series(
+        all_stocks.index.get_level_values(1),
+        index=all_stocks.index.get_level_values(0)
+        ).groupby(level=0).max()
+    state = pd.DataFrame({'last_ts': last_ts, 'file_size': file_sizes.reindex(last_ts.index)})
+    state.index.name = 'stock_code'
+    state.to_parquet(minute_store_path / INGEST_STATE_FILE)
+
+def open_minute_store(minute_store_path: Path) -> ds.Dataset:
+    """Open the month-partitioned minute store as a lazy pyarrow dataset."""
+    return ds.dataset(minute_store_path, format='parquet', partitioning=MONTH_PARTITIONING)
+
+@instrumented()
+def load_minute_store(minute_store_path: Path) -> pd.DataFrame:
+    """Read the whole minute store, sorted by (stock_code, ts)."""
+    all_stocks = open_minute_store(minute_store_path).to_table().to_pandas()
+    return all_stocks.drop(columns='month').sort_index()
+
+@instrumented()
+def load_selected_stocks(
+        minute_store_path: Path,
+        filtered_stocks_list: pd.DataFrame
+        ) -> pd.DataFrame:
+    """Read only the minute rows of the (day, stock_code) pairs in filtered_stocks_list.
+
+    Month partitions and per-stock row groups that no pair touches are skipped, so
+    memory and I/O scale with the number of selected trades, not the universe.
+    """
+    dataset = open_minute_store(minute_store_path)
+    pairs = filtered_stocks_list['stock_list'].explode().dropna()
+    if pairs.empty:
+        return dataset.schema.empty_table().to_pandas().drop(columns='month')
+
+    days = pd.to_datetime(pairs.index)
+    selection = None
+    for month, codes in pairs.groupby(days.strftime('%Y-%m')):
+        month_selection = (pc.field('month') == month) & pc.field('stock_code').isin(codes.unique().tolist())
+        selection = month_selection if selection is None else selection | month_selection
+    all_stocks = dataset.to_table(filter=selection).to_pandas().drop(columns='month')
+
+    # 同月份同股票的其他日期在這裡去掉
+    pair_index = pd.MultiIndex.from_arrays([pairs.to_numpy(), days])
+    row_index = pd.MultiIndex.from_arrays([
+        all_stocks.index.get_level_values(0),
+        all_stocks.index.get_level_values(1).normalize()
+        ])
+    return all_stocks[row_index.isin(pair_index)].sort_index()
+
+def merge_daily_bars(
+        all_stocks_daily: pd.DataFrame,
+        new_daily: pd.DataFrame
+        ) -> pd.DataFrame:
+    """Fold freshly aggregated bars into the existing ones for the same (stock_code, day).
+
+    Every DAILY_AGG function is associative, so aggregating the old bar followed by the
+    bar built from the newer minutes gives the same result as re-aggregating the full day.
+    """
+    old_daily = all_stocks_daily.reindex(new_daily.index).dropna(how='any')
+    merged = pd.concat([old_daily, new_daily]).groupby(level=[0, 1], sort=False).agg(DAILY_AGG)
+    return merged.reindex(new_daily.index)
+
+@instrumented()
+def update_stock_data(
+        data_folder: Path,
+        minute_store_path: Path,
+        daily_store_path: Path,
+        start_date: str,
+        end_date: str
+        ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Incremental rebuild: append only rows past each stock's high-water mark.
+
+    New minute rows up to end_date are written as extra parts of the minute store, and
+    only the daily bars of the days they touch are recomputed. Returns (new minute rows,
+    daily store).
+    """
+    state = read_ingest_state(minute_store_path)
+    file_sizes = csv_file_sizes(data_folder)
+    all_stocks_daily = pd.read_parquet(daily_store_path)
+
+    new_stocks = []
+    for stock_code, file_size in file_sizes.items():
+        if stock_code in state.index:
+            last_ts, offset = state.loc[stock_code, ['last_ts', 'file_size']]
+        else:
+            last_ts, offset = pd.NaT, 0
+        if file_size == offset:
+            continue
+        if file_size < offset:
+            raise ValueError(
+                f"{stock_code}.csv shrank since the last ingest, run a full rebuild instead"
+                )
+        stock_df = load_new_stock_data(
+            stock_code, data_folder / f'{stock_code}.csv', int(offset), last_ts
+            )
+        # 超過 end_date 的資料先不寫入, offset 不前進, 下次 end_date 更新後再讀
+        in_range = stock_df.index < pd.Timestamp(end_date) + pd.Timedelta(days=1)
+        next_offset = file_size if in_range.all() else offset
+        stock_df = stock_df[in_range]
+        if stock_df.empty:
+            if stock_code in state.index:
+                state.loc[stock_code, 'file_size'] = next_offset
+            continue
+        # 新股票也要先有 file_size (實際使用的 offset), 否則 state 會出現 NaN
+        state.loc[stock_code, 'file_size'] = next_offset
+        state.loc[stock_code, 'last_ts'] = stock_df.index[-1]
+
         stock_df['stock_code'] = stock_code
         stock_df.set_index('stock_code', append=True, inplace=True)
         stock_df = stock_df.reorder_levels(['stock_code', stock_df.index.names[0]])
-        all_stocks.append(stock_df)
-        all_stocks_daily.append(stock_df_daily)
-        print(f"Processing stock_code: {stock_code}")
-    
-    # #############
-    # def process_stock(csv_file):
-    #     stock_code = csv_file.stem  # Use file stem as the stock code
-    #     stock_df = load_stock_data(stock_code, csv_file)
-    #     stock_df_daily = resample_to_daily(stock_code, stock_df, start_date, end_date)
-    #     stock_df['stock_code'] = stock_code
-    #     stock_df.set_index('stock_code', append=True, inplace=True)
-    #     stock_df = stock_df.reorder_levels(['stock_code', stock_df.index.names[0]])
-    #     return stock_df, stock_df_daily
-    
-    # # 使用 ThreadPoolExecutor 進行並行處理
-    # with ThreadPoolExecutor() as executor:
-    #     results = list(executor.map(process_stock, data_folder.glob('*.csv')))
-    
-    # for stock_df, stock_df_daily in results:
-    #     all_stocks.append(stock_df)
-    #     all_stocks_daily.append(stock_df_daily)
-    # #############
+        new_stocks.append(stock_df)
+        print(f"Appending stock_code: {stock_code} ({len(stock_df)} rows)")
+
+    # 先整理好 state, 有問題時還沒寫入任何檔案, minute parts/日K/state 不會不一致
+    state['file_size'] = state['file_size'].astype('int64')
+    state['last_ts'] = pd.to_datetime(state['last_ts'])
+
+    # Extend the daily grid to the current calendar by session id, then overwrite the affected bars
+    daily_index = all_stocks_daily.index
+    stock_codes = daily_index.get_level_values(0).unique().union(state.index)
+    stock_pos = stock_codes.get_indexer(daily_index.levels[0])[daily_index.codes[0]]
+    day_ids = get_session_ids(daily_index.levels[1], start_date, end_date)[daily_index.codes[1]]
+    in_range = day_ids >= 0
+    n_sessions = len(get_sessions(start_date, end_date))
+    daily = np.full((len(stock_codes) * n_sessions, len(all_stocks_daily.columns)), np.nan)
+    daily[stock_pos[in_range] * n_sessions + day_ids[in_range]] = all_stocks_daily.to_numpy(dtype='float64')[in_range]
+    all_stocks_daily = pd.DataFrame(
+        daily,
+        index=pd.MultiIndex.from_product(
+            [stock_codes, get_session_labels(start_date, end_date)], names=daily_index.names
+            ),
+        columns=all_stocks_daily.columns
+        )
+
+    if new_stocks:
+        new_stocks = pd.concat(new_stocks, axis=0).sort_index()
+        new_daily = build_daily_bars(new_stocks, start_date, end_date, dense=False)
+        new_daily.index.names = all_stocks_daily.index.names
+        all_stocks_daily.loc[new_daily.index] = merge_daily_bars(all_stocks_daily, new_daily)
+        write_minute_partitions(new_stocks, minute_store_path)
+    else:
+        new_stocks = pd.DataFrame(columns=all_stocks_daily.columns)
 
-    all_stocks = pd.concat(all_stocks, axis=0)
-    all_stocks_daily = pd.concat(all_stocks_daily, axis=0)
+    all_stocks_daily.to_parquet(daily_store_path)
+    state.to_parquet(minute_store_path / INGEST_STATE_FILE)
     
-    return all_stocks.sort_index(), all_stocks_daily.sort_index()
+    return new_stocks, all_stocks_daily
 
 if __name__ == "__main__":
     data_folder = Path('***') # exist path of 'k_data/永豐'
-    all_stocks_path = Path('***') # construct path of 'all_stocks.parquet'
+    all_stocks_path = Path('***') # construct path of 'all_stocks.parquet' (partitioned directory)
     all_stocks_daily_path = Path('***') # construct path of 'all_stocks_daily.parquet'
     start_date, end_date = '2021-01-01', '2024-10-14'
+    max_workers = os.cpu_count() # 1 = serial
+    incremental = True # False 強制全部重建
 
-    # Combine all stock data into one DataFrame
-    all_stocks, all_stocks_daily = combine_stock_data(data_folder, start_date, end_date)
-    print(all_stocks)
-    print(all_stocks_daily)
-    # Optionally, save the combined DataFrame to a Parquet file
-    all_stocks.to_parquet(all_stocks_path)
-    all_stocks_daily.to_parquet(all_stocks_daily_path)
+    if incremental and (all_stocks_path / INGEST_STATE_FILE).exists():
+        # Parse only rows appended since the last run
+        new_stocks, all_stocks_daily = update_stock_data(
+            data_folder, all_stocks_path, all_stocks_daily_path, start_date, end_date
+            )
+        print(new_stocks)
+        print(all_stocks_daily)
+    else:
+        # Combine all stock data into one DataFrame
+        file_sizes = csv_file_sizes(data_folder)
+        all_stocks, all_stocks_daily = combine_stock_data(
+            data_folder, start_date, end_date, max_workers=max_workers
+            )
+        print(all_stocks)
+        print(all_stocks_daily)
+        write_minute_store(all_stocks, all_stocks_path, file_sizes)
+        all_stocks_daily.to_parquet(all_stocks_daily_path)
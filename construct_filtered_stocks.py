@@ -1,7 +1,13 @@
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from typing import List
-import pandas_market_calendars as mcal
+from typing import List, Optional, Tuple
+
+from construct_basic_data import load_selected_stocks
+from criteria import CriteriaEngine, Expr, field
+from instrumentation import count, instrumented
+from trade_tensor import write_trade_tensor
+from trading_calendar import get_session_ids, get_session_labels, get_sessions
 
 def filter_stocks_by_list(
         stocks_df: pd.DataFrame,
@@ -10,80 +16,127 @@ def filter_stocks_by_list(
     filtered_stocks_df = stocks_df[stocks_df.index.get_level_values(0).isin(stocks_list)]
     return filtered_stocks_df
 
+def build_daily_panel(
+        stocks_df: pd.DataFrame,
+        start_date: str,
+        end_date: str
+        ) -> Tuple[np.ndarray, pd.Index, pd.Index]:
+    """Scatter a long (stock_code, day) frame into a dense (session id, stock, field) array.
+
+    Rows are the sessions of get_sessions(start_date, end_date). Returns the array with
+    its stock_code and field labels; sessions not in the frame are NaN.
+    """
+    index = stocks_df.index
+    # 以 level codes 定位, 不必逐列比對字串
+    stock_level_codes = pd.unique(index.codes[0])
+    stock_codes = index.levels[0][stock_level_codes]
+    stock_pos = np.full(len(index.levels[0]), -1, dtype=np.int64)
+    stock_pos[stock_level_codes] = np.arange(len(stock_level_codes))
+    day_pos = get_session_ids(index.levels[1], start_date, end_date)[index.codes[1]]
+    stock_pos = stock_pos[index.codes[0]]
+    
+    fields = stocks_df.columns
+    panel = np.full((len(get_sessions(start_date, end_date)), len(stock_codes), len(fields)), np.nan)
+    in_range = day_pos >= 0
+    panel[day_pos[in_range], stock_pos[in_range]] = stocks_df.to_numpy(dtype='float64')[in_range]
+    return panel, stock_codes, fields
+
+@instrumented()
 def filter_stocks_by_trading_days(
         stocks_df: pd.DataFrame,
         start_date_str: str,
         end_date_str: str
         ) -> pd.DataFrame:
     """Filter all_stocks_df by keeping only rows within the business days range."""
-    start_date = pd.to_datetime(start_date_str)
-    end_date = pd.to_datetime(end_date_str)
-    trading_days = mcal.get_calendar('XTAI').schedule(
-        start_date=start_date, 
-        end_date=end_date
-        ).index.strftime('%Y-%m-%d')
-    reindexed_stocks = []
-    for stock_code in stocks_df.index.get_level_values(0).unique():
-        stock_data = stocks_df.xs(stock_code, level=0)
-        stock_data = stock_data.reindex(trading_days)
-        stock_data.columns = pd.MultiIndex.from_product([[stock_code], stock_data.columns])
-        reindexed_stocks.append(stock_data)
-
-    combined_df = pd.concat(reindexed_stocks, axis=1)
+    panel, stock_codes, fields = build_daily_panel(stocks_df, start_date_str, end_date_str)
+    
+    # 輸出仍以 '%Y-%m-%d' 字串為日期 key, 與日K store 及 stock_list 一致
+    combined_df = pd.DataFrame(
+        panel.reshape(len(panel), -1),
+        index=get_session_labels(start_date_str, end_date_str),
+        columns=pd.MultiIndex.from_product([stock_codes, fields], names=[None, None])
+        )
     
     return combined_df
 
+def daily_panel_from_wide(stocks_df: pd.DataFrame) -> Tuple[np.ndarray, pd.Index, pd.Index]:
+    """View the (date x (stock_code, field)) frame as a (date, stock, field) array."""
+    stock_codes = stocks_df.columns.get_level_values(0).unique()
+    fields = stocks_df.columns.get_level_values(1).unique()
+    columns = pd.MultiIndex.from_product([stock_codes, fields])
+    if not stocks_df.columns.equals(columns):
+        stocks_df = stocks_df.reindex(columns=columns)
+    panel = stocks_df.to_numpy(dtype='float64').reshape(len(stocks_df), len(stock_codes), len(fields))
+    return panel, stock_codes, fields
+
+def evaluate_criterion(
+        stocks_df: pd.DataFrame,
+        criterion: Expr
+        ) -> pd.DataFrame:
+    """Evaluate one criterion expression into a (date x stock_code) boolean DataFrame."""
+    panel, stock_codes, fields = daily_panel_from_wide(stocks_df)
+    criteria_np = CriteriaEngine(panel, fields).evaluate(criterion)
+    return pd.DataFrame(criteria_np, index=stocks_df.index, columns=stock_codes.rename(None))
+
+def top_ret_criterion(offset_days: int = 3, top_n: int = 100) -> Expr:
+    # Top N of the previous day's offset_days return, i.e. pct_change(offset_days).shift(1)
+    close = field('Close')
+    return (close.shift(1) / close.shift(1 + offset_days) - 1).top_n(top_n)
+
+def new_high_criterion(offset_days: int = 3) -> Expr:
+    # The previous day's Close is higher than the maximum High over the past offset_days
+    return field('Close').shift(1) > field('High').shift(2).rolling_max(offset_days)
+
+def higher_criterion(threshold: float) -> Expr:
+    # The previous day's Open is at least threshold above the Close of the day before
+    return field('Open').shift(1) >= field('Close').shift(2) * (1 + threshold)
+
+def vol_and_amount_criterion(offset_days: int = 3) -> Expr:
+    volume = field('Volume')
+    amount = field('Amount')
+    criteria_1 = volume.shift(1) > 3 * volume.shift(2).rolling_mean(offset_days)
+    criteria_2 = volume.shift(1) > 2000
+    criteria_3 = amount.shift(1).rolling_mean(5) > 1000
+    criteria_4 = amount.shift(1) > 1e8
+    return criteria_1 & criteria_2 & criteria_3 & criteria_4
+
+# 決定選股結果的參數與預設值; 改動時需要重算選股
+DEFAULT_FILTER_PARAMS = {
+    'top_n': 100,
+    'offset_days': 3,
+    'offset_days_2': 3,
+    'offset_days_3': 3,
+    'threshold': 0.001,
+}
+FILTER_PARAMS = tuple(DEFAULT_FILTER_PARAMS)
+
+def filter_criteria(params: dict) -> tuple:
+    """The four selection criteria for one set of filter parameters (see DEFAULT_FILTER_PARAMS)."""
+    return (
+        top_ret_criterion(params['offset_days'], params['top_n']),
+        new_high_criterion(params['offset_days_2']),
+        vol_and_amount_criterion(params['offset_days_3']),
+        higher_criterion(params['threshold'])
+    )
+
 def create_top_ret(
         stocks_df: pd.DataFrame,
         offset_days: int = 3,
         top_n: int = 100
         ) -> pd.DataFrame:
-    close_df = stocks_df.xs('Close', axis=1, level=1)
-    
-    ret_df = close_df.pct_change(periods=offset_days, fill_method=None).shift(1)
-    
-    criteria_df = pd.DataFrame(False, index=ret_df.index, columns=ret_df.columns)
-    
-    # print(criteria_df)
-    
-    # Iterate over each trading day to identify top N stocks
-    for date, row in ret_df.iterrows():
-        if row.isna().all():
-            continue  # Skip if all returns are NaN for the date
-        # Drop NaN values to exclude stocks with undefined returns
-        row_cleaned = row.dropna()
-        # Get the top N stocks based on return
-        top_stocks = row_cleaned.nlargest(top_n).index.tolist()
-        # Mark the top N stocks as True in the criteria DataFrame
-        criteria_df.loc[date, top_stocks] = True
-    
-    return criteria_df
+    return evaluate_criterion(stocks_df, top_ret_criterion(offset_days, top_n))
 
 def create_new_high(
         stocks_df: pd.DataFrame,
         offset_days: int = 3
         ) -> pd.DataFrame:
-    # Extract 'Close' and 'High' columns from the multi-index DataFrame
-    close_df = stocks_df.xs('Close', axis=1, level=1)
-    high_df = stocks_df.xs('High', axis=1, level=1)
-    
-    # Criteria: The previous day's Close is higher than the maximum High over the past offset_days
-    criteria = close_df.shift(1) > high_df.shift(2).rolling(window=offset_days).max()
-    
-    return criteria
+    return evaluate_criterion(stocks_df, new_high_criterion(offset_days))
 
 def create_higher(
         stocks_df: pd.DataFrame,
         threshold: float
         ) -> pd.DataFrame:
-    # Extract 'Close' and 'High' columns from the multi-index DataFrame
-    close_df = stocks_df.xs('Close', axis=1, level=1)
-    open_df = stocks_df.xs('Open', axis=1, level=1)
-    
-    # Criteria: The previous day's Close is higher than the maximum High over the past offset_days
-    criteria = open_df.shift(1) >= close_df.shift(2) * (1 + threshold)
-    
-    return criteria
+    return evaluate_criterion(stocks_df, higher_criterion(threshold))
 
 def create_filtered_by_vol_and_amount(
         stocks_df: pd.DataFrame,
@@ -99,42 +152,77 @@ def create_filtered_by_vol_and_amount(
     Returns:
     - pd.DataFrame: A boolean DataFrame where True indicates the stock meets the volume and amount criteria
     """
-    # Extract 'Volume' and 'Amount' columns
-    volume_df = stocks_df.xs('Volume', axis=1, level=1)
-    amount_df = stocks_df.xs('Amount', axis=1, level=1)
-    
-    criteria_1 = volume_df.shift(1) > 3 * volume_df.shift(2).rolling(window=offset_days).mean()
-    criteria_2 = volume_df.shift(1) > 2000
-    criteria_3 = amount_df.shift(1).rolling(window=5).mean() > 1000
-    criteria_4 = amount_df.shift(1) > 1e8
+    return evaluate_criterion(stocks_df, vol_and_amount_criterion(offset_days))
+
+
+def mask_to_list(
+        mask: np.ndarray,
+        index: pd.Index,
+        columns: pd.Index
+        ) -> pd.DataFrame:
+    """Turn a (date, stock) boolean mask into a Date -> stock_list DataFrame."""
+    rows, cols = np.nonzero(mask)
+    bounds = np.searchsorted(rows, np.arange(1, len(index)))
+    stock_list = [codes.tolist() for codes in np.split(columns.to_numpy()[cols], bounds)]
     
-    # Combine all criteria: A stock must satisfy all three criteria to be selected
-    combined_criteria = criteria_1 & criteria_2 & criteria_3 & criteria_4
+    result_df = pd.DataFrame({'stock_list': stock_list}, index=pd.Index(index, name='Date'))
     
-    return combined_criteria
-
+    return result_df
 
+@instrumented()
 def criterion_to_list(
         stocks_df: pd.DataFrame,
         *criteria: pd.DataFrame
         ) -> pd.DataFrame:
 
-    combined_criteria = criteria[0]
-    for crit in criteria[1:]:
-        combined_criteria &= crit
+    combined_criteria = np.logical_and.reduce([crit.to_numpy(dtype=bool) for crit in criteria])
     for col in stocks_df.columns.get_level_values(1).unique():
-        combined_criteria &= ~stocks_df.xs(col, axis=1, level=1).isna()
-    
-    stock_list = []
+        combined_criteria &= stocks_df.xs(col, axis=1, level=1).notna().to_numpy()
     
-    for date, row in combined_criteria.iterrows():
-        filtered_stocks = row[row].index.tolist()
-        stock_list.append([date, filtered_stocks])
+    return mask_to_list(combined_criteria, criteria[0].index, criteria[0].columns)
+
+def criteria_mask(
+        panel: np.ndarray,
+        fields: pd.Index,
+        *criteria: Expr,
+        engine: Optional[CriteriaEngine] = None
+        ) -> np.ndarray:
+    """(date, stock) mask of stocks meeting every criterion with no missing field that day.
+
+    All criteria run in one CriteriaEngine, so shared shift/rolling nodes are computed
+    once and stocks already ruled out on every day are skipped by later criteria.
+    Pass an engine built on the same panel to also share nodes across calls.
+    """
+    all_present = field(fields[0]).notna()
+    for col in fields[1:]:
+        all_present = all_present & field(col).notna()
     
-    # Convert the list to a DataFrame
-    result_df = pd.DataFrame(stock_list, columns=['Date', 'stock_list']).set_index('Date')
+    if engine is None:
+        engine = CriteriaEngine(panel, fields)
+    return engine.combine(all_present, *criteria)
+
+@instrumented()
+def select_stocks(
+        stocks_df: pd.DataFrame,
+        *criteria: Expr
+        ) -> pd.DataFrame:
+    """Date -> stock_list of the wide daily frame, see criteria_mask."""
+    panel, stock_codes, fields = daily_panel_from_wide(stocks_df)
+    combined_criteria = criteria_mask(panel, fields, *criteria)
     
-    return result_df
+    return mask_to_list(combined_criteria, stocks_df.index, stock_codes)
+
+def select_stocks_from_daily(
+        all_stocks_daily: pd.DataFrame,
+        stocks_list: List[str],
+        start_date: str,
+        end_date: str,
+        criteria: Tuple[Expr, ...]
+        ) -> pd.DataFrame:
+    """The criteria stage: universe and date filter of the daily store, then select_stocks."""
+    filtered_stocks_df = filter_stocks_by_list(all_stocks_daily, stocks_list)
+    filtered_stocks_df = filter_stocks_by_trading_days(filtered_stocks_df, start_date, end_date)
+    return select_stocks(filtered_stocks_df, *criteria)
 
 def process_stock_data_for_day(day, stock_code, all_stocks):
     stock_data = all_stocks.loc[stock_code, day].copy()
@@ -143,31 +231,85 @@ def process_stock_data_for_day(day, stock_code, all_stocks):
     stock_data['stock_code'] = stock_code
     return stock_data
 
-def process_filtered_stocks(filtered_stocks_list, all_stocks):
-    filtered_stocks_data = []
-    
-    ###
-    for day in filtered_stocks_list.index:
-        # print(f"Processing day: {day}")
-        for stock_code in filtered_stocks_list.loc[day, 'stock_list']:
-            stock_data = all_stocks.loc[stock_code, day].copy()
-            stock_data = stock_data.reset_index()
-            stock_data['day'] = day
-            stock_data['stock_code'] = stock_code
-            filtered_stocks_data.append(stock_data)
-    filtered_stocks_data = pd.concat(filtered_stocks_data, ignore_index=True)
-    
-    filtered_stocks_data.set_index(['day', 'stock_code', 'ts'], inplace=True)
-    filtered_stocks_data = filtered_stocks_data.sort_index()
+def selected_pairs(filtered_stocks_list: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Flatten the Date -> stock_list mapping into (day, stock_code) arrays sorted by day, stock_code."""
+    pairs = filtered_stocks_list['stock_list'].explode().dropna()
+    days = pairs.index.to_numpy().astype(str)
+    stock_codes = pairs.to_numpy().astype(str)
+    order = np.lexsort((stock_codes, days))
+    return days[order], stock_codes[order]
+
+def stock_day_row_ranges(
+        all_stocks: pd.DataFrame,
+        stock_codes: np.ndarray,
+        days: np.ndarray
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    """Row [start, stop) of each (stock_code, day) pair in a (stock_code, ts) sorted minute frame.
+
+    Every row gets an increasing (stock rank, day number) key, so all pairs are located
+    with two searchsorted calls instead of one .loc per pair. Missing pairs are empty ranges.
+    """
+    index = all_stocks.index
+    codes = index.codes[0]
+    stock_starts = np.r_[0, np.flatnonzero(codes[1:] != codes[:-1]) + 1] if len(codes) else np.array([], dtype=int)
+    stock_rank = np.zeros(len(codes), dtype=np.int64)
+    stock_rank[stock_starts[1:]] = 1
+    stock_rank = np.cumsum(stock_rank)
+    row_days = index.get_level_values(1).to_numpy().astype('datetime64[D]').astype(np.int64)
+    row_keys = (stock_rank << 32) + row_days
+    
+    rank_of_code = pd.Index(index.levels[0][codes[stock_starts]]).get_indexer(stock_codes)
+    pair_days = pd.to_datetime(days).to_numpy().astype('datetime64[D]').astype(np.int64)
+    pair_keys = (rank_of_code.astype(np.int64) << 32) + pair_days
+    
+    starts = np.searchsorted(row_keys, pair_keys, side='left')
+    stops = np.searchsorted(row_keys, pair_keys, side='right')
+    # 不存在的股票代碼給空區間
+    stops[rank_of_code < 0] = starts[rank_of_code < 0]
+    return starts, stops
+
+@instrumented()
+def process_filtered_stocks(filtered_stocks_list, all_stocks, tensor_path: Optional[Path] = None):
+    """Pull the minute rows of every selected (day, stock_code), indexed by (day, stock_code, ts).
+
+    A Minute column (minute of day, int16) is added for the backtest's time axis.
+    With tensor_path the result is also written there as a trade tensor store.
+    """
+    if not all_stocks.index.is_monotonic_increasing:
+        all_stocks = all_stocks.sort_index()
+    days, stock_codes = selected_pairs(filtered_stocks_list)
+    starts, stops = stock_day_row_ranges(all_stocks, stock_codes, days)
+    count('trades sliced', len(days))
+    
+    # 把每段 [start, stop) 串成一個 row 位置陣列
+    lengths = stops - starts
+    offsets = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    rows = np.arange(lengths.sum()) + offsets
+    
+    filtered_stocks_data = all_stocks.iloc[rows]
+    filtered_stocks_data.index = pd.MultiIndex.from_arrays(
+        [
+            np.repeat(days.astype(object), lengths),
+            np.repeat(stock_codes.astype(object), lengths),
+            filtered_stocks_data.index.get_level_values(1)
+        ],
+        names=['day', 'stock_code', 'ts']
+        )
+    # 盤中時間軸在這裡算一次, 回測不再對 ts 做字串格式化
+    ts = filtered_stocks_data.index.get_level_values(2)
+    filtered_stocks_data = filtered_stocks_data.assign(Minute=(ts.hour * 60 + ts.minute).astype('int16'))
+    if tensor_path is not None:
+        write_trade_tensor(filtered_stocks_data, tensor_path)
     return filtered_stocks_data
 
 if __name__ == "__main__":
     # Define file paths
-    all_stocks_path = Path('***') # exit path of 'all_stocks.parquet'
+    all_stocks_path = Path('***') # exit path of 'all_stocks.parquet' (partitioned directory)
     mid_stocks_list_path = Path('***') # exit path of 'mid_stocks_list.feather'
     all_stocks_daily_path = Path('***') # exist path of 'all_stocks_daily.parquet'
     filtered_stocks_list_path = Path('***') # construct path of 'filtered_stocks_list.parquet'
     filtered_stocks_data_path = Path('***') # construct path of 'filtered_stocks_data.parquet'
+    filtered_stocks_tensor_path = Path('***') # construct path of 'filtered_stocks_tensor' (directory)
     
     # Define parameters
     start_date, end_date = '2023-08-01', '2024-10-14'
@@ -181,30 +323,25 @@ if __name__ == "__main__":
     mid_stocks_list = pd.read_feather(mid_stocks_list_path)['stock_code'].astype(str).tolist()
     all_stocks_daily = pd.read_parquet(all_stocks_daily_path)
     
-    filtered_stocks_df = filter_stocks_by_list(all_stocks_daily, mid_stocks_list)
-    
-    filtered_stocks_df = filter_stocks_by_trading_days(filtered_stocks_df, start_date, end_date)
-    
-    # Generate criteria DataFrames
-    top_ret_criteria = create_top_ret(filtered_stocks_df, offset_days, top_n)
-    new_high_criteria = create_new_high(filtered_stocks_df, offset_days_2)
-    vol_amount_criteria = create_filtered_by_vol_and_amount(filtered_stocks_df, offset_days_3)
-    higher_criteria = create_higher(filtered_stocks_df, threshold)
-    
     # Combine all criteria to find common stocks
-    filtered_stocks_list = criterion_to_list(
-        filtered_stocks_df,
-        top_ret_criteria,
-        new_high_criteria,
-        vol_amount_criteria,
-        higher_criteria
+    filtered_stocks_list = select_stocks_from_daily(
+        all_stocks_daily,
+        mid_stocks_list,
+        start_date,
+        end_date,
+        (
+            top_ret_criterion(offset_days, top_n),
+            new_high_criterion(offset_days_2),
+            vol_and_amount_criterion(offset_days_3),
+            higher_criterion(threshold)
+        )
     )
     filtered_stocks_list.to_parquet(filtered_stocks_list_path)
     print(filtered_stocks_list[filtered_stocks_list['stock_list'].apply(lambda x: len(x) > 0)])
     
     #%%
-    all_stocks = pd.read_parquet(all_stocks_path)
-    filtered_stocks_data = process_filtered_stocks(filtered_stocks_list, all_stocks)
+    all_stocks = load_selected_stocks(all_stocks_path, filtered_stocks_list)
+    filtered_stocks_data = process_filtered_stocks(filtered_stocks_list, all_stocks, filtered_stocks_tensor_path)
     
     # print(filtered_stocks_data)
     filtered_stocks_data.to_parquet(filtered_stocks_data_path)
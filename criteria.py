@@ -0,0 +1,234 @@
+import operator
+from typing import Callable, Dict, Hashable, Optional, Sequence, Tuple
+import numpy as np
+
+# Criteria are declared as expression trees over the (day, stock, field) panel, e.g.
+#   field('Close').shift(1) > field('High').shift(2).rolling_max(3)
+# Nodes with the same structure share one cache entry, so a sub-expression used by
+# several criteria (Volume.shift(1), Close.shift(1), ...) is computed once.
+
+_BINARY_OPS: Dict[str, Callable] = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '&': operator.and_,
+    '|': operator.or_,
+}
+
+def top_n_mask(values: np.ndarray, top_n: int) -> np.ndarray:
+    """Boolean mask of the top_n largest non-NaN values of each row.
+
+    A stable descending sort keeps the first column among ties and sorts NaN last,
+    matching row.dropna().nlargest(top_n).
+    """
+    top_idx = np.argsort(-values, axis=1, kind='stable')[:, :top_n]
+    top_valid = ~np.isnan(np.take_along_axis(values, top_idx, axis=1))
+    mask = np.zeros(values.shape, dtype=bool)
+    np.put_along_axis(mask, top_idx, top_valid, axis=1)
+    return mask
+
+def _as_expr(value) -> 'Expr':
+    return value if isinstance(value, Expr) else Const(value)
+
+class Expr:
+    """A lazily evaluated node; `key` identifies structurally equal nodes."""
+    # 需要整個橫截面才能計算 (例如排名), 不能只算存活的欄位
+    cross_sectional = False
+
+    def __init__(self, key: Hashable, children: Tuple['Expr', ...] = ()):
+        self.key = key
+        self.children = children
+
+    def compute(self, engine: 'CriteriaEngine', cols: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    @property
+    def lookback(self) -> int:
+        """Number of earlier rows the value of the last row depends on."""
+        return max((child.lookback for child in self.children), default=0)
+
+    def shift(self, periods: int) -> 'Expr':
+        return Shift(self, periods)
+
+    def rolling_max(self, window: int) -> 'Expr':
+        return Rolling(self, window, 'max')
+
+    def rolling_mean(self, window: int) -> 'Expr':
+        return Rolling(self, window, 'mean')
+
+    def pct_change(self, periods: int) -> 'Expr':
+        return self / self.shift(periods) - 1
+
+    def notna(self) -> 'Expr':
+        return NotNa(self)
+
+    def top_n(self, n: int) -> 'Expr':
+        return TopN(self, n)
+
+    def __add__(self, other): return BinOp('+', self, other)
+    def __radd__(self, other): return BinOp('+', other, self)
+    def __sub__(self, other): return BinOp('-', self, other)
+    def __rsub__(self, other): return BinOp('-', other, self)
+    def __mul__(self, other): return BinOp('*', self, other)
+    def __rmul__(self, other): return BinOp('*', other, self)
+    def __truediv__(self, other): return BinOp('/', self, other)
+    def __rtruediv__(self, other): return BinOp('/', other, self)
+    def __gt__(self, other): return BinOp('>', self, other)
+    def __ge__(self, other): return BinOp('>=', self, other)
+    def __lt__(self, other): return BinOp('<', self, other)
+    def __le__(self, other): return BinOp('<=', self, other)
+    def __and__(self, other): return BinOp('&', self, other)
+    def __or__(self, other): return BinOp('|', self, other)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}{self.key[1:]}'
+
+class Field(Expr):
+    def __init__(self, name: str):
+        super().__init__(('field', name))
+        self.name = name
+
+    def compute(self, engine, cols):
+        return engine.field_values(self.name, cols)
+
+class Const(Expr):
+    def __init__(self, value):
+        super().__init__(('const', value))
+        self.value = value
+
+    def compute(self, engine, cols):
+        return self.value
+
+class Shift(Expr):
+    def __init__(self, child: Expr, periods: int):
+        super().__init__(('shift', child.key, periods), (child,))
+        self.periods = periods
+
+    @property
+    def lookback(self):
+        return self.children[0].lookback + max(self.periods, 0)
+
+    def compute(self, engine, cols):
+        values = engine.evaluate(self.children[0], cols)
+        shifted = np.full(values.shape, np.nan)
+        if self.periods > 0:
+            shifted[self.periods:] = values[:-self.periods]
+        elif self.periods < 0:
+            shifted[:self.periods] = values[-self.periods:]
+        else:
+            shifted[:] = values
+        return shifted
+
+class Rolling(Expr):
+    def __init__(self, child: Expr, window: int, how: str):
+        super().__init__(('rolling', child.key, window, how), (child,))
+        self.window = window
+        self.how = how
+
+    @property
+    def lookback(self):
+        return self.children[0].lookback + self.window - 1
+
+    def compute(self, engine, cols):
+        # min_periods = window: 視窗內有任何 NaN 結果即為 NaN, 與 pandas rolling 相同
+        values = engine.evaluate(self.children[0], cols)
+        rolled = np.full(values.shape, np.nan)
+        if len(values) >= self.window:
+            windows = np.lib.stride_tricks.sliding_window_view(values, self.window, axis=0)
+            if self.how == 'max':
+                rolled[self.window - 1:] = windows.max(axis=-1)
+            else:
+                rolled[self.window - 1:] = windows.sum(axis=-1) / self.window
+        return rolled
+
+class BinOp(Expr):
+    def __init__(self, op: str, left, right):
+        left, right = _as_expr(left), _as_expr(right)
+        super().__init__(('binop', op, left.key, right.key), (left, right))
+        self.op = op
+
+    def compute(self, engine, cols):
+        left = engine.evaluate(self.children[0], cols)
+        right = engine.evaluate(self.children[1], cols)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return _BINARY_OPS[self.op](left, right)
+
+class NotNa(Expr):
+    def __init__(self, child: Expr):
+        super().__init__(('notna', child.key), (child,))
+
+    def compute(self, engine, cols):
+        return ~np.isnan(engine.evaluate(self.children[0], cols))
+
+class TopN(Expr):
+    cross_sectional = True
+
+    def __init__(self, child: Expr, n: int):
+        super().__init__(('top_n', child.key, n), (child,))
+        self.n = n
+
+    def compute(self, engine, cols):
+        return top_n_mask(engine.evaluate(self.children[0], cols), self.n)
+
+def field(name: str) -> Field:
+    return Field(name)
+
+class CriteriaEngine:
+    """Evaluate criteria expressions on a (day, stock, field) panel with shared results.
+
+    Every node is computed at most once per set of live stock columns. combine() ANDs
+    criteria in order and drops stock columns that are already False on every day, so
+    later criteria only touch the survivors (cross-sectional nodes still see all stocks).
+    """
+
+    def __init__(self, panel: np.ndarray, fields: Sequence[str]):
+        self.panel = panel
+        self.field_pos = {name: i for i, name in enumerate(fields)}
+        self.all_cols = np.arange(panel.shape[1])
+        self._cache: Dict[Hashable, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def field_values(self, name: str, cols: np.ndarray) -> np.ndarray:
+        values = self.panel[:, :, self.field_pos[name]]
+        return values if len(cols) == len(self.all_cols) else values[:, cols]
+
+    def evaluate(self, expr: Expr, cols: Optional[np.ndarray] = None) -> np.ndarray:
+        """Values of expr for the given stock columns (all columns by default)."""
+        if cols is None or expr.cross_sectional:
+            cols_needed = self.all_cols
+        else:
+            cols_needed = cols
+
+        hit = self._cache.get(expr.key)
+        if hit is not None and (hit[0] is cols_needed or np.isin(cols_needed, hit[0]).all()):
+            values = hit[1]
+        else:
+            values = expr.compute(self, cols_needed)
+            if np.ndim(values):
+                self._cache[expr.key] = (cols_needed, values)
+            hit = (cols_needed, values)
+
+        if not np.ndim(values):
+            return values
+        # 快取的欄位比需要的多時取子集合
+        target = self.all_cols if cols is None else cols
+        if hit[0] is target or len(hit[0]) == len(target):
+            return values
+        return values[:, np.searchsorted(hit[0], target)]
+
+    def combine(self, *criteria: Expr) -> np.ndarray:
+        """AND of all criteria as a (day, stock) boolean mask."""
+        mask = np.ones(self.panel.shape[:2], dtype=bool)
+        cols = self.all_cols
+        for crit in criteria:
+            mask[:, cols] &= self.evaluate(crit, cols)
+            alive = mask[:, cols].any(axis=0)
+            if not alive.all():
+                cols = cols[alive]
+            if len(cols) == 0:
+                break
+        return mask
@@ -0,0 +1,194 @@
+import argparse
+import cProfile
+import functools
+import io
+import json
+import pstats
+import runpy
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# 預設關閉: 沒有 profile() 時, stage()/count() 只做一次 None 檢查就返回
+
+class ProfileReport:
+    """Wall time, traced memory peak and call count per stage, plus free-form counters.
+
+    Stage times are inclusive (a stage that calls another also counts the callee's
+    time). Work done inside process pools is not seen by this process.
+    """
+
+    def __init__(self, memory: bool = True):
+        self.memory = memory
+        self.stages: Dict[str, dict] = {}
+        self.counters: Dict[str, int] = {}
+        self.cprofile: List[dict] = []
+        self.wall_seconds = 0.0
+        self._stack: List[list] = []
+
+    def _enter(self) -> list:
+        frame = [time.perf_counter(), 0, 0]  # start time, start memory, peak memory
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], peak)
+            tracemalloc.reset_peak()
+            frame[1] = frame[2] = current
+        self._stack.append(frame)
+        return frame
+
+    def _exit(self, name: str, frame: list):
+        seconds = time.perf_counter() - frame[0]
+        self._stack.pop()
+        if self.memory and tracemalloc.is_tracing():
+            frame[2] = max(frame[2], tracemalloc.get_traced_memory()[1])
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], frame[2])
+        stats = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_mb': 0.0})
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+        stats['peak_mb'] = max(stats['peak_mb'], (frame[2] - frame[1]) / 1024 ** 2)
+
+    def to_dict(self) -> dict:
+        return {
+            'wall_seconds': self.wall_seconds,
+            'stages': self.stages,
+            'counters': self.counters,
+            'cprofile': self.cprofile,
+        }
+
+    def write_json(self, path: Path):
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2))
+
+    def print(self):
+        """Print stage times, memory peaks and counters with sr8.print_dict."""
+        # sr8 會載入 matplotlib/seaborn, 只在印報表時才 import
+        import sr8_performance as sr8
+
+        if self.stages:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1]['seconds'])
+            sr8.print_dict({name: stats['seconds'] for name, stats in stages}, 'Stage time (s)')
+            if self.memory:
+                sr8.print_dict({name: stats['peak_mb'] for name, stats in stages}, 'Stage peak memory (MB)')
+            sr8.print_dict({name: stats['calls'] for name, stats in stages}, 'Stage calls')
+        if self.counters:
+            sr8.print_dict(dict(self.counters), 'Counters')
+        if self.cprofile:
+            sr8.print_dict(
+                {row['function']: row['cumulative_s'] for row in self.cprofile},
+                'cProfile cumulative (s)'
+            )
+
+_active: Optional[ProfileReport] = None
+
+@contextmanager
+def profile(memory: bool = True, cprofile: bool = False, cprofile_top: int = 30):
+    """Collect a ProfileReport for everything run inside the block.
+
+        with profile() as report:
+            run_pipeline(...)
+        report.print()
+
+    memory=True traces allocations with tracemalloc (slower); cprofile=True also
+    keeps the cprofile_top functions by cumulative time.
+    """
+    global _active
+    report = ProfileReport(memory)
+    previous, _active = _active, report
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if cprofile else None
+    start_time = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield report
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        report.wall_seconds = time.perf_counter() - start_time
+        if started_tracing:
+            tracemalloc.stop()
+        _active = previous
+        if profiler is not None:
+            report.cprofile = _top_functions(profiler, cprofile_top)
+
+def _top_functions(profiler: cProfile.Profile, top: int) -> List[dict]:
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (file_name, line, func_name), (_, n_calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f'{Path(file_name).name}:{line}({func_name})',
+            'calls': n_calls,
+            'total_s': total,
+            'cumulative_s': cumulative,
+        })
+    return sorted(rows, key=lambda row: -row['cumulative_s'])[:top]
+
+@contextmanager
+def stage(name: str):
+    """Time a block as `name` when profiling is active."""
+    report = _active
+    if report is None:
+        yield
+        return
+    frame = report._enter()
+    try:
+        yield
+    finally:
+        report._exit(name, frame)
+
+def instrumented(name: Optional[str] = None) -> Callable:
+    """Decorator form of stage(); the function name is used by default."""
+    def decorator(func: Callable) -> Callable:
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            report = _active
+            if report is None:
+                return func(*args, **kwargs)
+            frame = report._enter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                report._exit(stage_name, frame)
+        return wrapper
+    return decorator
+
+def counting_enabled() -> bool:
+    """True inside profile(); lets callers skip computing costly counter values."""
+    return _active is not None
+
+def count(name: str, n: int = 1):
+    """Add n to a counter when profiling is active."""
+    report = _active
+    if report is not None:
+        report.counters[name] = report.counters.get(name, 0) + int(n)
+
+
+#%%
+if __name__ == "__main__":
+    # python instrumentation.py [--json report.json] [--cprofile] script.py [script args]
+    parser = argparse.ArgumentParser(description='Run a pipeline script with instrumentation on.')
+    parser.add_argument('--json', type=Path, help='write the report here instead of printing it')
+    parser.add_argument('--cprofile', action='store_true', help='also collect cProfile statistics')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc memory peaks')
+    parser.add_argument('script', type=Path)
+    parser.add_argument('script_args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    # 腳本 import 的是 instrumentation 模組, 不是這裡的 __main__, 要用同一份狀態
+    import instrumentation
+    sys.argv = [str(args.script)] + args.script_args
+    sys.path.insert(0, str(args.script.resolve().parent))
+    with instrumentation.profile(memory=not args.no_memory, cprofile=args.cprofile) as report:
+        runpy.run_path(str(args.script), run_name='__main__')
+    if args.json is not None:
+        report.write_json(args.json)
+    else:
+        report.print()
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+from construct_filtered_stocks import (
+    daily_panel_from_wide, filter_stocks_by_list, filter_stocks_by_trading_days,
+    higher_criterion, new_high_criterion, top_ret_criterion, vol_and_amount_criterion
+    )
+from criteria import CriteriaEngine, Expr
+from trading_calendar import get_session_labels
+
+def _sessions_after(day: str) -> pd.Index:
+    # 以年份為單位查交易日曆, 每年只建一次 (get_session_labels 有快取)
+    year = int(day[:4])
+    sessions = get_session_labels(f'{year}-01-01', f'{year + 1}-12-31')
+    return sessions[sessions > day]
+
+class StreamingSelector:
+    """Incremental version of select_stocks for producing the next session's stock_list.
+
+    Only the last `lookback` daily bars per stock are kept (the deepest shift/rolling
+    window of the criteria), so adding a bar and evaluating the criteria costs the same
+    whatever the length of the history. The signal for a session is computed on
+    those bars plus an empty row for the session itself, which gives exactly the
+    values the full-history panel has on that day. select_stocks also requires the
+    stock to have a bar on the session itself; that is not known at the open and is
+    left to the caller.
+    """
+
+    def __init__(
+            self,
+            stock_codes: Sequence[str],
+            fields: Sequence[str],
+            criteria: Sequence[Expr]
+        ):
+        self.stock_codes = pd.Index(stock_codes)
+        self.fields = pd.Index(fields)
+        self.criteria = tuple(criteria)
+        self.lookback = max((crit.lookback for crit in self.criteria), default=0)
+        # 最近 lookback 天的日K, 依日期由舊到新
+        self.bars = np.full((self.lookback, len(self.stock_codes), len(self.fields)), np.nan)
+        self.days: List[str] = []
+
+    @classmethod
+    def from_history(cls, stocks_df: pd.DataFrame, criteria: Sequence[Expr]) -> 'StreamingSelector':
+        """Warm up from a wide (date x (stock_code, field)) frame, e.g. filter_stocks_by_trading_days."""
+        panel, stock_codes, fields = daily_panel_from_wide(stocks_df)
+        selector = cls(stock_codes, fields, criteria)
+        keep = min(selector.lookback, len(panel))
+        if keep:
+            selector.bars[-keep:] = panel[-keep:]
+        selector.days = list(stocks_df.index[len(stocks_df) - keep:])
+        return selector
+
+    @classmethod
+    def load(cls, path: Path, criteria: Sequence[Expr]) -> 'StreamingSelector':
+        return cls.from_history(pd.read_parquet(path), criteria)
+
+    def to_frame(self) -> pd.DataFrame:
+        """The kept bars as a wide (date x (stock_code, field)) frame."""
+        bars = self.bars[len(self.bars) - len(self.days):]
+        return pd.DataFrame(
+            bars.reshape(len(bars), -1),
+            index=pd.Index(self.days, dtype=object),
+            columns=pd.MultiIndex.from_product([self.stock_codes, self.fields], names=[None, None])
+            )
+
+    def save(self, path: Path):
+        self.to_frame().to_parquet(path)
+
+    def _push(self, day: str, bar: np.ndarray):
+        if self.lookback == 0:
+            return
+        self.bars[:-1] = self.bars[1:]
+        self.bars[-1] = bar
+        self.days = (self.days + [day])[-self.lookback:]
+
+    def update(self, day: str, bars: pd.DataFrame):
+        """Add the daily bars of `day` (index stock_code, columns fields).
+
+        Sessions skipped since the last update are added as missing bars, like the
+        NaN rows of the full panel; stocks not in the universe are ignored.
+        """
+        day = pd.Timestamp(day).strftime('%Y-%m-%d')
+        if self.days:
+            if day <= self.days[-1]:
+                raise ValueError(f'{day} is not after the last update {self.days[-1]}')
+            sessions = _sessions_after(self.days[-1])
+            for missing_day in sessions[sessions < day]:
+                self._push(missing_day, np.nan)
+
+        bar = bars.reindex(index=self.stock_codes, columns=self.fields).to_numpy(dtype='float64')
+        self._push(day, bar)
+
+    def next_session(self) -> str:
+        return _sessions_after(self.days[-1])[0]
+
+    def signal_mask(self) -> np.ndarray:
+        """Criteria mask (one bool per stock) for the session after the last update."""
+        panel = np.concatenate([self.bars, np.full((1,) + self.bars.shape[1:], np.nan)])
+        return CriteriaEngine(panel, self.fields).combine(*self.criteria)[-1]
+
+    def signal(self) -> Tuple[str, List[str]]:
+        """(next session, stock_list) from the bars received so far."""
+        return self.next_session(), self.stock_codes[self.signal_mask()].tolist()
+
+
+#%%
+if __name__ == "__main__":
+    all_stocks_daily_path = Path('***') # exist path of 'all_stocks_daily.parquet' (only for the first run)
+    mid_stocks_list_path = Path('***') # exit path of 'mid_stocks_list.feather'
+    live_state_path = Path('***') # construct path of 'live_state.parquet'
+
+    top_n = 100
+    offset_days = 3
+    offset_days_2 = 3
+    offset_days_3 = 3
+    threshold = 0.001
+    criteria = (
+        top_ret_criterion(offset_days, top_n),
+        new_high_criterion(offset_days_2),
+        vol_and_amount_criterion(offset_days_3),
+        higher_criterion(threshold)
+    )
+
+    if live_state_path.exists():
+        selector = StreamingSelector.load(live_state_path, criteria)
+    else:
+        # 第一次執行: 從歷史日K取最後幾天作為初始狀態
+        mid_stocks_list = pd.read_feather(mid_stocks_list_path)['stock_code'].astype(str).tolist()
+        all_stocks_daily = filter_stocks_by_list(pd.read_parquet(all_stocks_daily_path), mid_stocks_list)
+        end_date = all_stocks_daily.index.get_level_values(1).max()
+        start_date = (pd.Timestamp(end_date) - pd.Timedelta(days=60)).strftime('%Y-%m-%d')
+        selector = StreamingSelector.from_history(
+            filter_stocks_by_trading_days(all_stocks_daily, start_date, end_date),
+            criteria
+        )
+
+    # 每天收盤後: selector.update(day, bars_of_day), bars_of_day 以 stock_code 為 index
+    day, stock_list = selector.signal()
+    print(day, stock_list)
+    selector.save(live_state_path)
@@ -1,26 +1,126 @@
 import pandas as pd
 import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-import pandas_market_calendars as mcal
 from datetime import datetime
+from typing import List, Optional, Tuple, Union
 
 import sr8_performance as sr8
+from instrumentation import count, counting_enabled, instrumented
+from shared_arrays import attach_shared, release_shared, to_shared
+from trade_tensor import TradeTensor
+from trading_calendar import get_session_ids, get_sessions
+
+def time_to_minute(hhmm: str) -> int:
+    """'HH:MM' -> minutes since midnight."""
+    hour, minute = hhmm.split(':')
+    return int(hour) * 60 + int(minute)
+
+def as_minute(time: Union[int, str]) -> int:
+    """Minute of day from an int or an 'HH:MM' string (the form earliest_entry_time used to take)."""
+    return time_to_minute(time) if isinstance(time, str) else int(time)
+
+# 盤中時間一律用 minute of day (int), 不做字串比較
+SESSION_OPEN_MINUTE = time_to_minute('09:00')
+EARLIEST_ENTRY_MINUTE = time_to_minute('09:06')
+PARTIAL_EXIT_MINUTE_1 = time_to_minute('11:00')
+PARTIAL_EXIT_MINUTE_2 = time_to_minute('13:00')
+FORCED_EXIT_MINUTE = time_to_minute('13:30')
+
+# 只影響盤中執行的參數與預設值; 選股結果不受影響
+DEFAULT_EXECUTION_PARAMS = {
+    'stop_loss_pct': 0.005,
+    'earliest_entry_time': EARLIEST_ENTRY_MINUTE,
+    'initial_cap': 1e5,
+}
+EXECUTION_PARAMS = tuple(DEFAULT_EXECUTION_PARAMS)
+
+def session_cutoff_idx(
+        minute_np: np.ndarray,
+        earliest_entry_time: Union[int, str] = EARLIEST_ENTRY_MINUTE
+    ) -> np.ndarray:
+    """Index of the first bar at/after entry, 11:00, 13:00 and 13:30 for each trade.
+
+    minute_np is (minute,) for one trade or (trade, minute) padded with 24:00 after the
+    last bar; the result has a trailing axis of 4 cut-offs.
+    """
+    cutoffs = np.array([as_minute(earliest_entry_time), PARTIAL_EXIT_MINUTE_1, PARTIAL_EXIT_MINUTE_2, FORCED_EXIT_MINUTE])
+    # 已排序, searchsorted(side='left') 等於早於該時間的 bar 數
+    return (minute_np[..., None] < cutoffs).sum(axis=-2)
+
+class IntradayGrid:
+    """Portfolio P&L, gross exposure and open positions of each day on a shared minute grid.
+
+    Rows are days, columns the minutes SESSION_OPEN_MINUTE..FORCED_EXIT_MINUTE. Trades
+    add the change of their P&L, position value and open count at each bar, so the
+    cumulative sum along the minutes gives the whole portfolio at every minute (each
+    trade's last value carried forward) without keeping any per-trade path.
+    """
+
+    def __init__(
+            self,
+            n_days: int,
+            first_minute: int = SESSION_OPEN_MINUTE,
+            last_minute: int = FORCED_EXIT_MINUTE
+        ):
+        self.minutes = np.arange(first_minute, last_minute + 1)
+        self.days = pd.RangeIndex(n_days)
+        self.capital = np.zeros(n_days)
+        self.pnl = np.zeros((n_days, len(self.minutes)))
+        self.exposure = np.zeros((n_days, len(self.minutes)))
+        self.positions = np.zeros((n_days, len(self.minutes)), dtype=np.int32)
+
+    def add(
+            self,
+            day_idx: np.ndarray,
+            minute: np.ndarray,
+            pnl: np.ndarray,
+            exposure: np.ndarray,
+            positions: np.ndarray
+        ):
+        """Add per-trade changes at their bar minutes; bars outside the grid go to its edges."""
+        cols = np.clip(minute - self.minutes[0], 0, len(self.minutes) - 1)
+        np.add.at(self.pnl, (day_idx, cols), pnl)
+        np.add.at(self.exposure, (day_idx, cols), exposure)
+        np.add.at(self.positions, (day_idx, cols), positions)
+
+    def _frame(self, changes: np.ndarray) -> pd.DataFrame:
+        labels = [f'{m // 60:02d}:{m % 60:02d}' for m in self.minutes]
+        return pd.DataFrame(np.cumsum(changes, axis=1), index=self.days, columns=labels)
+
+    def pnl_frame(self) -> pd.DataFrame:
+        return self._frame(self.pnl)
+
+    def equity_frame(self) -> pd.DataFrame:
+        """Capital deployed that day (trades x initial_cap) plus the running P&L."""
+        return self.pnl_frame().add(self.capital, axis=0)
+
+    def exposure_frame(self) -> pd.DataFrame:
+        """Market value of the open (short) positions at the last close."""
+        return self._frame(self.exposure)
+
+    def positions_frame(self) -> pd.DataFrame:
+        return self._frame(self.positions)
 
 def execute_strategy_on_single(
-        ts_np: np.array,
+        minute_np: np.array,
         open_np: np.array,
         close_np: np.array,
         initial_cap: int = 1e5,
         stop_loss_pct: float = 0.005,
-        earliest_entry_time: str = '09:06',
+        earliest_entry_time: Union[int, str] = EARLIEST_ENTRY_MINUTE,
     ) -> pd.Series:
 
-    idx_len = len(ts_np)
+    idx_len = len(minute_np)
     
-    earliest_entry_idx = np.searchsorted(ts_np, earliest_entry_time, side='left')
-    partial_exit_idx_1 = np.searchsorted(ts_np, '11:00', side='left')
-    partial_exit_idx_2 = np.searchsorted(ts_np, '13:00', side='left')
-    partial_exit_idx_3 = np.searchsorted(ts_np, '13:30', side='left')
+    earliest_entry_idx, partial_exit_idx_1, partial_exit_idx_2, partial_exit_idx_3 = np.searchsorted(
+        minute_np,
+        [as_minute(earliest_entry_time), PARTIAL_EXIT_MINUTE_1, PARTIAL_EXIT_MINUTE_2, FORCED_EXIT_MINUTE],
+        side='left'
+        )
+    if earliest_entry_idx >= idx_len:
+        raise ValueError(f'no bar at or after earliest_entry_time {as_minute(earliest_entry_time)}')
 
     equity = np.full(idx_len, np.nan, dtype=float)
     
@@ -52,62 +152,396 @@ def execute_strategy_on_single(
         if position <= 0:
             break
 
+    count('trades executed')
+    count('minute-loop iterations', i - earliest_entry_idx + 1)
     if i < idx_len - 1:
         equity[i+1:] = equity[i]
     
-    equity_series = pd.Series(equity, index=ts_np, name='Equity')
+    equity_series = pd.Series(equity, index=minute_np, name='Equity')
     
     return equity_series
 
+@instrumented()
+def execute_strategy_batch(
+        minute_np: np.ndarray,
+        open_np: np.ndarray,
+        close_np: np.ndarray,
+        lengths: np.ndarray,
+        initial_cap: int = 1e5,
+        stop_loss_pct: float = 0.005,
+        earliest_entry_time: Union[int, str] = EARLIEST_ENTRY_MINUTE,
+        cutoff_idx: Optional[np.ndarray] = None,
+        grid: Optional[IntradayGrid] = None,
+        day_idx: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+    """Run execute_strategy_on_single for many trades at once and return each trade's P&L.
+
+    Inputs are (trade, minute) arrays padded past `lengths`, with minute_np holding the
+    minute of day of each bar; a trade without a bar at/after earliest_entry_time
+    raises ValueError. cutoff_idx, the per-trade session_cutoff_idx, can be
+    passed in when it was precomputed for the same earliest_entry_time. All trades
+    step through the session together as an array-level state machine, applying the
+    same entry, trailing stop, 11:00/13:00 partial exits and 13:30 forced exit with the
+    same floating-point operations, so the P&L equals equity.iloc[-1] - equity.iloc[0]
+    of the per-trade loop. With grid, each trade's P&L and exposure path is also added
+    to grid row day_idx as it is stepped.
+    """
+    n_trades, max_len = open_np.shape
+    if n_trades == 0:
+        return np.zeros(0)
+    trade_idx = np.arange(n_trades)
+    
+    if cutoff_idx is None:
+        valid = np.arange(max_len)[None, :] < lengths[:, None]
+        # 補齊的位置當作收盤後 (24:00), 不影響 bar 計數
+        cutoff_idx = session_cutoff_idx(np.where(valid, minute_np, 24 * 60), earliest_entry_time)
+    earliest_entry_idx, partial_exit_idx_1, partial_exit_idx_2, partial_exit_idx_3 = cutoff_idx.T
+    # 沒有進場 bar 的交易會讀到 padding, 直接拒絕
+    no_entry = earliest_entry_idx >= lengths
+    if no_entry.any():
+        raise ValueError(f'trades {np.flatnonzero(no_entry).tolist()} have no bar at or after earliest_entry_time')
+    
+    entry_price = open_np[trade_idx, earliest_entry_idx]
+    initial_position = np.floor(initial_cap * 1000 / (entry_price * 1.000399)) / 1000
+    partial_close_position = np.floor(initial_position / 3)
+    position = initial_position.copy()
+    cap = initial_cap - position * entry_price
+    
+    entry_equity = cap + position * (2 * entry_price - close_np[trade_idx, earliest_entry_idx] * 1.003399)
+    first_equity = np.where(earliest_entry_idx > 0, float(initial_cap), entry_equity)
+    last_equity = entry_equity.copy()
+    if grid is not None:
+        # 進場前 P&L 與部位皆為 0, 從進場那根 bar 開始累加變化量
+        last_pnl = entry_equity - first_equity
+        last_exposure = position * close_np[trade_idx, earliest_entry_idx]
+        last_open = (position > 0).astype(np.int32)
+        grid.add(day_idx, minute_np[trade_idx, earliest_entry_idx], last_pnl, last_exposure, last_open)
+    
+    trailing_price = entry_price.copy()
+    done = np.zeros(n_trades, dtype=bool)
+    # (minute, trade) 排列讓每一步取用連續記憶體
+    open_t = np.ascontiguousarray(open_np.T)
+    close_t = np.ascontiguousarray(close_np.T)
+    for i in range(int(earliest_entry_idx.min()) + 1, int(lengths.max())):
+        active = (i > earliest_entry_idx) & (i < lengths) & ~done
+        if not active.any():
+            if (done | (i >= lengths)).all():
+                break
+            continue
+        holding = active & (position > 0)
+        exit_price = open_t[i]
+        exit_value = 2 * entry_price - exit_price * 1.003399
+        
+        forced_exit = holding & (i >= partial_exit_idx_3)
+        stop_exit = holding & ~forced_exit & (close_t[i - 1] > trailing_price * (1 + stop_loss_pct))
+        partial_exit = holding & ~forced_exit & ~stop_exit & (
+            (i == partial_exit_idx_1) | (i == partial_exit_idx_2))
+        
+        full_exit = forced_exit | stop_exit
+        trailing_price[stop_exit] = exit_price[stop_exit]
+        cap[full_exit] += position[full_exit] * exit_value[full_exit]
+        position[full_exit] -= position[full_exit]
+        cap[partial_exit] += partial_close_position[partial_exit] * exit_value[partial_exit]
+        position[partial_exit] -= partial_close_position[partial_exit]
+        
+        equity = cap + position * (2 * entry_price - close_t[i] * 1.003399)
+        last_equity[active] = equity[active]
+        done |= active & (position <= 0)
+        if grid is not None:
+            pnl = equity[active] - first_equity[active]
+            exposure = position[active] * close_t[i][active]
+            is_open = (position[active] > 0).astype(np.int32)
+            grid.add(
+                day_idx[active], minute_np[active, i],
+                pnl - last_pnl[active], exposure - last_exposure[active], is_open - last_open[active]
+            )
+            last_pnl[active], last_exposure[active], last_open[active] = pnl, exposure, is_open
+        if counting_enabled():
+            count('batch minute steps')
+            count('trade-minutes stepped', active.sum())
+    
+    count('trades executed', n_trades)
+    return last_equity - first_equity
+
+@instrumented()
+def trade_arrays(
+        filtered_stocks_data: pd.DataFrame,
+        days: np.ndarray,
+        stock_codes: np.ndarray
+    ) -> tuple:
+    """Padded (minute, open, close) arrays and lengths for the given (day, stock_code) trades.
+
+    Rows with any NaN are dropped first, like .loc[day, stock_code].dropna(); minutes
+    past a trade's last bar are padded with 24:00.
+    """
+    day_data = filtered_stocks_data[filtered_stocks_data.notna().all(axis=1)]
+    index = day_data.index
+    
+    # (day, stock_code) 已排序且連續, 以變化點切出每筆交易的列範圍
+    group_change = np.flatnonzero(
+        (index.codes[0][1:] != index.codes[0][:-1]) | (index.codes[1][1:] != index.codes[1][:-1])
+        ) + 1
+    starts = np.r_[0, group_change] if len(index) else np.array([], dtype=int)
+    stops = np.r_[group_change, len(index)] if len(index) else np.array([], dtype=int)
+    groups = pd.MultiIndex.from_arrays([
+        index.levels[0][index.codes[0][starts]],
+        index.levels[1][index.codes[1][starts]]
+        ])
+    group_pos = groups.get_indexer(pd.MultiIndex.from_arrays([days, stock_codes]))
+    if (group_pos < 0).any():
+        missing = group_pos < 0
+        raise KeyError(list(zip(days[missing], stock_codes[missing])))
+    
+    starts, stops = starts[group_pos], stops[group_pos]
+    lengths = stops - starts
+    max_len = int(lengths.max()) if len(lengths) else 0
+    offsets = np.arange(max_len)[None, :]
+    rows = np.minimum(starts[:, None] + offsets, np.maximum(stops[:, None] - 1, 0))
+    
+    if 'Minute' in day_data.columns:
+        minute_of_day = day_data['Minute'].to_numpy()
+    else:
+        # 舊版 filtered_stocks_data 沒有 Minute 欄位
+        ts = index.get_level_values(2)
+        minute_of_day = (ts.hour * 60 + ts.minute).to_numpy()
+    minute_np = np.where(
+        np.arange(max_len)[None, :] < lengths[:, None],
+        minute_of_day[rows],
+        24 * 60
+        )
+    open_np = day_data['Open'].to_numpy()[rows]
+    close_np = day_data['Close'].to_numpy()[rows]
+    return minute_np, open_np, close_np, lengths
+
+def _run_shard(
+        minute_np: np.ndarray,
+        open_np: np.ndarray,
+        close_np: np.ndarray,
+        lengths: np.ndarray,
+        day_idx: Optional[np.ndarray] = None,
+        **params
+    ) -> Union[np.ndarray, Tuple[np.ndarray, int, IntradayGrid]]:
+    """P&L of a shard; with day_idx also (first day, IntradayGrid of the shard's days)."""
+    # 只保留此分片實際用到的分鐘數, 不受其他分片最長交易的 padding 影響
+    max_len = int(lengths.max()) if len(lengths) else 0
+    minute_np, open_np, close_np = minute_np[:, :max_len], open_np[:, :max_len], close_np[:, :max_len]
+    cutoff_idx = session_cutoff_idx(minute_np, params['earliest_entry_time'])
+    if day_idx is None:
+        return execute_strategy_batch(minute_np, open_np, close_np, lengths, cutoff_idx=cutoff_idx, **params)
+    # 分片依日期切開, 每個分片只需要自己那幾天的 grid
+    first_day = int(day_idx[0]) if len(day_idx) else 0
+    grid = IntradayGrid(int(day_idx[-1]) - first_day + 1 if len(day_idx) else 0)
+    ret = execute_strategy_batch(
+        minute_np, open_np, close_np, lengths, cutoff_idx=cutoff_idx, grid=grid, day_idx=day_idx - first_day, **params
+    )
+    return ret, first_day, grid
+
+def _run_shared_shard(spec: dict, lo: int, hi: int, params: dict):
+    blocks, arrays = attach_shared(spec)
+    try:
+        result = _run_shard(
+            arrays['minute'][lo:hi], arrays['open'][lo:hi], arrays['close'][lo:hi], arrays['lengths'][lo:hi],
+            day_idx=arrays['day_idx'][lo:hi].copy() if 'day_idx' in arrays else None,
+            **params
+        )
+        return (result[0].copy(),) + result[1:] if isinstance(result, tuple) else result.copy()
+    finally:
+        del arrays
+        release_shared(blocks, unlink=False)
+
+def shard_bounds(days: np.ndarray, n_shards: int) -> List[Tuple[int, int]]:
+    """[lo, hi) trade ranges of about n_shards date chunks; days must be grouped by date."""
+    day_starts = np.r_[0, np.flatnonzero(days[1:] != days[:-1]) + 1] if len(days) else np.array([], dtype=int)
+    chunks = np.array_split(day_starts, min(n_shards, len(day_starts)) or 1)
+    starts = [int(chunk[0]) for chunk in chunks if len(chunk)]
+    return list(zip(starts, starts[1:] + [len(days)]))
+
+def execute_sharded(
+        minute_np: np.ndarray,
+        open_np: np.ndarray,
+        close_np: np.ndarray,
+        lengths: np.ndarray,
+        bounds: List[Tuple[int, int]],
+        max_workers: Optional[int] = None,
+        use_processes: bool = True,
+        grid: Optional[IntradayGrid] = None,
+        day_idx: Optional[np.ndarray] = None,
+        **params
+    ) -> np.ndarray:
+    """execute_strategy_batch over [lo, hi) trade shards in parallel, concatenated in shard order.
+
+    Processes attach to the arrays in shared memory; threads (use_processes=False) get
+    zero-copy slices but hold the GIL between the numpy calls of each minute step.
+    With grid, every shard fills its own days and they are copied into grid here.
+    """
+    if not bounds:
+        return np.array([], dtype=float)
+    shard_day_idx = (lambda lo, hi: day_idx[lo:hi]) if grid is not None else (lambda lo, hi: None)
+    if not use_processes:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(
+                lambda b: _run_shard(
+                    minute_np[b[0]:b[1]], open_np[b[0]:b[1]], close_np[b[0]:b[1]], lengths[b[0]:b[1]],
+                    day_idx=shard_day_idx(*b),
+                    **params
+                ),
+                bounds
+            ))
+    else:
+        arrays = {'minute': minute_np, 'open': open_np, 'close': close_np, 'lengths': lengths}
+        if grid is not None:
+            arrays['day_idx'] = day_idx
+        blocks, spec = to_shared(arrays)
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(_run_shared_shard, spec, lo, hi, params) for lo, hi in bounds]
+                results = [future.result() for future in futures]
+        finally:
+            release_shared(blocks)
+    if grid is None:
+        return np.concatenate(results)
+    
+    for _, first_day, shard_grid in results:
+        rows = slice(first_day, first_day + len(shard_grid.pnl))
+        grid.pnl[rows] += shard_grid.pnl
+        grid.exposure[rows] += shard_grid.exposure
+        grid.positions[rows] += shard_grid.positions
+    return np.concatenate([result[0] for result in results])
+
 #%%
+@instrumented()
 def backtest(
         filtered_stocks_list: pd.DataFrame,
-        filtered_stocks_data: pd.DataFrame,
+        filtered_stocks_data: Union[pd.DataFrame, TradeTensor],
         start_date: datetime,
         end_date: datetime,
-    ) -> pd.Series:
+        initial_cap: int = 1e5,
+        stop_loss_pct: float = 0.005,
+        earliest_entry_time: Union[int, str] = EARLIEST_ENTRY_MINUTE,
+        max_workers: Optional[int] = 1,
+        n_shards: Optional[int] = None,
+        use_processes: bool = True,
+        return_intraday: bool = False,
+    ) -> Union[pd.Series, Tuple[pd.Series, IntradayGrid]]:
+    """P&L of every (day, stock_code) trade in the date range, indexed by day.
+
+    With max_workers != 1 the trades are split into date shards (n_shards, default
+    4 per worker) that run on a process pool reading the trade arrays from shared
+    memory; the result is identical to the serial run. use_processes=False runs the
+    shards on threads instead, which contend for the GIL on every minute step and
+    only help when each shard holds a very wide batch of trades.
+    filtered_stocks_data can also be an opened trade tensor store.
+    return_intraday=True also returns the IntradayGrid of the portfolio of each day.
+    Raises ValueError naming the (day, stock_code) trades without a bar at/after
+    earliest_entry_time.
+    """
     
-    trading_days = mcal.get_calendar('XTAI').schedule(
-        start_date = start_date, 
-        end_date = end_date
-    ).index.strftime('%Y-%m-%d')
+    sessions = get_sessions(start_date, end_date)
     
-    # (day, ret)
-    ret_list = []
-    for day in trading_days:
-        if day not in filtered_stocks_list.index:
-            continue
-        stock_list = filtered_stocks_list.loc[day, 'stock_list']
-        if len(stock_list) == 0:
-            continue
-        for stock_code in stock_list:
-            day_data = filtered_stocks_data.loc[day, stock_code].dropna()
-            
-            ts_np = day_data.index.strftime('%H:%M').to_numpy()
-            open_np = day_data['Open'].to_numpy()
-            close_np = day_data['Close'].to_numpy()
-            
-            equity = execute_strategy_on_single(ts_np, open_np, close_np)
-            
-            ret = equity.iloc[-1] - equity.iloc[0]
-            
-            ret_list.append((day, ret))
-    
-    index_series, ret_series = zip(*ret_list)
-    ret_series = pd.Series(data=ret_series, index=index_series)
-    
-    # ret_series 以日期為 index
-    ret_series.index = pd.to_datetime(ret_series.index)
+    # (day, stock_code) of every trade, in trading-day then stock_list order
+    list_ids = get_session_ids(filtered_stocks_list.index, start_date, end_date)
+    in_range = np.flatnonzero(list_ids >= 0)
+    in_range = in_range[np.argsort(list_ids[in_range], kind='stable')]
+    # 以列位置展開, 每筆交易同時帶著 session id 與日期 key
+    trades = pd.Series(filtered_stocks_list['stock_list'].to_numpy()[in_range], index=in_range).explode().dropna()
+    rows = trades.index.to_numpy(dtype=np.int64)
+    trade_ids = list_ids[rows]
+    days = filtered_stocks_list.index.to_numpy()[rows]
+    stock_codes = trades.to_numpy()
+    
+    if isinstance(filtered_stocks_data, TradeTensor):
+        minute_np, open_np, close_np, lengths = filtered_stocks_data.trade_arrays(days, stock_codes)
+    else:
+        minute_np, open_np, close_np, lengths = trade_arrays(filtered_stocks_data, days, stock_codes)
+    params = dict(initial_cap=initial_cap, stop_loss_pct=stop_loss_pct, earliest_entry_time=as_minute(earliest_entry_time))
+    last_minute = minute_np[np.arange(len(lengths)), np.maximum(lengths - 1, 0)]
+    no_entry = (lengths == 0) | (last_minute < params['earliest_entry_time'])
+    if no_entry.any():
+        raise ValueError(
+            f'no bar at or after earliest_entry_time for trades {list(zip(days[no_entry], stock_codes[no_entry]))}'
+        )
+    grid = day_idx = None
+    if return_intraday:
+        day_idx, grid_days = pd.factorize(trade_ids)
+        grid = IntradayGrid(len(grid_days))
+        grid.days = sessions[grid_days]
+        grid.capital = np.bincount(day_idx, minlength=len(grid_days)) * float(initial_cap)
+    if max_workers == 1:
+        ret = _run_shard(minute_np, open_np, close_np, lengths, day_idx=day_idx, **params)
+        if grid is not None:
+            # day_idx 從 0 開始, 整個回測就是一個分片
+            ret, _, shard_grid = ret
+            grid.pnl, grid.exposure, grid.positions = shard_grid.pnl, shard_grid.exposure, shard_grid.positions
+    else:
+        ret = execute_sharded(
+            minute_np, open_np, close_np, lengths,
+            shard_bounds(days, n_shards or 4 * (max_workers or os.cpu_count() or 1)),
+            max_workers=max_workers,
+            use_processes=use_processes,
+            grid=grid,
+            day_idx=day_idx,
+            **params
+        )
+    
+    # ret_series 以日期為 index, 直接由 session id 取 DatetimeIndex
+    ret_series = pd.Series(data=ret, index=sessions[trade_ids])
+    if return_intraday:
+        return ret_series, grid
     return ret_series
 
+def summarize_backtest(
+        ret_per_trade: pd.Series,
+        investment_each_trade: float = 1e5
+    ) -> dict:
+    """Return series derived from the per-trade P&L: RoR per trade/day, monthly return, equity."""
+    total_investment = len(ret_per_trade) * investment_each_trade
+    ret_per_day = ret_per_trade.groupby(ret_per_trade.index).sum()
+    ror_per_trade = ret_per_trade/investment_each_trade
+    ror_per_day = ret_per_trade.groupby(ret_per_trade.index).mean()/investment_each_trade
+    
+    # ret_per_week = ret_per_day.resample('W-SAT').sum()
+    
+    ret_per_month = ret_per_day.resample('ME').sum()
+    
+    equity_series = ret_per_day.cumsum() + total_investment
+    
+    return {
+        'total_investment': total_investment,
+        'ret_per_day': ret_per_day,
+        'ror_per_trade': ror_per_trade,
+        'ror_per_day': ror_per_day,
+        'ret_per_month': ret_per_month,
+        'equity_series': equity_series,
+    }
+
+@instrumented()
+def backtest_metrics(summary: dict) -> tuple:
+    """(tradely, daily, equity) metric dicts of a summarize_backtest result; empty if no trades."""
+    if len(summary['ror_per_trade']) == 0:
+        return {}, {}, {}
+    
+    tradely_metrics = sr8.calculate_single_metrics(summary['ror_per_trade'])
+    
+    daily_metrics = sr8.calculate_single_metrics(summary['ror_per_day'])
+    
+    equity_metrics = sr8.calculate_equity_metrics(summary['total_investment'], summary['equity_series'])
+    
+    return tradely_metrics, daily_metrics, equity_metrics
+
 
 #%%
 if __name__ == "__main__":
+    from bootstrap import backtest_confidence_intervals, with_confidence_intervals
+    
     filtered_stocks_list_path = Path('***') # exist path of 'filtered_stocks_list.parquet'
     filtered_stocks_data_path = Path('***') # exist path of 'filtered_stocks_data.parquet'
+    filtered_stocks_tensor_path = Path('***') # exist path of 'filtered_stocks_tensor' (optional, faster to open)
     
     filtered_stocks_list = pd.read_parquet(filtered_stocks_list_path)
-    filtered_stocks_data = pd.read_parquet(filtered_stocks_data_path)
+    if filtered_stocks_tensor_path.exists():
+        filtered_stocks_data = TradeTensor(filtered_stocks_tensor_path)
+    else:
+        filtered_stocks_data = pd.read_parquet(filtered_stocks_data_path)
 
     start_date = '2023-09-01'
     end_date = '2024-10-14'
@@ -116,36 +550,31 @@ if __name__ == "__main__":
     
     investment_each_trade = 1e5
     
-    ret_per_trade = backtest(
+    ret_per_trade, intraday_grid = backtest(
         filtered_stocks_list, 
         filtered_stocks_data, 
         start_date_dt, 
-        end_date_dt
+        end_date_dt,
+        initial_cap=investment_each_trade,
+        return_intraday=True
+    )
+    summary = summarize_backtest(ret_per_trade, investment_each_trade)
+    tradely_metrics, daily_metrics, equity_metrics = backtest_metrics(summary)
+    intraday_metrics = sr8.calculate_intraday_metrics(
+        intraday_grid.equity_frame(),
+        intraday_grid.exposure_frame(),
+        intraday_grid.positions_frame(),
+        intraday_grid.capital
     )
-    total_investment = len(ret_per_trade) * investment_each_trade
-    ret_per_day = ret_per_trade.groupby(ret_per_trade.index).sum()
-    ror_per_trade = ret_per_trade/investment_each_trade
-    ror_per_day = ret_per_trade.groupby(ret_per_trade.index).mean()/investment_each_trade
-    
-    # ret_per_week = ret_per_day.resample('W-SAT').sum()
-    
-    ret_per_month = ret_per_day.resample('ME').sum()
-    
-    equity_series = ret_per_day.cumsum() + total_investment
-    
-    tradely_metrics = sr8.calculate_single_metrics(ror_per_trade)
-    
-    daily_metrics = sr8.calculate_single_metrics(ror_per_day)
-    
-    equity_metrics = sr8.calculate_equity_metrics(total_investment, equity_series)
     
     #%%
-    sr8.plot_monthly_heatplot(ret_per_month, 'Monthly Return')
-    sr8.plot_equity(equity_series)
-    sr8.plot_ret_distribution(ror_per_day, 'Returns (daily)')
-    sr8.plot_ret_distribution(ror_per_trade, 'Returns (tradely)')
-    sr8.print_dict(daily_metrics, 'Performance (daily)')
-    sr8.print_dict(equity_metrics, 'Equity Performance (daily)')
-    sr8.print_dict(tradely_metrics, 'Performance (tradely)')
-    
-    
+    sr8.plot_monthly_heatplot(summary['ret_per_month'], 'Monthly Return')
+    sr8.plot_equity(summary['equity_series'])
+    sr8.plot_ret_distribution(summary['ror_per_day'], 'Returns (daily)')
+    sr8.plot_ret_distribution(summary['ror_per_trade'], 'Returns (tradely)')
+    # 95% bootstrap 信賴區間, 放在各指標下面
+    tradely_ci, daily_ci, equity_ci = backtest_confidence_intervals(summary, max_workers=os.cpu_count())
+    sr8.print_dict(with_confidence_intervals(daily_metrics, daily_ci), 'Performance (daily)')
+    sr8.print_dict(with_confidence_intervals(equity_metrics, equity_ci), 'Equity Performance (daily)')
+    sr8.print_dict(with_confidence_intervals(tradely_metrics, tradely_ci), 'Performance (tradely)')
+    sr8.print_dict(intraday_metrics, 'Intraday Portfolio')
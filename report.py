@@ -0,0 +1,238 @@
+import argparse
+import html
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+import sr8_performance as sr8
+from bootstrap import backtest_confidence_intervals, with_confidence_intervals
+from main_backtest import backtest_metrics, summarize_backtest
+
+IMAGE_FORMATS = ('png', 'svg')
+REPORT_FORMATS = ('html', 'md')
+# 總覽頁每個策略列出的指標: (表格, 指標)
+INDEX_METRICS = (
+    ('Equity Performance (daily)', 'Total RoR'),
+    ('Equity Performance (daily)', 'Sharpe ratio'),
+    ('Equity Performance (daily)', 'MDD'),
+    ('Performance (tradely)', 'WR'),
+    ('Performance (tradely)', 'Trade times'),
+)
+
+# --- tables --------------------------------------------------------------------------
+
+def format_value(value) -> str:
+    """A metric value formatted the way sr8.print_dict prints it."""
+    if isinstance(value, (float, np.floating)):
+        return f'{value:.2e}' if abs(value) < 1e-2 else f'{value:.2f}'
+    if isinstance(value, (int, np.integer)):
+        return f'{value:d}'
+    return str(value)
+
+def markdown_table(metrics: dict, key_str: str) -> str:
+    lines = [f'| {key_str} | Value |', '| --- | ---: |']
+    lines += [f'| {str(key).strip()} | {format_value(value)} |' for key, value in metrics.items()]
+    return '\n'.join(lines)
+
+def html_table(metrics: dict, key_str: str) -> str:
+    rows = ''.join(
+        f'<tr><td>{html.escape(str(key).strip())}</td><td class="num">{format_value(value)}</td></tr>'
+        for key, value in metrics.items()
+        )
+    return f'<table><thead><tr><th>{html.escape(key_str)}</th><th>Value</th></tr></thead><tbody>{rows}</tbody></table>'
+
+HTML_STYLE = (
+    'body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin:1em 0}'
+    'td,th{border:1px solid #ccc;padding:2px 8px}td.num{text-align:right}img{max-width:100%}'
+)
+
+def write_document(
+        path: Path,
+        title: str,
+        tables: Dict[str, dict],
+        figures: Dict[str, Path],
+        report_format: str = 'html'
+    ) -> Path:
+    """One HTML or Markdown file with the tables followed by the figures (linked relatively)."""
+    path = Path(path)
+    if report_format == 'md':
+        parts = [f'# {title}']
+        parts += [markdown_table(metrics, key_str) for key_str, metrics in tables.items() if metrics]
+        parts += [f'![{name}]({figure.relative_to(path.parent).as_posix()})' for name, figure in figures.items()]
+        text = '\n\n'.join(parts) + '\n'
+    else:
+        body = [f'<h1>{html.escape(title)}</h1>']
+        body += [html_table(metrics, key_str) for key_str, metrics in tables.items() if metrics]
+        body += [
+            f'<h2>{html.escape(name)}</h2><img src="{html.escape(figure.relative_to(path.parent).as_posix())}">'
+            for name, figure in figures.items()
+            ]
+        text = (
+            f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+            f'<style>{HTML_STYLE}</style></head><body>{"".join(body)}</body></html>\n'
+        )
+    path.write_text(text, encoding='utf-8')
+    return path
+
+# --- figures -------------------------------------------------------------------------
+
+def render_figures(summary: dict, output_dir: Path, image_format: str = 'png', dpi: int = 100) -> Dict[str, Path]:
+    """Save the sr8 charts of a summarize_backtest result as image files; nothing is shown.
+
+    With show=False the charts are plain matplotlib Figures outside pyplot, so no display
+    is needed and the caller's backend is left alone.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if summary['ror_per_trade'].empty:
+        return {}
+    charts = {
+        # plot_monthly_heatplot 會改寫傳入 series 的 index
+        'Monthly Return': lambda: sr8.plot_monthly_heatplot(summary['ret_per_month'].copy(), 'Monthly Return', show=False),
+        'Equity': lambda: sr8.plot_equity(summary['equity_series'], show=False),
+        'Returns (daily)': lambda: sr8.plot_ret_distribution(summary['ror_per_day'], 'Returns (daily)', show=False),
+        'Returns (tradely)': lambda: sr8.plot_ret_distribution(summary['ror_per_trade'], 'Returns (tradely)', show=False),
+    }
+    figures = {}
+    for name, draw in charts.items():
+        fig = draw()
+        figure_path = output_dir / f"{name.lower().replace(' ', '_').replace('(', '').replace(')', '')}.{image_format}"
+        fig.savefig(figure_path, format=image_format, dpi=dpi)
+        figures[name] = figure_path
+    return figures
+
+# --- reports -------------------------------------------------------------------------
+
+def render_backtest_report(
+        name: str,
+        ret_per_trade: pd.Series,
+        output_dir: Path,
+        investment_each_trade: float = 1e5,
+        image_format: str = 'png',
+        report_format: str = 'html',
+        bootstrap_resamples: int = 0
+    ) -> dict:
+    """Figures and metric tables of one backtest under output_dir/name.
+
+    Returns {'name', 'path', 'tables'}; bootstrap_resamples > 0 adds 95% CI rows.
+    """
+    report_dir = Path(output_dir) / name
+    summary = summarize_backtest(ret_per_trade, investment_each_trade)
+    tradely_metrics, daily_metrics, equity_metrics = backtest_metrics(summary)
+    if bootstrap_resamples:
+        tradely_ci, daily_ci, equity_ci = backtest_confidence_intervals(summary, n_resamples=bootstrap_resamples)
+        tradely_metrics = with_confidence_intervals(tradely_metrics, tradely_ci)
+        daily_metrics = with_confidence_intervals(daily_metrics, daily_ci)
+        equity_metrics = with_confidence_intervals(equity_metrics, equity_ci)
+    tables = {
+        'Performance (daily)': daily_metrics,
+        'Equity Performance (daily)': equity_metrics,
+        'Performance (tradely)': tradely_metrics,
+    }
+    figures = render_figures(summary, report_dir, image_format)
+    path = write_document(report_dir / f'report.{report_format}', name, tables, figures, report_format)
+    return {'name': name, 'path': path, 'tables': tables}
+
+def _render_task(kwargs: dict) -> dict:
+    return render_backtest_report(**kwargs)
+
+def render_reports(
+        backtests: Dict[str, pd.Series],
+        output_dir: Path,
+        investment_each_trade: float = 1e5,
+        image_format: str = 'png',
+        report_format: str = 'html',
+        bootstrap_resamples: int = 0,
+        max_workers: Optional[int] = None
+    ) -> Path:
+    """One report per {name: ret_per_trade} plus an index page comparing them.
+
+    Reports are rendered in a process pool; max_workers=1 renders in-process. Neither
+    needs a display or changes the matplotlib backend. Returns the path of the index page.
+    """
+    if image_format not in IMAGE_FORMATS or report_format not in REPORT_FORMATS:
+        raise ValueError(f'image_format must be one of {IMAGE_FORMATS} and report_format one of {REPORT_FORMATS}')
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tasks = [
+        {
+            'name': name,
+            'ret_per_trade': ret_per_trade,
+            'output_dir': output_dir,
+            'investment_each_trade': investment_each_trade,
+            'image_format': image_format,
+            'report_format': report_format,
+            'bootstrap_resamples': bootstrap_resamples,
+        }
+        for name, ret_per_trade in backtests.items()
+        ]
+
+    if max_workers == 1 or len(tasks) <= 1:
+        results = [_render_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_render_task, tasks))
+    return write_index(results, output_dir / f'index.{report_format}', report_format)
+
+def write_index(results: List[dict], path: Path, report_format: str = 'html') -> Path:
+    """Overview page: one row of INDEX_METRICS per report, linking to it."""
+    headers = ['Strategy'] + [metric for _, metric in INDEX_METRICS]
+    rows = []
+    for result in results:
+        link = result['path'].relative_to(path.parent).as_posix()
+        values = [format_value(result['tables'][table].get(metric, '')) for table, metric in INDEX_METRICS]
+        rows.append((result['name'], link, values))
+
+    title = f"Backtest reports ({datetime.now().strftime('%Y-%m-%d %H:%M')})"
+    if report_format == 'md':
+        lines = [f'# {title}', '', '| ' + ' | '.join(headers) + ' |', '| --- |' + ' ---: |' * (len(headers) - 1)]
+        lines += [f'| [{name}]({link}) | ' + ' | '.join(values) + ' |' for name, link, values in rows]
+        text = '\n'.join(lines) + '\n'
+    else:
+        head = ''.join(f'<th>{html.escape(header)}</th>' for header in headers)
+        body = ''.join(
+            f'<tr><td><a href="{html.escape(link)}">{html.escape(name)}</a></td>'
+            + ''.join(f'<td class="num">{value}</td>' for value in values) + '</tr>'
+            for name, link, values in rows
+            )
+        text = (
+            f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+            f'<style>{HTML_STYLE}</style></head><body><h1>{html.escape(title)}</h1>'
+            f'<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table></body></html>\n'
+        )
+    path.write_text(text, encoding='utf-8')
+    return path
+
+def _backtest_name(path: Path) -> str:
+    # run_pipeline 的 checkpoint 目錄裡檔名固定是 ret_per_trade.parquet, 改用目錄名
+    return path.parent.name if path.stem == 'ret_per_trade' else path.stem
+
+
+#%%
+if __name__ == "__main__":
+    # python report.py --output reports run_a/ret_per_trade.parquet run_b/ret_per_trade.parquet ...
+    parser = argparse.ArgumentParser(description='Render backtest reports without a display.')
+    parser.add_argument('ret_per_trade', nargs='+', type=Path, help="parquet files with a 'ret' column")
+    parser.add_argument('--output', type=Path, required=True, help='directory of the reports')
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='html')
+    parser.add_argument('--image-format', choices=IMAGE_FORMATS, default='png')
+    parser.add_argument('--investment-each-trade', type=float, default=1e5)
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N', help='add bootstrap CIs from N resamples')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    backtests = {_backtest_name(path): pd.read_parquet(path)['ret'] for path in args.ret_per_trade}
+    start_time = datetime.now()
+    index_path = render_reports(
+        backtests,
+        args.output,
+        investment_each_trade=args.investment_each_trade,
+        image_format=args.image_format,
+        report_format=args.format,
+        bootstrap_resamples=args.bootstrap,
+        max_workers=args.max_workers
+    )
+    print(f'{len(backtests)} reports in {datetime.now() - start_time}: {index_path}')
@@ -0,0 +1,179 @@
+import warnings
+from collections import deque
+from typing import Optional, Tuple
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import sr8_performance as sr8
+
+# 監控用的指標, 名稱與 calculate_single_metrics / calculate_equity_metrics 相同;
+# 'MDD since start' 不是視窗內的 MDD, 是從第一天累計的最大回撤
+ROLLING_METRICS = ('RoR mean', 'RoR volatility', 'Sharpe ratio', 'Sortino ratio', 'WR', 'DD', 'MDD since start')
+
+class _WindowMoments:
+    """Mean and sum of squared deviations of a sliding window (Welford add/remove)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x: float):
+        if self.n <= 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        old_mean = self.mean
+        self.n -= 1
+        self.mean -= (x - old_mean) / self.n
+        self.m2 = max(self.m2 - (x - old_mean) * (x - self.mean), 0.0)
+
+    def std(self) -> float:
+        # 與 pandas .std() 相同: ddof=1, 少於兩筆為 NaN
+        return np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan
+
+class RollingMetrics:
+    """Rolling metrics of a daily P&L stream (ret_per_day), updated in O(1) per day.
+
+    The equity is total_investment plus the cumulative P&L, as in summarize_backtest.
+    Over the last `window` days of equity returns it keeps running moments for RoR
+    mean / volatility / Sharpe / Sortino and a count of winning days for WR. 'DD' is
+    the drawdown of the latest equity from the window's peak (monotonic deque, amortized
+    O(1)) and 'MDD since start' the maximum drawdown from the running peak since the
+    first update; the window's own MDD is in window_metrics().
+    rolling_metrics() computes the same history in one vectorized pass.
+    """
+
+    def __init__(self, window: int, total_investment: float):
+        self.window = window
+        self.total_investment = total_investment
+        self.equity = float(total_investment)
+        self.rets = _WindowMoments()
+        self.loss_rets = _WindowMoments()
+        self.n_wins = 0
+        # 視窗內的 (ret, 報酬率, 權益), 由舊到新; 視窗前一天的權益另外記
+        self.days: deque = deque()
+        self.equity_before_window = float(total_investment)
+        self._peaks: deque = deque()  # (第幾天, 權益), 權益遞減
+        self.n_updates = 0
+        self.running_peak = np.nan
+        self.mdd = 0.0
+
+    @classmethod
+    def from_history(cls, ret_per_day: pd.Series, total_investment: float, window: int) -> 'RollingMetrics':
+        rolling = cls(window, total_investment)
+        for ret in ret_per_day.to_numpy(dtype=float):
+            rolling.update(ret)
+        return rolling
+
+    def update(self, ret: float) -> dict:
+        """Add one day's P&L and return the metrics of the new window."""
+        equity = self.equity + ret
+        ror = equity / self.equity - 1
+        self.equity = equity
+
+        if len(self.days) == self.window:
+            old_ret, old_ror, old_equity = self.days.popleft()
+            self.rets.remove(old_ror)
+            if old_ror < 0:
+                self.loss_rets.remove(old_ror)
+            self.n_wins -= old_ret > 0
+            self.equity_before_window = old_equity
+        self.days.append((ret, ror, equity))
+        self.rets.add(ror)
+        if ror < 0:
+            self.loss_rets.add(ror)
+        self.n_wins += ret > 0
+
+        while self._peaks and self._peaks[-1][1] <= equity:
+            self._peaks.pop()
+        self._peaks.append((self.n_updates, equity))
+        if self._peaks[0][0] <= self.n_updates - self.window:
+            self._peaks.popleft()
+        self.n_updates += 1
+
+        self.running_peak = equity if np.isnan(self.running_peak) else max(self.running_peak, equity)
+        self.mdd = max(self.mdd, (self.running_peak - equity) / self.running_peak)
+        return self.metrics()
+
+    def metrics(self) -> dict:
+        if not self.days:
+            return {}
+        rets_mean = self.rets.mean
+        rets_std = self.rets.std()
+        loss_std = self.loss_rets.std()
+        window_peak = self._peaks[0][1]
+        return {
+            'RoR mean': rets_mean,
+            'RoR volatility': rets_std,
+            'Sharpe ratio': rets_mean / rets_std if rets_std != 0 else 0,
+            'Sortino ratio': rets_mean / loss_std if loss_std != 0 else 0,
+            'WR': self.n_wins / len(self.days),
+            'DD': (window_peak - self.equity) / window_peak,
+            'MDD since start': self.mdd,
+        }
+
+    def window_metrics(self) -> Tuple[dict, dict]:
+        """Full calculate_single_metrics / calculate_equity_metrics of the current window.
+
+        Costs O(window); the equity metrics start from the equity the day before the
+        window, so their returns are the ones the running moments use.
+        """
+        rets = pd.Series([ret for ret, _, _ in self.days], dtype=float)
+        equity = pd.Series([equity for _, _, equity in self.days], dtype=float)
+        if rets.empty:
+            return {}, {}
+        return (
+            sr8.calculate_single_metrics(rets),
+            sr8.calculate_equity_metrics(self.equity_before_window, equity),
+        )
+
+def rolling_metrics(
+        ret_per_day: pd.Series,
+        total_investment: float,
+        window: int,
+        min_periods: Optional[int] = None
+    ) -> pd.DataFrame:
+    """History of RollingMetrics.metrics() for every day, in one vectorized pass.
+
+    Days with fewer than min_periods (default: window) days in their window are NaN.
+    """
+    ret = ret_per_day.to_numpy(dtype=float)
+    min_periods = window if min_periods is None else min_periods
+    equity = np.cumsum(ret) + total_investment
+    ror = equity / np.r_[total_investment, equity[:-1]] - 1
+
+    # 前面補 NaN, 讓前 window-1 天也有 (較短的) 視窗
+    pad = np.full(window - 1, np.nan)
+    ror_windows = sliding_window_view(np.r_[pad, ror], window, axis=0)
+    ret_windows = sliding_window_view(np.r_[pad, ret], window, axis=0)
+    equity_windows = sliding_window_view(np.r_[pad, equity], window, axis=0)
+    counts = (~np.isnan(ror_windows)).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        rets_mean = np.nanmean(ror_windows, axis=1)
+        rets_std = np.nanstd(ror_windows, axis=1, ddof=1)
+        loss_std = np.nanstd(np.where(ror_windows < 0, ror_windows, np.nan), axis=1, ddof=1)
+        window_peak = np.nanmax(equity_windows, axis=1)
+        running_peak = np.maximum.accumulate(equity)
+        history = pd.DataFrame(
+            {
+                'RoR mean': rets_mean,
+                'RoR volatility': rets_std,
+                'Sharpe ratio': np.where(rets_std != 0, rets_mean / rets_std, 0),
+                'Sortino ratio': np.where(loss_std != 0, rets_mean / loss_std, 0),
+                'WR': (ret_windows > 0).sum(axis=1) / counts,
+                'DD': (window_peak - equity) / window_peak,
+                'MDD since start': np.maximum.accumulate((running_peak - equity) / running_peak),
+            },
+            index=ret_per_day.index
+            )
+    history[counts < min_periods] = np.nan
+    return history
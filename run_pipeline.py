@@ -0,0 +1,108 @@
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+import pandas as pd
+
+import sr8_performance as sr8
+from construct_basic_data import combine_stock_data, csv_file_sizes, write_minute_store
+from construct_filtered_stocks import DEFAULT_FILTER_PARAMS, filter_criteria, process_filtered_stocks, select_stocks_from_daily
+from main_backtest import DEFAULT_EXECUTION_PARAMS, EXECUTION_PARAMS, backtest, backtest_metrics, summarize_backtest
+from stage_cache import StageCache, backtest_stage, combine_stage, criteria_stage, slice_stage
+
+def run_pipeline(
+        data_folder: Path,
+        stocks_list: List[str],
+        data_start: str,
+        data_end: str,
+        filter_start: str,
+        filter_end: str,
+        backtest_start: str,
+        backtest_end: str,
+        params: Optional[dict] = None,
+        max_workers: Optional[int] = 1,
+        checkpoint_dir: Optional[Path] = None,
+        cache: Optional[StageCache] = None
+    ) -> dict:
+    """Ingestion -> criteria -> slice extraction -> backtest -> sr8 metrics in one process.
+
+    Every stage gets the previous stage's objects directly. params overrides
+    DEFAULT_FILTER_PARAMS and DEFAULT_EXECUTION_PARAMS. With checkpoint_dir each stage
+    is also written under the file names the three scripts use; with cache the stages
+    go through a StageCache.
+    """
+    params = {**DEFAULT_FILTER_PARAMS, **DEFAULT_EXECUTION_PARAMS, **(params or {})}
+    criteria = filter_criteria(params)
+    exec_params = {name: params[name] for name in EXECUTION_PARAMS}
+    backtest_start_dt = datetime.strptime(backtest_start, '%Y-%m-%d')
+    backtest_end_dt = datetime.strptime(backtest_end, '%Y-%m-%d')
+    file_sizes = csv_file_sizes(data_folder) if checkpoint_dir is not None else None
+
+    if cache is None:
+        all_stocks, all_stocks_daily = combine_stock_data(data_folder, data_start, data_end, max_workers=max_workers)
+        filtered_stocks_list = select_stocks_from_daily(all_stocks_daily, stocks_list, filter_start, filter_end, criteria)
+        filtered_stocks_data = process_filtered_stocks(filtered_stocks_list, all_stocks)
+        ret_per_trade = backtest(
+            filtered_stocks_list, filtered_stocks_data, backtest_start_dt, backtest_end_dt, **exec_params
+        )
+    else:
+        all_stocks, all_stocks_daily = combine_stage(cache, data_folder, data_start, data_end, max_workers)
+        filtered_stocks_list = criteria_stage(cache, all_stocks_daily, stocks_list, filter_start, filter_end, criteria)
+        filtered_stocks_data = slice_stage(cache, filtered_stocks_list, all_stocks)
+        ret_per_trade = backtest_stage(
+            cache, filtered_stocks_list, filtered_stocks_data, backtest_start_dt, backtest_end_dt, **exec_params
+        )
+        all_stocks, all_stocks_daily, filtered_stocks_list, filtered_stocks_data, ret_per_trade = (
+            result.value for result in
+            (all_stocks, all_stocks_daily, filtered_stocks_list, filtered_stocks_data, ret_per_trade)
+        )
+
+    if checkpoint_dir is not None:
+        # 只在需要時落地, 檔名與三支腳本相同
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        write_minute_store(all_stocks, checkpoint_dir / 'all_stocks.parquet', file_sizes)
+        all_stocks_daily.to_parquet(checkpoint_dir / 'all_stocks_daily.parquet')
+        filtered_stocks_list.to_parquet(checkpoint_dir / 'filtered_stocks_list.parquet')
+        filtered_stocks_data.to_parquet(checkpoint_dir / 'filtered_stocks_data.parquet')
+        ret_per_trade.to_frame('ret').to_parquet(checkpoint_dir / 'ret_per_trade.parquet')
+
+    summary = summarize_backtest(ret_per_trade, exec_params['initial_cap'])
+    tradely_metrics, daily_metrics, equity_metrics = backtest_metrics(summary)
+    return {
+        'all_stocks_daily': all_stocks_daily,
+        'filtered_stocks_list': filtered_stocks_list,
+        'filtered_stocks_data': filtered_stocks_data,
+        'ret_per_trade': ret_per_trade,
+        'summary': summary,
+        'tradely_metrics': tradely_metrics,
+        'daily_metrics': daily_metrics,
+        'equity_metrics': equity_metrics,
+    }
+
+
+#%%
+if __name__ == "__main__":
+    data_folder = Path('***') # exist path of 'k_data/永豐'
+    mid_stocks_list_path = Path('***') # exit path of 'mid_stocks_list.feather'
+    checkpoint_dir = None # Path('***') to also write every stage's parquet
+    use_cache = True # reuse unchanged stages from .cache/stages
+
+    mid_stocks_list = pd.read_feather(mid_stocks_list_path)['stock_code'].astype(str).tolist()
+    result = run_pipeline(
+        data_folder,
+        mid_stocks_list,
+        '2021-01-01', '2024-10-14',
+        '2023-08-01', '2024-10-14',
+        '2023-09-01', '2024-10-14',
+        params={'top_n': 100, 'stop_loss_pct': 0.005},
+        max_workers=os.cpu_count(),
+        checkpoint_dir=checkpoint_dir,
+        cache=StageCache() if use_cache else None
+    )
+
+    #%%
+    sr8.plot_monthly_heatplot(result['summary']['ret_per_month'], 'Monthly Return')
+    sr8.plot_equity(result['summary']['equity_series'])
+    sr8.print_dict(result['daily_metrics'], 'Performance (daily)')
+    sr8.print_dict(result['equity_metrics'], 'Equity Performance (daily)')
+    sr8.print_dict(result['tradely_metrics'], 'Performance (tradely)')
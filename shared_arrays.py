@@ -0,0 +1,32 @@
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+import numpy as np
+
+# 在行程間共用 numpy 陣列: 父行程複製一次到 shared memory, 子行程只 attach 不複製
+SharedSpec = Dict[str, Tuple[str, tuple, str]]
+
+def to_shared(arrays: Dict[str, np.ndarray]) -> Tuple[List[shared_memory.SharedMemory], SharedSpec]:
+    """Copy arrays into shared memory blocks; returns the blocks and a picklable spec."""
+    blocks, spec = [], {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        spec[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, spec
+
+def attach_shared(spec: SharedSpec) -> Tuple[List[shared_memory.SharedMemory], Dict[str, np.ndarray]]:
+    """Zero-copy views of the arrays described by spec; keep the blocks alive while using them."""
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return blocks, arrays
+
+def release_shared(blocks: List[shared_memory.SharedMemory], unlink: bool = True):
+    """Close the blocks and, in the owning process, free them."""
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
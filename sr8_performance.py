@@ -1,9 +1,15 @@
+import warnings
 import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
-def plot_ret_distribution(ret_series: pd.Series, title_str: str):
+def _new_figure(show: bool, **kwargs) -> Figure:
+    # show=False 不經過 pyplot: 不必切換 backend, 圖也不會留在 pyplot 裡
+    return plt.figure(**kwargs) if show else Figure(**kwargs)
+
+def plot_ret_distribution(ret_series: pd.Series, title_str: str, show: bool = True):
     # Ensure 0 is a bin edge and bins have equal width
     min_ret = ret_series.min()
     max_ret = ret_series.max()
@@ -23,9 +29,8 @@ def plot_ret_distribution(ret_series: pd.Series, title_str: str):
         bin_edges = np.insert(bin_edges, np.searchsorted(bin_edges, 0), 0)
 
     # Create figure and axes
-    fig, (ax1, ax2) = plt.subplots(nrows=2, sharex=True,
-                                   gridspec_kw={'height_ratios': [4, 1]},
-                                   figsize=(12, 8))
+    fig = _new_figure(show, figsize=(12, 8))
+    ax1, ax2 = fig.subplots(nrows=2, sharex=True, gridspec_kw={'height_ratios': [4, 1]})
 
     # Plot histogram with different colors for positive and negative values
     ax1.hist([ret_series[ret_series < 0], ret_series[ret_series > 0]], bins=bin_edges,
@@ -63,11 +68,13 @@ def plot_ret_distribution(ret_series: pd.Series, title_str: str):
     ax2.grid(True, linestyle='--', linewidth=0.5)
 
     # Adjust layout
-    plt.tight_layout(rect=[0, 0.03, 1, 0.95])
+    fig.tight_layout(rect=[0, 0.03, 1, 0.95])
 
-    plt.show()
+    if show:
+        plt.show()
+    return fig
 
-def plot_monthly_heatplot(series_per_month: pd.Series, title_str: str):
+def plot_monthly_heatplot(series_per_month: pd.Series, title_str: str, show: bool = True):
     series_per_month.index = pd.to_datetime(series_per_month.index)
     
     # Use pivot_table to rearrange data into a DataFrame structured by year and month
@@ -76,14 +83,17 @@ def plot_monthly_heatplot(series_per_month: pd.Series, title_str: str):
         ).sum().unstack()
 
     # Plot heatmap
-    plt.figure(figsize=(10, 6))
-    sns.heatmap(ret_per_month_df, annot=False, fmt=".2f", cmap="coolwarm", linewidths=0.5)
+    fig = _new_figure(show, figsize=(10, 6))
+    ax = fig.subplots()
+    sns.heatmap(ret_per_month_df, annot=False, fmt=".2f", cmap="coolwarm", linewidths=0.5, ax=ax)
     
     # Set title and axis labels
-    plt.title(f'{title_str}')
-    plt.xlabel('Month')
-    plt.ylabel('Year')
-    plt.show()
+    ax.set_title(f'{title_str}')
+    ax.set_xlabel('Month')
+    ax.set_ylabel('Year')
+    if show:
+        plt.show()
+    return fig
 
 def calculate_single_metrics(ret_series: pd.Series) -> dict:
     """
@@ -161,7 +171,236 @@ def calculate_equity_metrics(total_investment: int, equity_series: pd.Series) ->
         'Calmar ratio': calmar_ratio,
     }
 
-def plot_equity(equity: pd.Series):
+def drawdown_runs(equity_np: np.ndarray, lengths: np.ndarray = None) -> dict:
+    """Run-length encode the drawdowns of every column of a (time, series) equity array.
+
+    Columns are top-aligned; rows at or past a column's length (default: its count of
+    non-NaN values) are ignored. A drawdown runs from the first bar below the running
+    max to the bar that makes a new high, or to the last bar if it never recovers.
+    Returns flat arrays, one entry per drawdown, ordered by column then start:
+    column, start, end, duration (end - start, in bars) and depth (min of
+    equity / running max - 1 inside the run).
+    """
+    equity_np = np.asarray(equity_np, dtype=float)
+    if equity_np.ndim == 1:
+        equity_np = equity_np[:, None]
+    n_rows, n_cols = equity_np.shape
+    if lengths is None:
+        lengths = (~np.isnan(equity_np)).sum(axis=0)
+    valid = np.arange(n_rows)[:, None] < lengths[None, :]
+
+    cummax = np.fmax.accumulate(equity_np, axis=0)
+    below = valid & ~(equity_np == cummax)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dd = np.where(valid, equity_np / cummax - 1, np.nan)
+
+    # 每欄上下補 False 後取差分: +1 為回撤開始, -1 為回到新高
+    edges = np.diff(np.vstack([np.zeros((1, n_cols), bool), below, np.zeros((1, n_cols), bool)]).astype(np.int8), axis=0)
+    start_col, start = np.nonzero(edges.T == 1)
+    _, stop = np.nonzero(edges.T == -1)
+    # 最後仍在回撤中: 以最後一根為結束
+    end = np.minimum(stop, lengths[start_col] - 1)
+
+    flat = np.r_[dd.T.ravel(), np.nan]
+    bounds = np.c_[start_col * n_rows + start, start_col * n_rows + stop].ravel()
+    depth = np.fmin.reduceat(flat, bounds)[::2] if len(bounds) else np.zeros(0)
+    return {
+        'column': start_col,
+        'start': start,
+        'end': end,
+        'duration': end - start,
+        'depth': depth,
+    }
+
+def drawdown_periods(equity: pd.Series) -> pd.DataFrame:
+    """Drawdown periods of one equity curve: start, end (index labels), duration and depth."""
+    runs = drawdown_runs(equity.to_numpy(dtype=float), np.array([len(equity)]))
+    return pd.DataFrame({
+        'start': equity.index[runs['start']],
+        'end': equity.index[runs['end']],
+        'duration': runs['duration'],
+        'depth': runs['depth'],
+    })
+
+def stack_series(series_list: list) -> tuple:
+    """Top-align series of different lengths into a (time, series) array padded with NaN."""
+    lengths = np.array([len(series) for series in series_list], dtype=np.int64)
+    stacked = np.full((int(lengths.max()) if len(lengths) else 0, len(series_list)), np.nan)
+    for col, series in enumerate(series_list):
+        stacked[:len(series), col] = np.asarray(series, dtype=float)
+    return stacked, lengths
+
+def _column_quantiles(values: np.ndarray, counts: np.ndarray, qs: tuple) -> list:
+    """Linear-interpolated quantiles of the non-NaN values of each column.
+
+    Same interpolation as np.quantile / Series.quantile, with one sort for all columns
+    instead of np.nanquantile's per-column loop.
+    """
+    sorted_np = np.sort(values, axis=0)  # NaN 排在最後
+    cols = np.arange(values.shape[1])
+    result = []
+    for q in qs:
+        pos = q * (counts - 1)
+        lo = np.clip(np.floor(pos).astype(np.int64), 0, None)
+        hi = np.clip(np.ceil(pos).astype(np.int64), 0, None)
+        if len(values) == 0:
+            result.append(np.full(len(cols), np.nan))
+            continue
+        a = sorted_np[np.minimum(lo, len(values) - 1), cols]
+        b = sorted_np[np.minimum(hi, len(values) - 1), cols]
+        t = pos - np.floor(pos)
+        diff = b - a
+        # numpy 的 _lerp: t >= 0.5 時從上端回推, 結果逐位元相同
+        quantile = np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+        result.append(np.where(counts > 0, quantile, np.nan))
+    return result
+
+def batch_single_metrics(rets_np: np.ndarray) -> dict:
+    """calculate_single_metrics for every column of a (time, series) array at once.
+
+    NaN entries are treated as missing, so series of different lengths can be
+    NaN-padded. Each metric is an array with one value per column (NaN if empty).
+    """
+    rets_np = np.asarray(rets_np, dtype=float)
+    if rets_np.ndim == 1:
+        rets_np = rets_np[:, None]
+    valid = ~np.isnan(rets_np)
+    trade_times = valid.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        # 空的欄位 (沒有交易) 得到 NaN, 不需要警告
+        warnings.simplefilter('ignore', RuntimeWarning)
+        ret_mean = np.nansum(rets_np, axis=0) / trade_times
+        
+        q1, ret_median, q99 = _column_quantiles(rets_np, trade_times, (0.01, 0.5, 0.99))
+        in_trim = valid & (rets_np >= q1) & (rets_np <= q99)
+        ret_trimmed_mean = np.where(in_trim, rets_np, 0).sum(axis=0) / in_trim.sum(axis=0)
+        
+        profit = valid & (rets_np > 0)
+        loss = valid & (rets_np < 0)
+        ret_win_rate = profit.sum(axis=0) / trade_times
+        mean_profit_trades = np.where(profit.any(axis=0), np.where(profit, rets_np, 0).sum(axis=0) / profit.sum(axis=0), 0)
+        mean_loss_trades = np.where(loss.any(axis=0), -np.where(loss, rets_np, 0).sum(axis=0) / loss.sum(axis=0), 0)
+        ret_pl_ratio = np.where(mean_loss_trades > 0, mean_profit_trades / mean_loss_trades, np.inf)
+    
+    return {
+        'Mean': ret_mean,
+        'Trimmed mean': ret_trimmed_mean,
+        'Median': ret_median,
+        'WR': ret_win_rate,
+        'PL ratio': ret_pl_ratio,
+        'Trade times': trade_times
+    }
+
+def batch_equity_metrics(total_investment, equity_np: np.ndarray, lengths: np.ndarray = None) -> dict:
+    """calculate_equity_metrics for every column of a top-aligned (time, series) equity array.
+
+    total_investment is a scalar or one value per column. Besides the metrics of
+    calculate_equity_metrics, the longest drawdown (in bars) and the number of
+    drawdowns are returned, from drawdown_runs.
+    """
+    equity_np = np.asarray(equity_np, dtype=float)
+    if equity_np.ndim == 1:
+        equity_np = equity_np[:, None]
+    n_rows, n_cols = equity_np.shape
+    if lengths is None:
+        lengths = (~np.isnan(equity_np)).sum(axis=0)
+    total_investment = np.broadcast_to(np.asarray(total_investment, dtype=float), (n_cols,))
+    valid = np.arange(n_rows)[:, None] < lengths[None, :]
+    cols = np.arange(n_cols)
+    
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # Calculate daily returns
+        rets = np.full(equity_np.shape, np.nan)
+        rets[1:] = equity_np[1:] / equity_np[:-1] - 1
+        rets[0] = equity_np[0] / total_investment - 1
+        rets[~valid] = np.nan
+        
+        rets_mean = np.nanmean(rets, axis=0) if n_rows else np.full(n_cols, np.nan)
+        rets_std = np.nanstd(rets, axis=0, ddof=1) if n_rows else np.full(n_cols, np.nan)
+        
+        # Sharpe ratio
+        sharpe_ratio = np.where(rets_std != 0, rets_mean / rets_std, 0)
+        
+        # Max Drawdown (MDD)
+        equity_cummax = np.fmax.accumulate(equity_np, axis=0)
+        equity_DDs = np.where(valid, (equity_np - equity_cummax) / equity_cummax, np.nan)
+        equity_MDD = -np.nanmin(equity_DDs, axis=0) if n_rows else np.full(n_cols, np.nan)
+        
+        # Total Return
+        last_equity = equity_np[np.maximum(lengths - 1, 0), cols] if n_rows else np.full(n_cols, np.nan)
+        total_ror = last_equity / total_investment - 1
+        
+        # Calmar ratio
+        calmar_ratio = np.where(equity_MDD != 0, total_ror / equity_MDD, 0)
+        
+        # Sortino ratio
+        negative_rets = np.where(rets < 0, rets, np.nan)
+        loss_std = np.nanstd(negative_rets, axis=0, ddof=1) if n_rows else np.full(n_cols, np.nan)
+        sortino_ratio = np.where(loss_std != 0, rets_mean / loss_std, 0)
+    
+    runs = drawdown_runs(equity_np, lengths)
+    longest_dd = np.zeros(n_cols, dtype=np.int64)
+    np.maximum.at(longest_dd, runs['column'], runs['duration'])
+    
+    return {
+        'Total investment': total_investment,
+        'Total RoR': total_ror,
+        'RoR mean': rets_mean,
+        'RoR volatility': rets_std,
+        'MDD': equity_MDD,
+        'Sharpe ratio': sharpe_ratio,
+        'Sortino ratio': sortino_ratio,
+        'Calmar ratio': calmar_ratio,
+        'Longest DD': longest_dd,
+        'DD count': np.bincount(runs['column'], minlength=n_cols),
+    }
+
+def intraday_drawdowns(equity: pd.DataFrame, capital) -> pd.Series:
+    """Maximum drawdown within each day of a (day x minute) portfolio equity frame.
+
+    The peak of a day starts at that day's capital, so a loss right after entry counts.
+    """
+    equity_np = equity.to_numpy(dtype=float)
+    capital = np.broadcast_to(np.asarray(capital, dtype=float), (len(equity_np),))
+    peaks = np.maximum(np.maximum.accumulate(equity_np, axis=1), capital[:, None])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        DDs = np.where(peaks > 0, (peaks - equity_np) / peaks, 0)
+    return pd.Series(DDs.max(axis=1) if DDs.size else np.zeros(len(equity_np)), index=equity.index, name='Intraday MDD')
+
+def calculate_intraday_metrics(
+        equity: pd.DataFrame,
+        exposure: pd.DataFrame,
+        positions: pd.DataFrame,
+        capital
+    ) -> dict:
+    """Risk of the minute-level portfolio of each day (e.g. main_backtest.IntradayGrid frames).
+
+    Exposure is the market value of open positions as a fraction of the day's capital.
+    """
+    if equity.empty:
+        return {}
+    capital = np.broadcast_to(np.asarray(capital, dtype=float), (len(equity),))
+    
+    # Intraday drawdown of each day
+    daily_MDD = intraday_drawdowns(equity, capital)
+    
+    # Worst point of the day relative to the capital
+    worst_ror = (equity.to_numpy(dtype=float) / capital[:, None] - 1).min(axis=1)
+    
+    # Exposure relative to capital
+    exposure_ratio = exposure.to_numpy(dtype=float) / capital[:, None]
+    
+    return {
+        'Intraday MDD': daily_MDD.max(),
+        'Intraday MDD mean': daily_MDD.mean(),
+        'Worst intraday RoR': worst_ror.min(),
+        'Max exposure': exposure_ratio.max(),
+        'Mean exposure': exposure_ratio.mean(),
+        'Max positions': int(positions.to_numpy().max()),
+    }
+
+def plot_equity(equity: pd.Series, show: bool = True):
     # Calculate cumulative maximum and drawdowns
     equity_cummax = equity.cummax()
     DDs = equity - equity_cummax
@@ -170,36 +409,14 @@ def plot_equity(equity: pd.Series):
     new_highs = (equity == equity_cummax)
 
     # Calculate drawdown periods
-    drawdowns = []
-    in_drawdown = False
-    drawdown_start = None
-
-    for t in equity.index:
-        if equity[t] == equity_cummax[t]:  # New high
-            if in_drawdown:
-                drawdown_end = t
-                # Calculate duration as the number of periods
-                duration = equity.index.get_loc(drawdown_end) - equity.index.get_loc(drawdown_start)
-                drawdowns.append({'start': drawdown_start, 'end': drawdown_end, 'duration': duration})
-                in_drawdown = False
-        else:
-            if not in_drawdown:
-                drawdown_start = t
-                in_drawdown = True
-
-    # If still in drawdown at the end
-    if in_drawdown:
-        drawdown_end = equity.index[-1]
-        # Calculate duration as the number of periods
-        duration = equity.index.get_loc(drawdown_end) - equity.index.get_loc(drawdown_start)
-        drawdowns.append({'start': drawdown_start, 'end': drawdown_end, 'duration': duration})
+    drawdowns = drawdown_periods(equity).to_dict('records')
 
     # Find the top five longest drawdown periods
     top_five_drawdowns = sorted(drawdowns, key=lambda x: x['duration'], reverse=True)[:5]
 
     # Plotting
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(14, 10), sharex=True,
-                                   gridspec_kw={'height_ratios': [3, 1]})
+    fig = _new_figure(show, figsize=(14, 10))
+    ax1, ax2 = fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [3, 1]})
 
     # Plot Equity Curve
     ax1.plot(equity, label='Equity Curve', linewidth=1)
@@ -227,8 +444,10 @@ def plot_equity(equity: pd.Series):
     ax2.grid(True)
     # ax2.legend()
 
-    plt.tight_layout()
-    plt.show()
+    fig.tight_layout()
+    if show:
+        plt.show()
+    return fig
 
 
 def print_dict(to_print_dict: dict, key_str: str):
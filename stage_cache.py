@@ -0,0 +1,269 @@
+import ast
+import hashlib
+import os
+import pickle
+from datetime import datetime
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+import numpy as np
+import pandas as pd
+
+import construct_basic_data
+import construct_filtered_stocks
+import main_backtest
+from construct_basic_data import combine_stock_data, load_selected_stocks
+from construct_filtered_stocks import process_filtered_stocks, select_stocks_from_daily
+from criteria import Expr
+from main_backtest import backtest
+from trading_calendar import CACHE_DIR
+
+# 每個 stage 的輸出以 (stage, 程式碼版本, 輸入指紋, 參數) 的 hash 為 key 存成一個檔案;
+# 輸入是上游 stage 的結果時直接沿用它的 key, 不必再 hash 大表.
+STAGE_CACHE_DIR = CACHE_DIR / 'stages'
+REPO_DIR = Path(__file__).resolve().parent
+STAGE_CACHE_MAX_BYTES = int(os.environ.get('SR8_STAGE_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+
+class StageResult(NamedTuple):
+    value: Any
+    key: str
+
+def _hash(*parts: bytes) -> str:
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _repo_imports(path: Path) -> Set[Path]:
+    # 連函式內的 import 也算 (例如 lazy import), 只留 repo 裡的模組
+    names = set()
+    for node in ast.walk(ast.parse(path.read_bytes())):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split('.')[0])
+    return {REPO_DIR / f'{name}.py' for name in names if (REPO_DIR / f'{name}.py').is_file()}
+
+def module_sources(modules: Sequence[ModuleType]) -> List[Path]:
+    """Source files of the modules and of every repo module they import, directly or not."""
+    pending = [Path(module.__file__).resolve() for module in modules]
+    sources = set()
+    while pending:
+        path = pending.pop()
+        if path not in sources:
+            sources.add(path)
+            pending += _repo_imports(path)
+    return sorted(sources)
+
+def code_version(modules: Sequence[ModuleType]) -> str:
+    """Hash of module_sources, so editing any code a stage runs invalidates its outputs."""
+    return _hash(*(path.name.encode() + b'\0' + path.read_bytes() for path in module_sources(modules)))
+
+def path_fingerprint(path: Path) -> str:
+    """(relative name, size, mtime) of a file or of every file under a directory."""
+    path = Path(path)
+    files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+    parts = []
+    for file in files:
+        stat = file.stat()
+        parts.append(f'{file.relative_to(path) if path.is_dir() else file.name}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return _hash(*parts)
+
+def fingerprint(value: Any) -> str:
+    """Content fingerprint of a stage input or parameter."""
+    if isinstance(value, StageResult):
+        return value.key
+    if isinstance(value, Path):
+        return 'path:' + path_fingerprint(value)
+    if isinstance(value, Expr):
+        return 'expr:' + repr(value.key)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        try:
+            hashed = pd.util.hash_pandas_object(value, index=True).to_numpy()
+            return _hash(hashed.tobytes(), repr((type(value), getattr(value, 'columns', value.name))).encode())
+        except TypeError:
+            # 例如 stock_list 欄位是 list, 無法直接 hash
+            return _hash(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    if isinstance(value, np.ndarray):
+        return _hash(value.tobytes(), repr((value.dtype, value.shape)).encode())
+    if isinstance(value, (list, tuple)):
+        return _hash(*(fingerprint(item).encode() for item in value))
+    if isinstance(value, dict):
+        return _hash(*(f'{key}={fingerprint(item)}'.encode() for key, item in sorted(value.items())))
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return repr(value)
+
+class StageCache:
+    """Content-addressed store of stage outputs with least-recently-used eviction.
+
+    Entries are pickles under `root`; reading one refreshes its mtime, and after each
+    write the oldest entries are removed until the total size is under max_bytes.
+    """
+
+    def __init__(self, root: Path = STAGE_CACHE_DIR, max_bytes: int = STAGE_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, stage: str, key: str) -> Path:
+        return self.root / f'{stage}-{key}.pkl'
+
+    def key(self, stage: str, code: Sequence[ModuleType], inputs: Dict[str, Any]) -> str:
+        parts = [stage.encode(), code_version(code).encode()]
+        parts += [f'{name}={fingerprint(value)}'.encode() for name, value in sorted(inputs.items())]
+        return _hash(*parts)
+
+    def get(self, stage: str, key: str) -> Tuple[bool, Any]:
+        entry_path = self._entry_path(stage, key)
+        try:
+            with open(entry_path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return True, value
+
+    def put(self, stage: str, key: str, value: Any) -> None:
+        entry_path = self._entry_path(stage, key)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return  # 比整個快取還大, 存了只會把其他項目擠掉
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp_path = entry_path.with_suffix(f'.{os.getpid()}.tmp')
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            return  # read-only cache dir: run without caching
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for entry_path in self.root.glob('*.pkl'):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry_path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                entry_path.unlink()
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        for entry_path in self.root.glob('*.pkl'):
+            entry_path.unlink(missing_ok=True)
+
+    def run(
+            self,
+            stage: str,
+            func: Callable,
+            code: Sequence[ModuleType],
+            **inputs
+        ) -> StageResult:
+        """func(**inputs) through the cache; StageResult inputs are passed as their value."""
+        key = self.key(stage, code, inputs)
+        found, value = self.get(stage, key)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+            value = func(**{
+                name: item.value if isinstance(item, StageResult) else item
+                for name, item in inputs.items()
+                })
+            self.put(stage, key, value)
+        return StageResult(value, key)
+
+# --- pipeline stages -----------------------------------------------------------------
+
+def _slice_selected(filtered_stocks_list: pd.DataFrame, all_stocks: Union[pd.DataFrame, Path]) -> pd.DataFrame:
+    # all_stocks 可以是分鐘資料表, 或分月份的 all_stocks.parquet 目錄
+    if isinstance(all_stocks, Path):
+        all_stocks = load_selected_stocks(all_stocks, filtered_stocks_list)
+    return process_filtered_stocks(filtered_stocks_list, all_stocks)
+
+def combine_stage(
+        cache: StageCache,
+        data_folder: Path,
+        start_date: str,
+        end_date: str,
+        max_workers: Optional[int] = 1
+    ) -> Tuple[StageResult, StageResult]:
+    """combine_stock_data keyed on the CSV folder; returns (all_stocks, all_stocks_daily)."""
+    result = cache.run(
+        'combine_stock_data',
+        lambda data_folder, start_date, end_date: combine_stock_data(data_folder, start_date, end_date, max_workers),
+        (construct_basic_data,),
+        data_folder=Path(data_folder),
+        start_date=start_date,
+        end_date=end_date
+    )
+    all_stocks, all_stocks_daily = result.value
+    return StageResult(all_stocks, result.key + ':all_stocks'), StageResult(all_stocks_daily, result.key + ':daily')
+
+def criteria_stage(
+        cache: StageCache,
+        all_stocks_daily: Union[StageResult, pd.DataFrame],
+        stocks_list: Sequence[str],
+        start_date: str,
+        end_date: str,
+        criteria_list: Sequence[Expr]
+    ) -> StageResult:
+    """select_stocks_from_daily -> filtered_stocks_list."""
+    return cache.run(
+        'criteria',
+        select_stocks_from_daily,
+        (construct_filtered_stocks,),
+        all_stocks_daily=all_stocks_daily,
+        stocks_list=list(stocks_list),
+        start_date=start_date,
+        end_date=end_date,
+        criteria=tuple(criteria_list)
+    )
+
+def slice_stage(
+        cache: StageCache,
+        filtered_stocks_list: Union[StageResult, pd.DataFrame],
+        all_stocks: Union[StageResult, pd.DataFrame, Path]
+    ) -> StageResult:
+    """process_filtered_stocks -> filtered_stocks_data."""
+    return cache.run(
+        'process_filtered_stocks',
+        _slice_selected,
+        (construct_filtered_stocks,),
+        filtered_stocks_list=filtered_stocks_list,
+        all_stocks=all_stocks
+    )
+
+def backtest_stage(
+        cache: StageCache,
+        filtered_stocks_list: Union[StageResult, pd.DataFrame],
+        filtered_stocks_data: Union[StageResult, pd.DataFrame],
+        start_date: datetime,
+        end_date: datetime,
+        **params
+    ) -> StageResult:
+    """backtest -> ret_per_trade; params are backtest's execution parameters."""
+    return cache.run(
+        'backtest',
+        backtest,
+        (main_backtest,),
+        filtered_stocks_list=filtered_stocks_list,
+        filtered_stocks_data=filtered_stocks_data,
+        start_date=start_date,
+        end_date=end_date,
+        **params
+    )
@@ -0,0 +1,261 @@
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+import sr8_performance as sr8
+from bootstrap import series_confidence_intervals
+from construct_basic_data import load_selected_stocks
+from construct_filtered_stocks import (
+    DEFAULT_FILTER_PARAMS, FILTER_PARAMS, criteria_mask, daily_panel_from_wide, filter_criteria,
+    filter_stocks_by_list, filter_stocks_by_trading_days, mask_to_list, process_filtered_stocks
+    )
+from criteria import CriteriaEngine
+from main_backtest import (
+    DEFAULT_EXECUTION_PARAMS, EXECUTION_PARAMS, execute_strategy_batch, session_cutoff_idx, time_to_minute, trade_arrays
+    )
+from shared_arrays import attach_shared, release_shared, to_shared
+from trading_calendar import get_session_ids
+
+# 選股參數改動時需要重算 mask; 執行參數不同時直接重用同一組 mask
+DEFAULT_PARAMS = {**DEFAULT_FILTER_PARAMS, **DEFAULT_EXECUTION_PARAMS}
+
+def expand_grid(grid: Dict[str, Sequence]) -> List[dict]:
+    """Cartesian product of the grid, missing parameters taken from DEFAULT_PARAMS."""
+    unknown = set(grid) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f'Unknown sweep parameters: {sorted(unknown)}')
+    names = list(DEFAULT_PARAMS)
+    values = [list(grid.get(name, [DEFAULT_PARAMS[name]])) for name in names]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+# --- workers -----------------------------------------------------------------------
+
+_worker_blocks: list = []
+_worker_state: dict = {}
+
+def _init_worker(spec: dict, days: np.ndarray, filter_trades: List[np.ndarray], bootstrap_resamples: int = 0):
+    blocks, arrays = attach_shared(spec)
+    _worker_blocks.extend(blocks)
+    _worker_state.update(arrays)
+    _worker_state['days'] = days
+    _worker_state['filter_trades'] = filter_trades
+    _worker_state['bootstrap_resamples'] = bootstrap_resamples
+
+def _daily_arrays(ret: np.ndarray, days: np.ndarray, initial_cap: float) -> tuple:
+    """(ror_per_trade, ror_per_day, equity, ret_per_day) of trades sorted by day, as in summarize_backtest."""
+    day_starts = np.r_[0, np.flatnonzero(days[1:] != days[:-1]) + 1] if len(days) else np.zeros(0, dtype=int)
+    ret_per_day = np.add.reduceat(ret, day_starts) if len(ret) else np.zeros(0)
+    trades_per_day = np.diff(np.r_[day_starts, len(ret)])
+    equity = np.cumsum(ret_per_day) + len(ret) * initial_cap
+    return ret / initial_cap, ret_per_day / trades_per_day / initial_cap, equity, ret_per_day
+
+def _metric_rows(tradely: dict, daily: dict, equity: dict, n_trades: np.ndarray) -> List[dict]:
+    rows = []
+    for i, n in enumerate(n_trades):
+        if n == 0:
+            rows.append({})  # 沒有交易: 與 backtest_metrics 一樣沒有指標
+            continue
+        row = {}
+        for prefix, metrics in (('tradely', tradely), ('daily', daily), ('equity', equity)):
+            row.update({f'{prefix} {key}': values[i].item() for key, values in metrics.items()})
+        rows.append(row)
+    return rows
+
+def _run_execution(exec_params: dict) -> List[dict]:
+    """P&L of every candidate trade for one execution setting, then metrics per filter combo.
+
+    The metrics of all filter combinations are computed together with the batch
+    functions of sr8_performance instead of one backtest_metrics call per combination.
+    """
+    state = _worker_state
+    initial_cap = exec_params['initial_cap']
+    cutoff_idx = session_cutoff_idx(state['minute'], exec_params['earliest_entry_time'])
+    ret = execute_strategy_batch(
+        state['minute'], state['open'], state['close'], state['lengths'],
+        initial_cap=initial_cap,
+        stop_loss_pct=exec_params['stop_loss_pct'],
+        earliest_entry_time=exec_params['earliest_entry_time'],
+        cutoff_idx=cutoff_idx
+    )
+    per_combo = [_daily_arrays(ret[trades], state['days'][trades], initial_cap) for trades in state['filter_trades']]
+    ror_per_trade, _ = sr8.stack_series([arrays[0] for arrays in per_combo])
+    ror_per_day, _ = sr8.stack_series([arrays[1] for arrays in per_combo])
+    equity, equity_lengths = sr8.stack_series([arrays[2] for arrays in per_combo])
+    n_trades = np.array([len(trades) for trades in state['filter_trades']])
+    
+    tradely_metrics = sr8.batch_single_metrics(ror_per_trade)
+    daily_metrics = sr8.batch_single_metrics(ror_per_day)
+    equity_metrics = sr8.batch_equity_metrics(n_trades * initial_cap, equity, equity_lengths)
+    equity_metrics['Total investment'] = equity_metrics['Total investment'].astype(np.int64)
+    rows = _metric_rows(tradely_metrics, daily_metrics, equity_metrics, n_trades)
+    
+    n_resamples = state.get('bootstrap_resamples', 0)
+    if n_resamples:
+        # 每個組合各自 bootstrap; 已在 worker 內, 不再開 process pool
+        for row, (trade_ror, day_ror, _, day_ret), n in zip(rows, per_combo, n_trades):
+            if n == 0:
+                continue
+            intervals = series_confidence_intervals(trade_ror, day_ror, day_ret, n * initial_cap, n_resamples)
+            for prefix, metrics in zip(('tradely', 'daily', 'equity'), intervals):
+                for key, (low, high) in metrics.items():
+                    if key in ('Trade times', 'Total investment'):
+                        continue
+                    row[f'{prefix} {key} low'] = low
+                    row[f'{prefix} {key} high'] = high
+    return rows
+
+# --- sweep ---------------------------------------------------------------------------
+
+def run_sweep(
+        all_stocks_daily: pd.DataFrame,
+        minute_store_path: Path,
+        stocks_list: List[str],
+        grid: Dict[str, Sequence],
+        filter_start: str,
+        filter_end: str,
+        backtest_start: str,
+        backtest_end: str,
+        max_workers: Optional[int] = None,
+        bootstrap_resamples: int = 0
+    ) -> pd.DataFrame:
+    """Backtest every combination of the grid and return one row of metrics per combination.
+
+    The daily panel is built once and all filter combinations run through one
+    CriteriaEngine, so sub-expressions they share are computed once. The intraday
+    slices of the union of all selected trades are loaded once and placed in shared
+    memory; each worker runs one execution setting over all candidate trades and
+    reuses the result for every filter combination. max_workers=1 runs in-process.
+    bootstrap_resamples > 0 adds 95% bootstrap interval columns ('... low' / '... high').
+    """
+    combos = expand_grid(grid)
+    filter_combos = list(dict.fromkeys(tuple(c[k] for k in FILTER_PARAMS) for c in combos))
+    exec_combos = list(dict.fromkeys(tuple(c[k] for k in EXECUTION_PARAMS) for c in combos))
+
+    stocks_df = filter_stocks_by_list(all_stocks_daily, stocks_list)
+    stocks_df = filter_stocks_by_trading_days(stocks_df, filter_start, filter_end)
+    panel, stock_codes, fields = daily_panel_from_wide(stocks_df)
+
+    # 只保留回測區間內的日期
+    in_window = get_session_ids(stocks_df.index, backtest_start, backtest_end) >= 0
+    # 所有組合共用一個 engine, 相同的子運算式只算一次
+    engine = CriteriaEngine(panel, fields)
+    masks = [
+        criteria_mask(panel, fields, *filter_criteria(dict(zip(FILTER_PARAMS, combo))), engine=engine)[in_window]
+        for combo in filter_combos
+        ]
+
+    # 所有組合選到的 (day, stock) 聯集, 依日期再依欄位順序, 與 backtest 的交易順序相同
+    union_mask = np.logical_or.reduce(masks) if masks else np.zeros((in_window.sum(), len(stock_codes)), dtype=bool)
+    union_flat = np.flatnonzero(union_mask.ravel())
+    filter_trades = [np.searchsorted(union_flat, np.flatnonzero(mask.ravel())) for mask in masks]
+
+    window_days = stocks_df.index[in_window]
+    union_list = mask_to_list(union_mask, window_days, stock_codes)
+    all_stocks = load_selected_stocks(minute_store_path, union_list)
+    filtered_stocks_data = process_filtered_stocks(union_list, all_stocks)
+
+    days = window_days.to_numpy()[union_flat // len(stock_codes)]
+    codes = stock_codes.to_numpy()[union_flat % len(stock_codes)]
+    minute_np, open_np, close_np, lengths = trade_arrays(filtered_stocks_data, days, codes)
+    arrays = {'minute': minute_np, 'open': open_np, 'close': close_np, 'lengths': lengths}
+    days = pd.to_datetime(days).to_numpy()
+
+    exec_params = [dict(zip(EXECUTION_PARAMS, combo)) for combo in exec_combos]
+    if max_workers == 1:
+        _worker_state.update(arrays, days=days, filter_trades=filter_trades, bootstrap_resamples=bootstrap_resamples)
+        try:
+            results = [_run_execution(params) for params in exec_params]
+        finally:
+            _worker_state.clear()
+    else:
+        blocks, spec = to_shared(arrays)
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    initializer=_init_worker,
+                    initargs=(spec, days, filter_trades, bootstrap_resamples)
+                    ) as executor:
+                results = list(executor.map(_run_execution, exec_params))
+        finally:
+            release_shared(blocks)
+
+    metrics = {
+        (filter_combo, exec_combo): row
+        for exec_combo, rows in zip(exec_combos, results)
+        for filter_combo, row in zip(filter_combos, rows)
+        }
+    records = []
+    for combo in combos:
+        key = (tuple(combo[k] for k in FILTER_PARAMS), tuple(combo[k] for k in EXECUTION_PARAMS))
+        records.append({**combo, **metrics[key]})
+    return pd.DataFrame.from_records(records)
+
+def _parse_value(text: str):
+    # 'HH:MM' (例如 earliest_entry_time=09:06) 轉成 minute of day
+    if ':' in text:
+        try:
+            return time_to_minute(text)
+        except ValueError:
+            raise ValueError(f'Expected a time as HH:MM but got {text!r}') from None
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    raise ValueError(f'Expected a number or HH:MM but got {text!r}')
+
+def parse_grid(items: Sequence[str]) -> Dict[str, list]:
+    """['top_n=50,100', 'earliest_entry_time=09:06,09:30'] -> {'top_n': [50, 100], 'earliest_entry_time': [546, 570]}"""
+    grid = {}
+    for item in items:
+        name, _, values = item.partition('=')
+        if not values:
+            raise ValueError(f'Expected name=v1,v2,... but got {item!r}')
+        grid[name.strip()] = [_parse_value(v.strip()) for v in values.split(',')]
+    return grid
+
+
+#%%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backtest a grid of filter and execution parameters.')
+    parser.add_argument('--daily', type=Path, required=True, help="path of 'all_stocks_daily.parquet'")
+    parser.add_argument('--minute-store', type=Path, required=True, help="path of 'all_stocks.parquet' (partitioned directory)")
+    parser.add_argument('--stocks-list', type=Path, required=True, help="path of 'mid_stocks_list.feather'")
+    parser.add_argument('--filter-range', nargs=2, default=['2023-08-01', '2024-10-14'], metavar=('START', 'END'))
+    parser.add_argument('--backtest-range', nargs=2, default=['2023-09-01', '2024-10-14'], metavar=('START', 'END'))
+    parser.add_argument('--grid', nargs='+', default=[], metavar='NAME=V1,V2',
+                        help=f'parameters to sweep, any of {", ".join(DEFAULT_PARAMS)}')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', type=Path, help='write the results here (.parquet or .csv)')
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help='add bootstrap confidence intervals from N resamples per combination')
+    args = parser.parse_args()
+
+    stocks_list = pd.read_feather(args.stocks_list)['stock_code'].astype(str).tolist()
+    all_stocks_daily = pd.read_parquet(args.daily)
+
+    start_time = datetime.now()
+    results = run_sweep(
+        all_stocks_daily,
+        args.minute_store,
+        stocks_list,
+        parse_grid(args.grid),
+        *args.filter_range,
+        *args.backtest_range,
+        max_workers=args.max_workers,
+        bootstrap_resamples=args.bootstrap
+    )
+    print(f'{len(results)} combinations in {datetime.now() - start_time}')
+
+    if args.output is None:
+        print(results.to_string())
+    elif args.output.suffix == '.csv':
+        results.to_csv(args.output, index=False)
+    else:
+        results.to_parquet(args.output)
@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import construct_basic_data
+import trading_calendar
+
+# 合成資料: (股票數, 交易日數), 從 benchmark.BENCH_START_DATE 開始
+SYNTHETIC_STOCKS, SYNTHETIC_DAYS = 30, 60
+
+@pytest.fixture(scope='session', autouse=True)
+def cache_dir(tmp_path_factory):
+    """Calendar and CSV caches under a temporary directory instead of the repo's .cache/."""
+    cache_dir = tmp_path_factory.mktemp('cache')
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # process-pool workers 重新 import 時讀環境變數
+        monkeypatch.setenv('SR8_CACHE_DIR', str(cache_dir))
+        monkeypatch.setattr(trading_calendar, 'CACHE_DIR', cache_dir)
+        monkeypatch.setattr(trading_calendar, 'CALENDAR_CACHE_DIR', cache_dir / 'calendar')
+        monkeypatch.setattr(construct_basic_data, 'CSV_CACHE_DIR', cache_dir / 'k_data')
+        yield cache_dir
+
+@pytest.fixture(scope='session')
+def synthetic_store(tmp_path_factory, cache_dir):
+    """(all_stocks_daily, minute store path, sessions) built from benchmark's synthetic CSVs."""
+    from benchmark import synthetic_sessions, write_synthetic_csvs
+    root = tmp_path_factory.mktemp('synthetic')
+    write_synthetic_csvs(root / 'k', SYNTHETIC_STOCKS, SYNTHETIC_DAYS)
+    sessions = synthetic_sessions(SYNTHETIC_DAYS)
+    start_date, end_date = sessions[0].strftime('%Y-%m-%d'), sessions[-1].strftime('%Y-%m-%d')
+    file_sizes = construct_basic_data.csv_file_sizes(root / 'k')
+    all_stocks, all_stocks_daily = construct_basic_data.combine_stock_data(root / 'k', start_date, end_date)
+    construct_basic_data.write_minute_store(all_stocks, root / 'all_stocks.parquet', file_sizes)
+    return all_stocks_daily, root / 'all_stocks.parquet', sessions
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from bootstrap import bootstrap_distribution
+
+def test_bootstrap_distribution_is_seeded():
+    values = np.random.default_rng(0).normal(size=50)
+    first = bootstrap_distribution('single', values, n_resamples=700, seed=3)
+    second = bootstrap_distribution('single', values, n_resamples=700, seed=3)
+    assert len(first['Mean']) == 700
+    for key in first:
+        np.testing.assert_array_equal(first[key], second[key])
+
+@pytest.mark.parametrize('values, n_resamples', [([], 100), ([1.0, -1.0], 0)])
+def test_bootstrap_distribution_rejects_invalid_input(values, n_resamples):
+    with pytest.raises(ValueError):
+        bootstrap_distribution('equity', values, 1e5, n_resamples=n_resamples)
@@ -0,0 +1,76 @@
+import pandas as pd
+import pandas.testing as pt
+import pytest
+
+from construct_filtered_stocks import (
+    create_filtered_by_vol_and_amount, create_higher, create_new_high, create_top_ret, criterion_to_list,
+    filter_stocks_by_list, filter_stocks_by_trading_days, higher_criterion, new_high_criterion,
+    select_stocks, top_ret_criterion
+    )
+
+# --- the pandas create_* functions from before the CriteriaEngine ---------------------
+
+def reference_top_ret(stocks_df: pd.DataFrame, offset_days: int = 3, top_n: int = 100) -> pd.DataFrame:
+    close_df = stocks_df.xs('Close', axis=1, level=1)
+    ret_df = close_df.pct_change(periods=offset_days, fill_method=None).shift(1)
+    criteria_df = pd.DataFrame(False, index=ret_df.index, columns=ret_df.columns)
+    for date, row in ret_df.iterrows():
+        if row.isna().all():
+            continue
+        top_stocks = row.dropna().nlargest(top_n).index.tolist()
+        criteria_df.loc[date, top_stocks] = True
+    return criteria_df
+
+def reference_new_high(stocks_df: pd.DataFrame, offset_days: int = 3) -> pd.DataFrame:
+    close_df = stocks_df.xs('Close', axis=1, level=1)
+    high_df = stocks_df.xs('High', axis=1, level=1)
+    return close_df.shift(1) > high_df.shift(2).rolling(window=offset_days).max()
+
+def reference_higher(stocks_df: pd.DataFrame, threshold: float) -> pd.DataFrame:
+    close_df = stocks_df.xs('Close', axis=1, level=1)
+    open_df = stocks_df.xs('Open', axis=1, level=1)
+    return open_df.shift(1) >= close_df.shift(2) * (1 + threshold)
+
+def reference_vol_and_amount(stocks_df: pd.DataFrame, offset_days: int = 3) -> pd.DataFrame:
+    volume_df = stocks_df.xs('Volume', axis=1, level=1)
+    amount_df = stocks_df.xs('Amount', axis=1, level=1)
+    criteria_1 = volume_df.shift(1) > 3 * volume_df.shift(2).rolling(window=offset_days).mean()
+    criteria_2 = volume_df.shift(1) > 2000
+    criteria_3 = amount_df.shift(1).rolling(window=5).mean() > 1000
+    criteria_4 = amount_df.shift(1) > 1e8
+    return criteria_1 & criteria_2 & criteria_3 & criteria_4
+
+@pytest.fixture(scope='module')
+def stocks_df(synthetic_store):
+    all_stocks_daily, _, sessions = synthetic_store
+    stock_codes = all_stocks_daily.index.get_level_values(0).unique()
+    return filter_stocks_by_trading_days(
+        filter_stocks_by_list(all_stocks_daily, stock_codes),
+        sessions[0].strftime('%Y-%m-%d'), sessions[-1].strftime('%Y-%m-%d')
+        )
+
+@pytest.mark.parametrize('create, reference, args', [
+    (create_top_ret, reference_top_ret, (3, 5)),
+    (create_top_ret, reference_top_ret, (2, 10)),
+    (create_new_high, reference_new_high, (3,)),
+    (create_new_high, reference_new_high, (5,)),
+    (create_higher, reference_higher, (0.001,)),
+    (create_filtered_by_vol_and_amount, reference_vol_and_amount, (3,)),
+])
+def test_create_matches_pandas_reference(stocks_df, create, reference, args):
+    expected = reference(stocks_df, *args)
+    # 合成資料要讓每個條件都有選到與沒選到的股票
+    assert expected.to_numpy().any() and not expected.to_numpy().all()
+    result = create(stocks_df, *args)
+    pt.assert_frame_equal(result, expected, check_names=False)
+
+def test_select_stocks_matches_criterion_to_list(stocks_df):
+    expected = criterion_to_list(
+        stocks_df,
+        reference_top_ret(stocks_df, 3, 10),
+        reference_new_high(stocks_df, 3),
+        reference_higher(stocks_df, 0.001),
+    )
+    result = select_stocks(stocks_df, top_ret_criterion(3, 10), new_high_criterion(3), higher_criterion(0.001))
+    assert expected['stock_list'].str.len().sum() > 0
+    pt.assert_frame_equal(result, expected)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from main_backtest import (
+    FORCED_EXIT_MINUTE, PARTIAL_EXIT_MINUTE_1, PARTIAL_EXIT_MINUTE_2,
+    execute_strategy_batch, execute_strategy_on_single
+)
+
+SESSION_MINUTES = np.arange(541, FORCED_EXIT_MINUTE + 1)  # 09:01-13:30
+
+def random_sessions(n_trades: int, seed: int = 0):
+    """Ragged (minute, open, close) bars per trade: random gaps, some sessions end early."""
+    rng = np.random.default_rng(seed)
+    sessions = []
+    for _ in range(n_trades):
+        minutes = SESSION_MINUTES[rng.random(len(SESSION_MINUTES)) > 0.05]
+        # 約三成的交易提早收盤 (停牌), 但至少留到 09:10
+        if rng.random() < 0.3:
+            minutes = minutes[minutes <= rng.integers(550, FORCED_EXIT_MINUTE)]
+        close = 100 * np.exp(np.cumsum(rng.normal(0, rng.choice([1e-4, 2e-3]), len(minutes))))
+        open_ = np.r_[100, close[:-1]] * (1 + rng.normal(0, 5e-4, len(minutes)))
+        sessions.append((minutes, open_, close))
+    return sessions
+
+def pad(sessions):
+    lengths = np.array([len(minutes) for minutes, _, _ in sessions])
+    minute_np = np.full((len(sessions), lengths.max()), 24 * 60)
+    open_np = np.full(minute_np.shape, np.nan)
+    close_np = np.full(minute_np.shape, np.nan)
+    for i, (minutes, open_, close) in enumerate(sessions):
+        minute_np[i, :len(minutes)] = minutes
+        open_np[i, :len(minutes)] = open_
+        close_np[i, :len(minutes)] = close
+    return minute_np, open_np, close_np, lengths
+
+@pytest.mark.parametrize('stop_loss_pct', [0.002, 0.005, 1.0])
+def test_batch_matches_single(stop_loss_pct):
+    sessions = random_sessions(200, seed=int(stop_loss_pct * 1000))
+    lengths = np.array([len(minutes) for minutes, _, _ in sessions])
+    last_minutes = np.array([minutes[-1] for minutes, _, _ in sessions])
+    # 涵蓋長短不一, 以及撐過 11:00 / 13:00 / 13:30 的交易
+    assert len(np.unique(lengths)) > 10
+    assert (last_minutes < PARTIAL_EXIT_MINUTE_1).any()
+    assert ((last_minutes >= PARTIAL_EXIT_MINUTE_2) & (last_minutes < FORCED_EXIT_MINUTE)).any()
+    assert (last_minutes == FORCED_EXIT_MINUTE).any()
+
+    expected = []
+    for minutes, open_, close in sessions:
+        equity = execute_strategy_on_single(minutes, open_, close, stop_loss_pct=stop_loss_pct)
+        expected.append(equity.iloc[-1] - equity.iloc[0])
+    ret = execute_strategy_batch(*pad(sessions), stop_loss_pct=stop_loss_pct)
+    np.testing.assert_array_equal(ret, expected)
+
+def test_batch_partial_and_forced_exits_without_stop():
+    # 不觸發停損時, 11:00 / 13:00 各平 1/3, 13:30 開盤平掉剩下的部位
+    minutes = SESSION_MINUTES
+    open_ = np.full(len(minutes), 100.0)
+    close = np.full(len(minutes), 100.0)
+    ret = execute_strategy_batch(*pad([(minutes, open_, close)]), stop_loss_pct=1.0)
+    equity = execute_strategy_on_single(minutes, open_, close, stop_loss_pct=1.0)
+    assert ret[0] == equity.iloc[-1] - equity.iloc[0]
+    assert ret[0] < 0  # 只有手續費與稅
+
+def test_no_bar_after_earliest_entry_time():
+    sessions = random_sessions(5)
+    minutes = SESSION_MINUTES[:3]  # 09:01-09:03, 早於 09:06 進場時間
+    sessions[3] = (minutes, np.full(3, 100.0), np.full(3, 100.0))
+    with pytest.raises(ValueError, match=r'\[3\]'):
+        execute_strategy_batch(*pad(sessions))
+    with pytest.raises(ValueError):
+        execute_strategy_on_single(*sessions[3])
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from construct_filtered_stocks import (
+    filter_stocks_by_list, filter_stocks_by_trading_days, higher_criterion, new_high_criterion,
+    select_stocks, top_ret_criterion, vol_and_amount_criterion
+    )
+from live_signals import StreamingSelector
+
+CRITERIA = (top_ret_criterion(3, 5), new_high_criterion(3), vol_and_amount_criterion(3), higher_criterion(0.001))
+
+@pytest.fixture(scope='module')
+def stocks_df(synthetic_store):
+    all_stocks_daily, _, sessions = synthetic_store
+    stock_codes = all_stocks_daily.index.get_level_values(0).unique()
+    return filter_stocks_by_trading_days(
+        filter_stocks_by_list(all_stocks_daily, stock_codes),
+        sessions[0].strftime('%Y-%m-%d'), sessions[-1].strftime('%Y-%m-%d')
+        )
+
+def day_bars(stocks_df, day):
+    # 某天的日K: index 為 stock_code, 欄位為 fields
+    return stocks_df.loc[day].unstack()
+
+def streamed_lists(stocks_df, warm_up, skip=()):
+    """{session: stock_list} of StreamingSelector, keeping the stocks with a bar that session.
+
+    Sessions in skip get no update, so there is no signal for the session after them.
+    """
+    selector = StreamingSelector.from_history(stocks_df.iloc[:warm_up], CRITERIA)
+    present = stocks_df.T.groupby(level=0, sort=False).apply(lambda bars: bars.notna().all()).T
+    present.loc[list(skip)] = False
+    lists = {}
+    for i, day in enumerate(stocks_df.index[warm_up:], warm_up):
+        if stocks_df.index[i - 1] not in skip:
+            next_session, stock_list = selector.signal()
+            assert next_session == day
+            lists[day] = [code for code in stock_list if present.loc[day, code]]
+        if day not in skip:
+            selector.update(day, day_bars(stocks_df, day))
+    return lists
+
+def test_streaming_matches_select_stocks(stocks_df):
+    warm_up = 10
+    expected = select_stocks(stocks_df, *CRITERIA)['stock_list']
+    lists = streamed_lists(stocks_df, warm_up)
+    assert sum(map(len, lists.values())) > 0
+    assert lists == expected.iloc[warm_up:].to_dict()
+
+def test_skipped_sessions_count_as_missing_bars(stocks_df):
+    warm_up = 10
+    skip = stocks_df.index[[20, 21, 35]]
+    lists = streamed_lists(stocks_df, warm_up, skip)
+    # 沒收到的交易日在完整歷史裡就是 NaN 的一列
+    gapped_df = stocks_df.copy()
+    gapped_df.loc[skip] = np.nan
+    expected = select_stocks(gapped_df, *CRITERIA)['stock_list']
+    assert len(lists) == len(stocks_df) - warm_up - len(skip)
+    assert lists == expected[list(lists)].to_dict()
@@ -0,0 +1,19 @@
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from report import render_reports
+
+def test_render_reports_in_process_keeps_backend(tmp_path):
+    rng = np.random.default_rng(0)
+    days = pd.bdate_range('2024-01-01', periods=60).repeat(3)
+    backtests = {'a': pd.Series(rng.normal(100, 1000, len(days)), index=days)}
+    backend = matplotlib.get_backend()
+
+    index_path = render_reports(backtests, tmp_path, report_format='md', max_workers=1)
+
+    assert matplotlib.get_backend() == backend
+    assert plt.get_fignums() == []
+    assert index_path.exists()
+    assert len(list((tmp_path / 'a').glob('*.png'))) == 4
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sr8_performance as sr8
+from rolling_metrics import ROLLING_METRICS, RollingMetrics, rolling_metrics
+
+TOTAL_INVESTMENT = 3e6
+
+@pytest.fixture
+def ret_per_day():
+    rng = np.random.default_rng(1)
+    ret = pd.Series(rng.standard_normal(400) * 3000 + 200, index=pd.bdate_range('2022-01-03', periods=400))
+    ret.iloc[5] = 0
+    return ret
+
+@pytest.mark.parametrize('window', [1, 20, 60])
+def test_online_matches_vectorized(ret_per_day, window):
+    rolling = RollingMetrics(window, TOTAL_INVESTMENT)
+    online = pd.DataFrame([rolling.update(ret) for ret in ret_per_day], index=ret_per_day.index)
+    history = rolling_metrics(ret_per_day, TOTAL_INVESTMENT, window, min_periods=1)
+    assert list(history.columns) == list(ROLLING_METRICS)
+    pd.testing.assert_frame_equal(online[history.columns], history, rtol=1e-9, atol=1e-12)
+
+def test_metrics_against_full_calculations(ret_per_day):
+    window = 60
+    rolling = RollingMetrics.from_history(ret_per_day, TOTAL_INVESTMENT, window)
+    metrics = rolling.metrics()
+    single_metrics, equity_metrics = rolling.window_metrics()
+    for key in ('RoR mean', 'RoR volatility', 'Sharpe ratio', 'Sortino ratio'):
+        assert np.isclose(metrics[key], equity_metrics[key], rtol=1e-9), key
+    assert np.isclose(metrics['WR'], single_metrics['WR'])
+
+    equity = ret_per_day.cumsum() + TOTAL_INVESTMENT
+    assert np.isclose(metrics['DD'], 1 - equity.iloc[-1] / equity.iloc[-window:].max())
+    # 'MDD since start' 是整段的 MDD; window_metrics 的 'MDD' 只看視窗內
+    assert np.isclose(metrics['MDD since start'], sr8.calculate_equity_metrics(TOTAL_INVESTMENT, equity)['MDD'])
+    window_equity = equity.iloc[-window:]
+    window_peak = np.maximum.accumulate(np.r_[equity.iloc[-window - 1], window_equity.to_numpy()])[1:]
+    assert np.isclose(equity_metrics['MDD'], np.max((window_peak - window_equity.to_numpy()) / window_peak))
@@ -0,0 +1,25 @@
+import construct_filtered_stocks
+import main_backtest
+import stage_cache
+from stage_cache import StageCache, code_version, module_sources
+
+def test_module_sources_follow_indirect_imports():
+    backtest_sources = {path.name for path in module_sources([main_backtest])}
+    assert {'main_backtest.py', 'trade_tensor.py', 'shared_arrays.py', 'instrumentation.py'} <= backtest_sources
+    criteria_sources = {path.name for path in module_sources([construct_filtered_stocks])}
+    assert {'criteria.py', 'trading_calendar.py'} <= criteria_sources
+
+def test_editing_an_indirect_import_changes_the_key(tmp_path, monkeypatch):
+    (tmp_path / 'stage_a.py').write_text('import stage_b\n')
+    (tmp_path / 'stage_b.py').write_text('def f():\n    import stage_c\n')
+    (tmp_path / 'stage_c.py').write_text('X = 1\n')
+    monkeypatch.setattr(stage_cache, 'REPO_DIR', tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    import stage_a
+
+    cache = StageCache(tmp_path / 'stages')
+    key = cache.key('stage', (stage_a,), {})
+    version = code_version((stage_a,))
+    (tmp_path / 'stage_c.py').write_text('X = 2\n')
+    assert code_version((stage_a,)) != version
+    assert cache.key('stage', (stage_a,), {}) != key
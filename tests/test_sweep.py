@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from construct_basic_data import load_selected_stocks
+from construct_filtered_stocks import (
+    filter_criteria, filter_stocks_by_list, filter_stocks_by_trading_days, process_filtered_stocks, select_stocks
+    )
+from main_backtest import EARLIEST_ENTRY_MINUTE, backtest, backtest_metrics, summarize_backtest
+from sweep import run_sweep
+
+GRID = {
+    'top_n': [5, 10],
+    'offset_days': [2, 3],
+    'stop_loss_pct': [0.005, 0.01],
+    'earliest_entry_time': [EARLIEST_ENTRY_MINUTE, EARLIEST_ENTRY_MINUTE + 10],
+}
+
+def single_run_metrics(all_stocks_daily, minute_store_path, stock_codes, params, filter_window, backtest_window):
+    """select_stocks -> backtest -> backtest_metrics of one combination, keyed like the sweep columns."""
+    stocks_df = filter_stocks_by_trading_days(filter_stocks_by_list(all_stocks_daily, stock_codes), *filter_window)
+    filtered_stocks_list = select_stocks(stocks_df, *filter_criteria(params))
+    filtered_stocks_data = process_filtered_stocks(
+        filtered_stocks_list, load_selected_stocks(minute_store_path, filtered_stocks_list)
+        )
+    ret_per_trade = backtest(
+        filtered_stocks_list, filtered_stocks_data, *backtest_window,
+        initial_cap=params['initial_cap'],
+        stop_loss_pct=params['stop_loss_pct'],
+        earliest_entry_time=params['earliest_entry_time']
+    )
+    tradely, daily, equity = backtest_metrics(summarize_backtest(ret_per_trade, params['initial_cap']))
+    metrics = {}
+    for prefix, values in (('tradely', tradely), ('daily', daily), ('equity', equity)):
+        metrics.update({f'{prefix} {key}': value for key, value in values.items()})
+    return metrics
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_sweep_rows_match_single_backtests(synthetic_store, max_workers):
+    all_stocks_daily, minute_store_path, sessions = synthetic_store
+    stock_codes = all_stocks_daily.index.get_level_values(0).unique().tolist()
+    filter_window = (sessions[0].strftime('%Y-%m-%d'), sessions[-1].strftime('%Y-%m-%d'))
+    backtest_window = (sessions[20].strftime('%Y-%m-%d'), sessions[-1].strftime('%Y-%m-%d'))
+
+    result = run_sweep(
+        all_stocks_daily, minute_store_path, stock_codes, GRID, *filter_window, *backtest_window,
+        max_workers=max_workers
+    )
+    assert len(result) == 16
+    # to_dict('records') 保留各欄位的型別 (iterrows 會把整列轉成 float)
+    for row in result.to_dict('records'):
+        expected = single_run_metrics(
+            all_stocks_daily, minute_store_path, stock_codes, row, filter_window, backtest_window
+            )
+        assert expected['tradely Trade times'] > 0
+        for key, value in expected.items():
+            assert np.isclose(row[key], value, rtol=1e-12, equal_nan=True), (key, row[key], value)
@@ -0,0 +1,45 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from construct_basic_data import (
+    combine_stock_data, csv_file_sizes, load_minute_store, read_ingest_state,
+    update_stock_data, write_minute_store
+    )
+
+START_DATE, END_DATE = '2024-03-04', '2024-03-08'
+
+def write_csv(path: Path, days):
+    ts = pd.DatetimeIndex([
+        pd.Timestamp(day) + pd.Timedelta(minutes=m) for day in days for m in (541, 542, 543)
+        ], name='ts')
+    price = np.linspace(100, 101, len(ts)).round(2)
+    pd.DataFrame(
+        {'Open': price, 'High': price, 'Low': price, 'Close': price, 'Volume': 10, 'Amount': price * 10000},
+        index=ts
+        ).to_csv(path)
+
+def test_new_stock_with_rows_past_end_date(tmp_path, cache_dir):
+    data_folder, store, daily_path = tmp_path / 'k', tmp_path / 'all_stocks.parquet', tmp_path / 'daily.parquet'
+    data_folder.mkdir()
+    write_csv(data_folder / '1101.csv', ['2024-03-04', '2024-03-05'])
+    file_sizes = csv_file_sizes(data_folder)
+    all_stocks, all_stocks_daily = combine_stock_data(data_folder, START_DATE, END_DATE)
+    write_minute_store(all_stocks, store, file_sizes)
+    all_stocks_daily.to_parquet(daily_path)
+
+    # 新股票有一天超過 end_date
+    write_csv(data_folder / '1102.csv', ['2024-03-05', '2024-03-06', '2024-03-11'])
+    new_stocks, _ = update_stock_data(data_folder, store, daily_path, START_DATE, END_DATE)
+    assert len(new_stocks) == 6
+    state = read_ingest_state(store)
+    assert state.loc['1102', 'file_size'] == 0
+    assert state.loc['1102', 'last_ts'] == pd.Timestamp('2024-03-06 09:03')
+
+    # 重跑不會重複寫入
+    new_stocks, all_stocks_daily = update_stock_data(data_folder, store, daily_path, START_DATE, END_DATE)
+    assert len(new_stocks) == 0
+    minute_store = load_minute_store(store)
+    assert not minute_store.index.duplicated().any()
+    assert len(minute_store.loc['1102']) == 6
+    assert all_stocks_daily.loc[('1102', '2024-03-06'), 'Volume'] == 30
@@ -0,0 +1,144 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Optional, Sequence
+
+# 選中交易的盤中資料另存為 (trade, minute-of-session, field) 的稠密陣列:
+#   tensor.npy  — np.save 格式, 以 memmap 開啟, 每筆交易是一個 zero-copy 的切片
+#   index.parquet — (day, stock_code) -> row, 以及每筆交易的 bar 數
+# 沒有成交的分鐘為 NaN.
+TENSOR_FILE = 'tensor.npy'
+INDEX_FILE = 'index.parquet'
+TENSOR_FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume', 'Amount')
+
+def write_trade_tensor(
+        filtered_stocks_data: pd.DataFrame,
+        path: Path,
+        dtype: np.dtype = np.float64,
+        fields: Sequence[str] = TENSOR_FIELDS
+    ) -> None:
+    """Write a (day, stock_code, ts) frame from process_filtered_stocks as a tensor store."""
+    index = filtered_stocks_data.index
+    if 'Minute' in filtered_stocks_data.columns:
+        minute_of_day = filtered_stocks_data['Minute'].to_numpy().astype(np.int64)
+    else:
+        ts = index.get_level_values(2)
+        minute_of_day = (ts.hour * 60 + ts.minute).to_numpy().astype(np.int64)
+
+    # 每個 (day, stock_code) 一列; process_filtered_stocks 的輸出已依此排序
+    pair_codes = index.codes[0].astype(np.int64) * len(index.levels[1]) + index.codes[1]
+    group_change = np.flatnonzero(pair_codes[1:] != pair_codes[:-1]) + 1
+    starts = np.r_[0, group_change] if len(index) else np.array([], dtype=int)
+    trade_id = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(index)]))
+
+    first_minute = int(minute_of_day.min()) if len(index) else 0
+    n_minutes = int(minute_of_day.max()) - first_minute + 1 if len(index) else 0
+    minute_pos = minute_of_day - first_minute
+    if len(index) and np.any(np.bincount(trade_id * n_minutes + minute_pos) > 1):
+        raise ValueError('More than one bar per (day, stock_code, minute)')
+
+    path.mkdir(parents=True, exist_ok=True)
+    tensor_path = path / TENSOR_FILE
+    tmp_path = path / f'{TENSOR_FILE}.{os.getpid()}.tmp'
+    tensor = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=dtype, shape=(len(starts), n_minutes, len(fields))
+        )
+    tensor[...] = np.nan
+    tensor[trade_id, minute_pos] = filtered_stocks_data[list(fields)].to_numpy(dtype=dtype)
+    tensor.flush()
+    del tensor
+    os.replace(tmp_path, tensor_path)
+
+    table = pa.table({
+        'day': np.asarray(index.get_level_values(0)[starts], dtype=str),
+        'stock_code': np.asarray(index.get_level_values(1)[starts], dtype=str),
+        'length': np.bincount(trade_id, minlength=len(starts)).astype(np.int32),
+        })
+    table = table.replace_schema_metadata({
+        'first_minute': str(first_minute),
+        'fields': json.dumps(list(fields)),
+        'dtypes': json.dumps({name: str(filtered_stocks_data[name].dtype) for name in fields}),
+        })
+    pq.write_table(table, path / INDEX_FILE)
+
+class TradeTensor:
+    """Read side of a tensor store; opening only maps the file and reads the index."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.tensor = np.load(self.path / TENSOR_FILE, mmap_mode='r')
+        table = pq.read_table(self.path / INDEX_FILE)
+        metadata = table.schema.metadata
+        self.first_minute = int(metadata[b'first_minute'])
+        self.fields = json.loads(metadata[b'fields'])
+        self.dtypes = json.loads(metadata[b'dtypes'])
+        self.index = table.to_pandas()
+        self.pairs = pd.MultiIndex.from_arrays([self.index['day'], self.index['stock_code']])
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def minutes(self) -> np.ndarray:
+        """Minute of day of each column of the tensor."""
+        return self.first_minute + np.arange(self.tensor.shape[1])
+
+    def rows(self, days: np.ndarray, stock_codes: np.ndarray) -> np.ndarray:
+        """Tensor row of each (day, stock_code); KeyError lists the missing pairs."""
+        rows = self.pairs.get_indexer(pd.MultiIndex.from_arrays([np.asarray(days), np.asarray(stock_codes)]))
+        if (rows < 0).any():
+            missing = rows < 0
+            raise KeyError(list(zip(np.asarray(days)[missing], np.asarray(stock_codes)[missing])))
+        return rows
+
+    def get(self, day: str, stock_code: str) -> np.ndarray:
+        """(minute, field) view of one trade, no copy."""
+        return self.tensor[self.rows([day], [stock_code])[0]]
+
+    def trade_arrays(self, days: np.ndarray, stock_codes: np.ndarray) -> tuple:
+        """Same (minute, open, close, lengths) arrays as main_backtest.trade_arrays."""
+        data = self.tensor[self.rows(days, stock_codes)]
+        valid = ~np.isnan(data).any(axis=2)
+        lengths = valid.sum(axis=1)
+        max_len = int(lengths.max()) if len(lengths) else 0
+        # 有資料的分鐘移到前面 (順序不變), 之後重複最後一根
+        bar_pos = np.argsort(~valid, axis=1, kind='stable')
+        offsets = np.minimum(np.arange(max_len)[None, :], np.maximum(lengths[:, None] - 1, 0))
+        bar_pos = np.take_along_axis(bar_pos, offsets, axis=1)
+
+        minute_np = np.where(
+            np.arange(max_len)[None, :] < lengths[:, None],
+            self.first_minute + bar_pos,
+            24 * 60
+            )
+        open_np = np.take_along_axis(data[:, :, self.fields.index('Open')], bar_pos, axis=1)
+        close_np = np.take_along_axis(data[:, :, self.fields.index('Close')], bar_pos, axis=1)
+        return minute_np, open_np, close_np, lengths
+
+    def to_frame(self, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """The long (day, stock_code, ts) frame of process_filtered_stocks for the given rows."""
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        data = self.tensor[rows]
+        trade, minute_pos = np.nonzero(~np.isnan(data).all(axis=2))
+        values = data[trade, minute_pos]
+
+        minute_of_day = self.first_minute + minute_pos
+        days = self.index['day'].to_numpy()[rows][trade]
+        ts = pd.to_datetime(days) + pd.to_timedelta(minute_of_day, unit='min')
+        frame = pd.DataFrame(
+            values,
+            index=pd.MultiIndex.from_arrays(
+                [days.astype(object), self.index['stock_code'].to_numpy()[rows][trade].astype(object), ts],
+                names=['day', 'stock_code', 'ts']
+                ),
+            columns=self.fields
+            )
+        # 還原原本的 dtype (例如 Volume 為 int64), 有 NaN 的欄位維持 float
+        frame = frame.astype({
+            name: dtype for name, dtype in self.dtypes.items() if not frame[name].isna().any()
+            })
+        return frame.assign(Minute=minute_of_day.astype('int16'))
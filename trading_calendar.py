@@ -0,0 +1,69 @@
+import os
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+import numpy as np
+import pandas as pd
+import pandas_market_calendars as mcal
+
+CALENDAR_NAME = 'XTAI'
+# 預設放在 repo 的 .cache/ 下, 可用環境變數 SR8_CACHE_DIR 改路徑
+CACHE_DIR = Path(os.environ.get('SR8_CACHE_DIR', Path(__file__).resolve().parent / '.cache'))
+CALENDAR_CACHE_DIR = CACHE_DIR / 'calendar'
+
+DateLike = Union[str, datetime, pd.Timestamp]
+
+def _to_date_str(date: DateLike) -> str:
+    return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+@lru_cache(maxsize=None)
+def _load_sessions(start_date: str, end_date: str) -> pd.DatetimeIndex:
+    # 檔名帶 mcal 版本, 升級後假日表有變動時自動重建
+    cache_path = CALENDAR_CACHE_DIR / f'{CALENDAR_NAME}_{start_date}_{end_date}_{mcal.__version__}.parquet'
+    if cache_path.exists():
+        return pd.DatetimeIndex(pd.read_parquet(cache_path)['session'].to_numpy())
+
+    sessions = mcal.get_calendar(CALENDAR_NAME).schedule(
+        start_date=start_date,
+        end_date=end_date
+        ).index
+    sessions = pd.DatetimeIndex(sessions.to_numpy())
+    try:
+        CALENDAR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        pd.DataFrame({'session': sessions}).to_parquet(tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # read-only checkout: keep the in-memory copy only
+    return sessions
+
+@lru_cache(maxsize=None)
+def _load_session_labels(start_date: str, end_date: str) -> pd.Index:
+    return _load_sessions(start_date, end_date).strftime('%Y-%m-%d')
+
+def get_sessions(start_date: DateLike, end_date: DateLike) -> pd.DatetimeIndex:
+    """XTAI sessions between start_date and end_date (inclusive), computed once per range."""
+    return _load_sessions(_to_date_str(start_date), _to_date_str(end_date))
+
+def get_session_labels(start_date: DateLike, end_date: DateLike) -> pd.Index:
+    """Same sessions as '%Y-%m-%d' strings, the day key of the daily store and stock lists."""
+    return _load_session_labels(_to_date_str(start_date), _to_date_str(end_date))
+
+def get_session_ids(
+        days: Union[pd.Index, np.ndarray, list],
+        start_date: DateLike,
+        end_date: DateLike
+        ) -> np.ndarray:
+    """Integer session id of each day: its position in get_sessions(start_date, end_date), -1 if not a session.
+
+    days may be Timestamps or '%Y-%m-%d' labels; callers index arrays with the ids
+    and get_sessions(...)[ids] gives the DatetimeIndex back.
+    """
+    sessions = get_sessions(start_date, end_date)
+    days = pd.DatetimeIndex(pd.to_datetime(days)).normalize()
+    # sessions 已排序, 一次 searchsorted 找位置, 再確認是否真的是交易日
+    ids = sessions.searchsorted(days)
+    found = ids < len(sessions)
+    found[found] = sessions[ids[found]] == days[found]
+    return np.where(found, ids, -1)